@@ -0,0 +1,347 @@
+'''Benchmarks of the storage and capture paths.
+
+The benchmarks run on any platform, as the clipboard is replaced by the
+in-memory backend, and the database is created in a temporary directory,
+so the history of the application is never touched.
+
+For each history size, the database is filled up to that many entries
+and then the following are measured for each payload size
+
+- write_throughput - entries written per second through database.writeMany
+- write_latency - the time of a single database.write, including its commit
+- read_latest_latency - the time of database.readLatest for the latest history_length entries
+- save_latency - the time clipboard.save takes on the monitoring task
+- capture_to_persist_latency - the time from the clipboard changing to the entry
+  being written to the database by the monitoring and writer tasks
+
+The results are printed, or written to a file, as JSON, so they can be
+compared between versions.
+
+    python benchmark.py --history 1000 100000 --payload 100 10000 --output before.json
+'''
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "vsClipboard"))
+
+import clipboard
+import config
+import database
+from backends import MemoryBackend
+from tasks import TaskLoop
+from writer import Writer
+
+from PySide.QtCore import QCoreApplication, QThread
+
+
+HISTORY_SIZES = [1000, 100000, 1000000]
+
+PAYLOAD_SIZES = [100, 10000, 1000000]
+
+FILL_BATCH = 10000
+
+SAMPLE_BYTES = 64 * 1024 * 1024
+
+
+def _entry(i, payloadSize):
+    '''Creates unique clipboard data of roughly the passed in size.
+
+    Args:
+        i: A number making the data unique
+        payloadSize: The size of the text (in bytes)
+
+    Returns:
+        A dictionary representing a clipboard history entry
+        dict
+    '''
+    text = ("entry %d " % i).ljust(payloadSize, "x")
+    return {
+        "text": text,
+        "unicode": unicode(text),
+        "html": None,
+        "hasFile": False
+    }
+
+
+def _percentiles(samples):
+    '''Summarizes timing samples.
+
+    Args:
+        samples: A list of durations (in seconds)
+
+    Returns:
+        A dictionary with the "p50", "p95", "max" and "mean" durations
+        (in milliseconds)
+        dict
+    '''
+    samples = sorted(samples)
+    at = lambda fraction: samples[min(len(samples) - 1, int(len(samples) * fraction))] * 1000
+    return {
+        "p50": at(.5),
+        "p95": at(.95),
+        "max": samples[-1] * 1000,
+        "mean": sum(samples) / len(samples) * 1000
+    }
+
+
+def _samples(maximum, payloadSize):
+    '''Returns how many samples to take, so large payloads do not take forever.
+
+    Args:
+        maximum: The number of samples to take of small payloads
+        payloadSize: The size of the payloads (in bytes)
+
+    Returns:
+        int
+    '''
+    return max(10, min(maximum, SAMPLE_BYTES // payloadSize))
+
+
+def fill(count, start):
+    '''Fills the history with small entries up to the passed in count.
+
+    Args:
+        count: The number of entries the history should have
+        start: The number of entries the history already has
+
+    Returns:
+        The number of entries in the history
+        int
+    '''
+    for first in xrange(start, count, FILL_BATCH):
+        database.writeMany([(_entry(i, 100), time.time()) for i in xrange(first, min(count, first + FILL_BATCH))])
+    return max(count, start)
+
+
+def benchWriteThroughput(payloadSize, unique):
+    '''Measures writing a batch of entries in a single transaction.
+
+    Args:
+        payloadSize: The size of the payloads (in bytes)
+        unique: The number to start making the payloads unique from
+
+    Returns:
+        The number of entries written per second
+        float
+    '''
+    count = _samples(1000, payloadSize)
+    entries = [(_entry(unique + i, payloadSize), time.time()) for i in xrange(count)]
+    start = time.time()
+    database.writeMany(entries)
+    return count / (time.time() - start)
+
+
+def benchWriteLatency(payloadSize, unique):
+    '''Measures writing single entries, each in its own transaction.
+
+    Args:
+        payloadSize: The size of the payloads (in bytes)
+        unique: The number to start making the payloads unique from
+
+    Returns:
+        The percentiles of the durations
+        dict
+    '''
+    samples = []
+    for i in xrange(_samples(100, payloadSize)):
+        data = _entry(unique + i, payloadSize)
+        start = time.time()
+        database.write(data)
+        samples.append(time.time() - start)
+    return _percentiles(samples)
+
+
+def benchReadLatest(count=200):
+    '''Measures reading the latest entries, as displayed by the Paste widget.
+
+    Args:
+        count: The number of samples to take (default: {200})
+
+    Returns:
+        The percentiles of the durations
+        dict
+    '''
+    length = config.current.history_length
+    samples = []
+    for _ in xrange(count):
+        start = time.time()
+        database.readLatest(length)
+        samples.append(time.time() - start)
+    return _percentiles(samples)
+
+
+def benchSave(payloadSize, unique):
+    '''Measures saving a new clipboard snapshot through the write-behind queue.
+
+    Args:
+        payloadSize: The size of the payloads (in bytes)
+        unique: The number to start making the payloads unique from
+
+    Returns:
+        The percentiles of the durations
+        dict
+    '''
+    backend = MemoryBackend()
+    tasks = TaskLoop()
+    writer = Writer(tasks)
+    clipboard.setBackend(backend)
+    clipboard.setWriter(writer)
+
+    taskThread = QThread()
+    taskThread.run = tasks.run
+    taskThread.start()
+
+    samples = []
+    for i in xrange(_samples(100, payloadSize)):
+        backend.copy(_entry(unique + i, payloadSize))
+        clipboardSnapshot = backend.snapshot()
+        start = time.time()
+        clipboard.save(clipboardSnapshot)
+        samples.append(time.time() - start)
+
+    tasks.stop()
+    taskThread.wait()
+    writer.close()
+    clipboard.setWriter(None)
+
+    return _percentiles(samples)
+
+
+def benchCaptureToPersist(payloadSize, unique):
+    '''Measures the time from a clipboard change until its entry is in the
+    database, with the monitoring and writer tasks running as in the
+    application.
+
+    Args:
+        payloadSize: The size of the payloads (in bytes)
+        unique: The number to start making the payloads unique from
+
+    Returns:
+        The percentiles of the durations
+        dict
+    '''
+    backend = MemoryBackend()
+    tasks = TaskLoop(clipboard.monitorClipboard)
+    writer = Writer(tasks)
+    clipboard.setBackend(backend)
+    clipboard.setWriter(writer)
+
+    taskThread = QThread()
+    taskThread.run = tasks.run
+    taskThread.start()
+
+    samples = []
+    for i in xrange(_samples(20, payloadSize)):
+        data = _entry(unique + i, payloadSize)
+        dataHash = database.hashData(data)
+
+        start = time.time()
+        backend.copy(data)
+        while database.entryId(dataHash) is None:
+            time.sleep(.001)
+        samples.append(time.time() - start)
+
+    tasks.stop()
+    taskThread.wait()
+    writer.close()
+    clipboard.setWriter(None)
+
+    return _percentiles(samples)
+
+
+def run(historySizes, payloadSizes):
+    '''Runs all benchmarks.
+
+    Args:
+        historySizes: The numbers of history entries to run the benchmarks at
+        payloadSizes: The sizes of the clipboard data (in bytes) to run the benchmarks with
+
+    Returns:
+        A list of dictionaries with the "benchmark", "history", "payload"
+        and the measured values
+        list
+    '''
+    results = []
+
+    def record(benchmark, historySize, payloadSize, value):
+        result = {"benchmark": benchmark, "history": historySize, "payload": payloadSize}
+        result.update(value if isinstance(value, dict) else {"value": value})
+        results.append(result)
+        sys.stderr.write("%s\n" % json.dumps(result, sort_keys=True))
+
+    # Every benchmark writes new entries, so they never collide with
+    # the ones used for filling the history
+    unique = [10 ** 9]
+
+    def nextUnique():
+        unique[0] += 10000
+        return unique[0]
+
+    filled = 0
+    for historySize in sorted(historySizes):
+        filled = fill(historySize, filled)
+
+        record("read_latest_latency", historySize, None, benchReadLatest())
+
+        for payloadSize in payloadSizes:
+            record("write_throughput", historySize, payloadSize, benchWriteThroughput(payloadSize, nextUnique()))
+            record("write_latency", historySize, payloadSize, benchWriteLatency(payloadSize, nextUnique()))
+            record("save_latency", historySize, payloadSize, benchSave(payloadSize, nextUnique()))
+            record("capture_to_persist_latency", historySize, payloadSize,
+                   benchCaptureToPersist(payloadSize, nextUnique()))
+
+    return results
+
+
+def main():
+    '''Parses the arguments, runs the benchmarks and outputs the results.
+    '''
+    parser = argparse.ArgumentParser(description="Benchmarks the vsClipboard storage and capture paths.")
+    parser.add_argument("--history", type=int, nargs="+", default=HISTORY_SIZES,
+                        help="the numbers of history entries to run the benchmarks at")
+    parser.add_argument("--payload", type=int, nargs="+", default=PAYLOAD_SIZES,
+                        help="the sizes of the clipboard data (in bytes)")
+    parser.add_argument("--output", help="the file to write the results to, instead of printing them")
+    args = parser.parse_args()
+
+    # The capture benchmark runs the monitoring task on a tasks.TaskLoop,
+    # whose timers and queued signals need an application instance
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+
+    # Everything happens in a temporary directory, as the database
+    # and the config are relative to the working directory
+    previous = os.getcwd()
+    directory = tempfile.mkdtemp(prefix="vsClipboard_benchmark_")
+    os.chdir(directory)
+    try:
+        config.reload()
+        results = run(args.history, args.payload)
+        database.closeConnection()
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    output = json.dumps({
+        "timestamp": time.time(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": results
+    }, indent=4, sort_keys=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print output
+
+
+if __name__ == "__main__":
+    main()
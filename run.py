@@ -1,5 +1,6 @@
 import vsClipboard
 import logging
+import sys
 
 
 doLog = False
@@ -9,7 +10,11 @@ if doLog:
 
     logging.info("Imported module. Starting...")
 
-vsClipboard.start()
+if "--daemon" in sys.argv:
+    vsClipboard.startDaemon()
+else:
+    vsClipboard.start(measureStartup="--startup-time" in sys.argv,
+                      frontend="--frontend" in sys.argv)
 
 if doLog:
     logging.info("Finished.")
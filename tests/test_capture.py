@@ -0,0 +1,125 @@
+'''Tests of capturing the clipboard into the history.
+
+The clipboard is a MemoryBackend and the database is in a temporary
+directory, so the tests run without Windows. The clipboard module needs
+PySide though, so the tests are skipped without it
+
+    python -m unittest discover tests
+'''
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vsClipboard"))
+
+import database
+from backends import MemoryBackend
+from cache import HistoryCache
+
+try:
+    import clipboard
+    import config
+except ImportError:
+    clipboard = None
+
+
+def textEntry(text):
+    '''Returns the clipboard data of the passed in text.
+    '''
+    return {"text": text.encode("utf-8"), "unicode": text, "html": None, "hasFile": False}
+
+
+@unittest.skipIf(clipboard is None, "capturing the clipboard needs PySide")
+class CaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        config.reload()
+
+        self.backend = MemoryBackend()
+        self.cache = HistoryCache()
+        clipboard.setBackend(self.backend)
+        clipboard.setCache(self.cache)
+
+    def tearDown(self):
+        clipboard.setCache(None)
+        database.closeConnection()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def setThreshold(self, kilobytes):
+        '''Sets the large_payload_threshold_kb config.
+        '''
+        config.save(dict(config.parse(), large_payload_threshold_kb=kilobytes))
+        config.reload()
+
+    def copy(self, text):
+        '''Copies the text in another application and saves it.
+        '''
+        self.backend.copy(textEntry(text))
+        clipboard.save()
+
+    def unicodes(self):
+        '''Returns the text of every entry in the history, newest first.
+        '''
+        return [entry["unicode"] for entry in database.readLatest(100)]
+
+    def testCopiedTextIsSaved(self):
+        self.copy(u"first")
+        self.copy(u"second")
+
+        self.assertEqual(self.unicodes(), [u"second", u"first"])
+        self.assertEqual([entry["unicode"] for entry in self.cache.snapshot().entries], [u"second", u"first"])
+
+    def testLatestEntryIsNotSavedAgain(self):
+        self.copy(u"same")
+        self.copy(u"same")
+
+        self.assertEqual(self.unicodes(), [u"same"])
+
+    def testCopyingAnOlderEntryMovesItToTheTop(self):
+        for text in (u"a", u"b", u"a"):
+            self.copy(text)
+
+        self.assertEqual(self.unicodes(), [u"a", u"b"])
+
+    def testSettingTheClipboardIsNotSaved(self):
+        monitor = clipboard.monitorClipboard()
+        self.backend.copy(textEntry(u"copied"))
+        next(monitor)
+
+        clipboard.set(database.readLatest(1)[0])
+        next(monitor)
+        monitor.close()
+
+        self.assertEqual(self.unicodes(), [u"copied"])
+        self.assertTrue(self.backend.isInternal())
+
+    def testLargeEntriesAreStoredExternally(self):
+        self.setThreshold(1)
+
+        self.copy(u"large " * 1000)
+        self.copy(u"small")
+
+        small, large = database.readLatest(2)
+        self.assertTrue(large["external"])
+        self.assertFalse(small["external"])
+        self.assertIsNone(self.cache.snapshot().entries[1]["unicode"])
+
+        clipboard.set(large)
+        self.assertEqual(self.backend.getData()["unicode"], u"large " * 1000)
+
+    def testZeroThresholdStoresEverythingInTheDatabase(self):
+        self.setThreshold(0)
+
+        self.copy(u"text")
+
+        self.assertFalse(database.readLatest(1)[0]["external"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,247 @@
+'''Tests of storing the clipboard history.
+
+Every test works on a database in a temporary directory, so the tests
+run without Windows or PySide
+
+    python -m unittest discover tests
+'''
+import cPickle
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vsClipboard"))
+
+import archive
+import database
+
+
+DAY = 24 * 60 * 60
+
+
+def textEntry(text):
+    '''Returns a clipboard history entry of the passed in text.
+    '''
+    return {"text": text.encode("utf-8"), "unicode": text, "html": None, "hasFile": False}
+
+
+class DatabaseTestCase(unittest.TestCase):
+    '''Runs every test in an empty temporary directory.
+    '''
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        database.closeConnection()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def unicodes(self):
+        '''Returns the text of every entry in the history, newest first.
+        '''
+        return [entry["unicode"] for entry in database.readLatest(100)]
+
+
+class SchemaTest(DatabaseTestCase):
+
+    def createLegacy(self, texts):
+        '''Creates a database of an older version, with an entries table of
+        pickled entries of the passed in texts, oldest first.
+        '''
+        connection = sqlite3.connect(database.DATABASE_FILE)
+        connection.execute("CREATE TABLE entries(id INTEGER PRIMARY KEY, data BLOB)")
+        for text in texts:
+            connection.execute("INSERT INTO entries(data) VALUES (?)",
+                               [sqlite3.Binary(cPickle.dumps(textEntry(text)))])
+        connection.commit()
+        connection.close()
+
+    def migrate(self, largePayloadBytes=None):
+        '''Migrates all legacy entries, a batch of 2 at a time.
+        '''
+        while database.migrateLegacy(2, largePayloadBytes):
+            pass
+
+    def testNewDatabaseUsesIncrementalVacuum(self):
+        database.write(textEntry(u"text"))
+
+        self.assertFalse(database.enableIncrementalVacuum())
+
+    def testLegacyEntriesKeepTheirIdsAndOrder(self):
+        self.createLegacy([u"first", u"second", u"third"])
+
+        self.migrate()
+        database.write(textEntry(u"new"))
+
+        self.assertEqual([(entry["id"], entry["unicode"]) for entry in database.readLatest(10)],
+                         [(4, u"new"), (3, u"third"), (2, u"second"), (1, u"first")])
+        self.assertEqual(database.migrateLegacy(), 0)
+
+    def testLargeLegacyEntriesAreStoredExternally(self):
+        self.createLegacy([u"small", u"x" * 2000])
+
+        self.migrate(1000)
+
+        large, small = database.readLatest(10)
+        self.assertTrue(large["external"])
+        self.assertIsNone(large["unicode"])
+        self.assertEqual(database.loadPayload(large)["unicode"], u"x" * 2000)
+        self.assertFalse(small["external"])
+
+
+class WriteTest(DatabaseTestCase):
+
+    def testWritingAgainMovesTheEntryToTheTop(self):
+        database.writeMany([(textEntry(text), time.time()) for text in (u"a", u"b", u"c")])
+
+        database.write(textEntry(u"a"))
+
+        self.assertEqual(self.unicodes(), [u"a", u"c", u"b"])
+        self.assertEqual(database.stats()["entries"], 3)
+
+    def testFailedWriteIsRolledBack(self):
+        database.write(textEntry(u"kept"))
+
+        with self.assertRaises(KeyError):
+            database.writeMany([(textEntry(u"first"), time.time()), ({"text": "invalid"}, time.time())])
+
+        self.assertEqual(self.unicodes(), [u"kept"])
+
+    def testExternalPayloadIsReadBackFromFiles(self):
+        data = dict(textEntry(u"large " * 1000), external=True)
+        database.write(data)
+
+        entry, = database.readLatest(1)
+        self.assertTrue(entry["external"])
+        self.assertIsNone(entry["text"])
+        self.assertTrue(entry["preview"].startswith(u"large large"))
+
+        loaded = database.loadPayload(entry)
+        self.assertEqual(loaded["unicode"], data["unicode"])
+        self.assertEqual(loaded["text"], data["text"])
+
+    def testPinnedEntriesAreReadSeparately(self):
+        database.writeMany([(textEntry(text), time.time()) for text in (u"a", u"b")])
+        entry = database.readLatest(10)[1]
+
+        database.pin(entry["hash"])
+        self.assertEqual([each["unicode"] for each in database.readPinned()], [u"a"])
+
+        database.unpin(entry["hash"])
+        self.assertEqual(database.readPinned(), [])
+
+
+class RetentionTest(DatabaseTestCase):
+
+    def setUp(self):
+        super(RetentionTest, self).setUp()
+        now = time.time()
+        database.writeMany([(textEntry(u"entry %d" % i), now - (10 - i) * DAY) for i in range(10)])
+
+    def expire(self, maxEntries=0, maxBytes=0, maxAge=0, funcDeleted=None):
+        '''Deletes all expired entries, a batch of 3 at a time.
+        '''
+        deleted = 0
+        while True:
+            count = database.deleteExpired(maxEntries, maxBytes, maxAge, 3, funcDeleted)
+            if not count:
+                return deleted
+            deleted += count
+
+    def testNoLimitsDeleteNothing(self):
+        self.assertEqual(self.expire(), 0)
+        self.assertEqual(len(self.unicodes()), 10)
+
+    def testEntryLimitKeepsTheNewest(self):
+        self.assertEqual(self.expire(maxEntries=4), 6)
+        self.assertEqual(self.unicodes(), [u"entry %d" % i for i in (9, 8, 7, 6)])
+
+    def testSizeLimitKeepsTheNewest(self):
+        # Every entry is 7 bytes of text and 7 of unicode
+        self.expire(maxBytes=14 * 3)
+        self.assertEqual(self.unicodes(), [u"entry %d" % i for i in (9, 8, 7)])
+
+    def testAgeLimitKeepsTheRecent(self):
+        self.expire(maxAge=3.5 * DAY)
+        self.assertEqual(self.unicodes(), [u"entry %d" % i for i in (9, 8, 7)])
+
+    def testPinnedEntriesAreKept(self):
+        pinned = database.readLatest(10)[-1]
+        database.pin(pinned["hash"])
+
+        self.expire(maxEntries=2)
+
+        self.assertEqual(self.unicodes(), [u"entry 9", u"entry 8", u"entry 0"])
+
+    def testDeletedHashesArePassedOn(self):
+        oldest = [entry["hash"] for entry in database.readLatest(10)[-2:]]
+        deleted = []
+
+        self.expire(maxEntries=8, funcDeleted=deleted.extend)
+
+        self.assertEqual(sorted(deleted), sorted(oldest))
+
+    def testExternalFilesAreDeletedWithTheirEntries(self):
+        database.writeMany([(dict(textEntry(u"large " * 1000), external=True), time.time() - 20 * DAY)])
+        self.assertTrue(os.listdir(database.PAYLOADS_DIR))
+
+        self.expire(maxAge=DAY)
+
+        self.assertEqual(os.listdir(database.PAYLOADS_DIR), [])
+        self.assertEqual(self.unicodes(), [])
+
+
+class ImportTest(DatabaseTestCase):
+
+    def importArchive(self, texts, created):
+        '''Imports an export of entries of the passed in texts, recorded one second apart.
+        '''
+        lines = [json.dumps({"format": "vsClipboard", "version": archive.FORMAT_VERSION})]
+        for i, text in enumerate(texts):
+            lines.append(json.dumps({"created": created + i, "text": text, "unicode": text}))
+        return archive.importHistory(io.BytesIO("\n".join(lines) + "\n"))
+
+    def testImportedOlderEntriesAreBelowNewerOnes(self):
+        now = time.time()
+        database.writeMany([(textEntry(u"new %d" % i), now + i) for i in range(2)])
+
+        count, added, _ = self.importArchive([u"old 0", u"old 1"], now - 400 * DAY)
+
+        self.assertEqual((count, added), (2, 2))
+        self.assertEqual(self.unicodes(), [u"new 1", u"new 0", u"old 1", u"old 0"])
+
+    def testImportSkipsEntriesInTheHistory(self):
+        database.write(textEntry(u"same"))
+
+        _, added, _ = self.importArchive([u"same", u"other"], time.time() - DAY)
+
+        self.assertEqual(added, 1)
+        self.assertEqual(self.unicodes(), [u"same", u"other"])
+
+    def testAgeLimitKeepsRecentEntriesAfterImport(self):
+        now = time.time()
+        database.writeMany([(textEntry(u"new %d" % i), now + i) for i in range(5)])
+        self.importArchive([u"old %d" % i for i in range(3)], now - 400 * DAY)
+
+        deleted = 0
+        while True:
+            count = database.deleteExpired(0, 0, 30 * DAY)
+            if not count:
+                break
+            deleted += count
+
+        self.assertEqual(deleted, 3)
+        self.assertEqual(self.unicodes(), [u"new %d" % i for i in reversed(range(5))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+'''Tests of detecting whether the paste hotkey is tapped or held.
+
+The state machine is driven by a FakeKeyState and a fake clock, so the
+tests run without Windows or PySide
+
+    python -m unittest discover tests
+'''
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vsClipboard"))
+
+from hold import FakeKeyState, HoldStateMachine
+
+
+CTRL = 0x11
+
+V = 0x56
+
+HOLD_TIME = .15
+
+
+class HoldStateMachineTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 0.
+        self.calls = []
+        self.keyState = FakeKeyState()
+        self.machine = HoldStateMachine(
+            (CTRL, V), self.keyState,
+            funcPress=lambda: self.calls.append("press"),
+            funcRelease=lambda: self.calls.append("release"),
+            funcTap=lambda: self.calls.append("tap"),
+            clock=lambda: self.now)
+
+    def advance(self, seconds):
+        '''Moves the fake clock forward and ticks the state machine.
+        '''
+        self.now += seconds
+        return self.machine.tick()
+
+    def testTapPastes(self):
+        self.keyState.press(CTRL, V)
+        self.assertTrue(self.machine.press(HOLD_TIME))
+
+        self.assertTrue(self.advance(.01))
+        self.assertEqual(self.machine.state, HoldStateMachine.HOLDING)
+
+        self.keyState.release(V)
+        self.assertFalse(self.advance(.01))
+
+        self.assertEqual(self.calls, ["tap"])
+        self.assertEqual(self.machine.state, HoldStateMachine.IDLE)
+
+    def testHoldShowsAndReleaseHides(self):
+        self.keyState.press(CTRL, V)
+        self.machine.press(HOLD_TIME)
+
+        self.advance(.1)
+        self.assertEqual(self.calls, [])
+
+        self.assertTrue(self.advance(.1))
+        self.assertEqual(self.calls, ["press"])
+        self.assertEqual(self.machine.state, HoldStateMachine.SHOWN)
+
+        # Staying shown while held, without pressing again
+        self.assertTrue(self.advance(1))
+        self.assertEqual(self.calls, ["press"])
+
+        self.keyState.release(CTRL, V)
+        self.assertFalse(self.advance(.01))
+
+        self.assertEqual(self.calls, ["press", "release"])
+        self.assertEqual(self.machine.state, HoldStateMachine.IDLE)
+
+    def testPressIgnoredWhileActive(self):
+        self.keyState.press(CTRL, V)
+        self.machine.press(HOLD_TIME)
+        self.advance(.1)
+
+        # A repeated WM_HOTKEY does not restart the hold time
+        self.assertTrue(self.machine.press(HOLD_TIME))
+        self.advance(.1)
+
+        self.assertEqual(self.calls, ["press"])
+
+    def testPressIgnoredWithoutKeysDown(self):
+        self.keyState.press(CTRL)
+
+        self.assertFalse(self.machine.press(HOLD_TIME))
+        self.assertFalse(self.machine.tick())
+        self.assertEqual(self.calls, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,139 @@
+'''Tests of writing the clipboard history in the background.
+
+The flush task is stepped by hand instead of on a tasks.TaskLoop, so the
+tests run without Windows or PySide
+
+    python -m unittest discover tests
+'''
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "vsClipboard"))
+
+import database
+import writer
+
+
+def textEntry(text):
+    '''Returns a clipboard history entry of the passed in text.
+    '''
+    return {"text": text.encode("utf-8"), "unicode": text, "html": None, "hasFile": False}
+
+
+class FakeTasks(object):
+    '''Collects the spawned tasks instead of running them.
+    '''
+
+    def __init__(self):
+        self.spawned = []
+
+    def spawn(self, factory):
+        self.spawned.append(factory)
+
+
+class WriterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+
+        self.tasks = FakeTasks()
+        self.writer = writer.Writer(self.tasks, batchSize=2)
+
+        self.writeMany = database.writeMany
+        self.failures = 0
+
+        # The failed writes are logged with their tracebacks
+        logging.disable(logging.CRITICAL)
+
+    def tearDown(self):
+        logging.disable(logging.NOTSET)
+        database.writeMany = self.writeMany
+        database.closeConnection()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def failWrites(self, count):
+        '''Makes the next count writes to the database fail.
+        '''
+        self.failures = count
+
+        def writeMany(entries):
+            if self.failures:
+                self.failures -= 1
+                raise IOError("disk I/O error")
+            self.writeMany(entries)
+
+        database.writeMany = writeMany
+
+    def put(self, *texts):
+        for text in texts:
+            self.writer.put(textEntry(text))
+
+    def unicodes(self):
+        '''Returns the text of every entry in the history, newest first.
+        '''
+        return [entry["unicode"] for entry in database.readLatest(100)]
+
+    def testPutSpawnsASingleFlush(self):
+        self.put(u"a", u"b", u"c")
+
+        self.assertEqual(len(self.tasks.spawned), 1)
+
+        delays = list(self.tasks.spawned[0]())
+
+        # A batch of 2 and a batch of 1, letting the other tasks run in between
+        self.assertEqual(delays, [0, 0])
+        self.assertEqual(self.unicodes(), [u"c", u"b", u"a"])
+        self.assertEqual(self.writer.stats()["flushed"], 3)
+
+        # Once the queue is empty, putting spawns a new flush
+        self.put(u"d")
+        self.assertEqual(len(self.tasks.spawned), 2)
+
+    def testFailedWritesAreRetried(self):
+        self.failWrites(2)
+        self.put(u"a")
+
+        delays = list(self.tasks.spawned[0]())
+
+        self.assertEqual(delays, [writer.RETRY_DELAY, writer.RETRY_DELAY * 2, 0])
+        self.assertEqual(self.unicodes(), [u"a"])
+        self.assertEqual(self.writer.stats()["failed"], 0)
+
+    def testWritesAreGivenUpOn(self):
+        self.failWrites(writer.MAX_ATTEMPTS)
+        self.put(u"a", u"b")
+
+        list(self.tasks.spawned[0]())
+
+        self.assertEqual(self.unicodes(), [])
+        self.assertEqual(self.writer.stats()["failed"], 2)
+
+        # The writer keeps going with the next entries
+        self.put(u"c")
+        list(self.tasks.spawned[1]())
+        self.assertEqual(self.unicodes(), [u"c"])
+
+    def testCloseWritesWhatIsLeft(self):
+        self.failWrites(1)
+        self.put(u"a", u"b", u"c")
+
+        # The flush is cancelled while waiting to retry its first batch
+        flush = self.tasks.spawned[0]()
+        self.assertEqual(next(flush), writer.RETRY_DELAY)
+        flush.close()
+
+        self.writer.close()
+
+        self.assertEqual(self.unicodes(), [u"c", u"b", u"a"])
+        self.assertEqual(self.writer.stats()["pending"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
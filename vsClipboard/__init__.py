@@ -1 +1,26 @@
-from app import start
\ No newline at end of file
+import tracing
+
+
+def start(measureStartup=False, frontend=False):
+    '''Starts the application.
+
+    The app module, and with it PySide and the UI, is only imported here,
+    so the time spent importing them counts towards the startup.
+
+    Args:
+        measureStartup: Whether to exit as soon as the clipboard is being
+        captured and print how long that took (default: {False})
+        frontend: Whether to leave capturing the clipboard to the daemon,
+        starting it if it is not running (default: {False})
+    '''
+    tracing.mark("startup")
+
+    import app
+    app.start(measureStartup, frontend)
+
+
+def startDaemon():
+    '''Runs the headless daemon capturing the clipboard, until a client asks it to quit.
+    '''
+    import daemon
+    daemon.run()
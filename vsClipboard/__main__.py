@@ -0,0 +1,325 @@
+'''The command line of vsClipboard.
+
+Reads the clipboard history straight from the database, without the ui
+and without importing PySide, so it can be used from scripts, shells and
+editors, even while the application is running
+
+    python -m vsClipboard list -n 20
+    python -m vsClipboard search "def start"
+    python -m vsClipboard show 1234
+    python -m vsClipboard copy 1234
+    python -m vsClipboard stats
+    python -m vsClipboard export history.jsonl.gz
+    python -m vsClipboard import history.jsonl.gz
+    python -m vsClipboard vacuum
+
+The entries are written out as they are read from the database, so even
+listing the whole history runs in constant memory. Passing --json writes
+a JSON object per line instead of the text.
+
+Exporting and importing write and read the history a batch at a time,
+see the archive module, reporting their progress and throughput on the
+standard error.
+
+The history is read from the current directory, or the one passed with
+--directory, the same one the application runs in.
+'''
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+from vsClipboard import archive, database
+
+
+def _write(text):
+    '''Writes a line to the standard output as utf-8.
+
+    Args:
+        text: The line, without the line break
+    '''
+    if isinstance(text, unicode):
+        text = text.encode("utf-8")
+    sys.stdout.write(text + "\n")
+
+
+def _summary(entry):
+    '''Returns the metadata of an entry, as written by --json.
+
+    Args:
+        entry: A clipboard history entry
+
+    Returns:
+        dict
+    '''
+    return dict((key, entry[key]) for key in
+                ("id", "hash", "preview", "lines", "chars", "hasFile", "hasImage", "external"))
+
+
+def _writeEntries(entries, asJson):
+    '''Writes a line per entry, with its id and preview.
+
+    Args:
+        entries: An iterable of clipboard history entries
+        asJson: Whether to write the metadata of the entries as JSON
+    '''
+    for entry in entries:
+        if asJson:
+            _write(json.dumps(_summary(entry), sort_keys=True))
+        else:
+            _write(u"%d\t%s" % (entry["id"], (entry["preview"] or u"").replace(u"\n", u" ")))
+
+
+def _text(entry):
+    '''Returns the full text of an entry.
+
+    Args:
+        entry: A clipboard history entry with its data loaded
+
+    Returns:
+        The text, or the files one per line for file entries
+        unicode
+    '''
+    if entry["hasFile"]:
+        return u"\n".join(entry["text"] or ())
+    if entry["unicode"] is not None:
+        return entry["unicode"]
+    return (entry["text"] or entry["html"] or "").decode("utf-8", "replace")
+
+
+def _loadEntry(entryId):
+    '''Reads an entry with its data, exiting if it can not be read.
+
+    Args:
+        entryId: The id of the entry
+
+    Returns:
+        dict
+    '''
+    entry = database.readEntry(entryId)
+    if entry is None:
+        sys.exit("There is no entry with the id %d" % entryId)
+
+    loaded = database.loadPayload(entry)
+    if loaded is None:
+        sys.exit("The data of the entry %d is missing" % entryId)
+    return loaded
+
+
+def listEntries(args):
+    '''Writes the latest entries, newest first.
+    '''
+    entries = database.iterLatest()
+    try:
+        _writeEntries(itertools.islice(entries, args.count) if args.count else entries, args.json)
+    finally:
+        entries.close()
+
+
+def searchEntries(args):
+    '''Writes the entries containing all words of the text, newest first.
+    '''
+    _writeEntries(database.search(args.text.decode(sys.getfilesystemencoding()), args.count), args.json)
+
+
+def showEntry(args):
+    '''Writes the full text of an entry.
+    '''
+    entry = _loadEntry(args.id)
+    if args.json:
+        _write(json.dumps(dict(_summary(entry), text=_text(entry)), sort_keys=True))
+    else:
+        _write(_text(entry))
+
+
+def copyEntry(args):
+    '''Sets the clipboard to an entry.
+
+    This is the only command which needs the Windows clipboard backend,
+    so it is only imported by main for this command.
+    '''
+    entry = _loadEntry(args.id)
+
+    args.backend().set(entry)
+
+
+def showStats(args):
+    '''Writes the statistics of the history.
+    '''
+    stats = database.stats()
+    if args.json:
+        _write(json.dumps(stats, sort_keys=True))
+        return
+
+    formatTime = lambda timestamp: time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(timestamp)) \
+        if timestamp is not None else "-"
+
+    _write("entries         %d" % stats["entries"])
+    _write("images          %d" % stats["image"])
+    _write("stored in files %d" % stats["external"])
+    _write("pinned          %d" % stats["pinned"])
+    _write("data size       %.1f MB" % (stats["size"] / 1024. / 1024))
+    _write("database size   %.1f MB" % (stats["databaseBytes"] / 1024. / 1024))
+    _write("oldest          %s" % formatTime(stats["oldest"]))
+    _write("newest          %s" % formatTime(stats["newest"]))
+
+
+class _Progress(object):
+    '''Reports the progress and throughput of exporting or importing.
+    '''
+
+    def __init__(self, action):
+        '''Starts timing.
+
+        Args:
+            action: What is being done, e.g. "Exported"
+        '''
+        self.action = action
+        self.start = time.time()
+
+    def _line(self, count, size):
+        '''Returns the number of entries and bytes with their rate.
+        '''
+        elapsed = max(time.time() - self.start, 1e-6)
+        return "%s %d entries, %.1f MB in %.1fs (%d entries/s, %.1f MB/s)" % (
+            self.action, count, size / 1024. / 1024, elapsed, count / elapsed, size / 1024. / 1024 / elapsed)
+
+    def __call__(self, count, size):
+        '''Writes the progress so far, over the previous one.
+        '''
+        sys.stderr.write("\r" + self._line(count, size))
+        sys.stderr.flush()
+
+    def finish(self, count, size, note=""):
+        '''Writes the final progress.
+        '''
+        sys.stderr.write("\r" + self._line(count, size) + note + "\n")
+
+
+def exportHistory(args):
+    '''Writes the whole history to a file.
+    '''
+    progress = _Progress("Exported")
+    with archive.openFile(args.file, "wb") as f:
+        count, size = archive.exportHistory(f, args.batch_size, progress)
+    progress.finish(count, size)
+
+
+def importHistory(args):
+    '''Adds the entries of an export to the history.
+    '''
+    if not os.path.exists(args.file):
+        sys.exit("There is no file %s" % args.file)
+
+    largePayloadBytes = args.large_payload_kb * 1024 if args.large_payload_kb else None
+
+    progress = _Progress("Imported")
+    try:
+        with archive.openFile(args.file, "rb") as f:
+            count, added, size = archive.importHistory(f, largePayloadBytes, args.batch_size, progress)
+    except archive.ArchiveError as e:
+        sys.exit("Could not import %s: %s" % (args.file, e))
+    progress.finish(count, size, ", %d new" % added)
+
+
+def vacuumHistory(args):
+    '''Switches the database to incremental auto vacuum.
+    '''
+    before = os.path.getsize(database.DATABASE_FILE)
+    if not database.enableIncrementalVacuum():
+        _write("The database already uses incremental auto vacuum")
+        return
+    _write("Vacuumed the database from %.1f MB to %.1f MB" % (
+        before / 1024. / 1024, os.path.getsize(database.DATABASE_FILE) / 1024. / 1024))
+
+
+def main(argv=None):
+    '''Parses the arguments and runs the command.
+
+    Args:
+        argv: The arguments, without the program name (default: {None})
+    '''
+    parser = argparse.ArgumentParser(prog="python -m vsClipboard",
+                                     description="Reads the vsClipboard clipboard history.")
+    parser.add_argument("-C", "--directory", default=".",
+                        help="the directory the application runs in (default: the current one)")
+    commands = parser.add_subparsers()
+
+    command = commands.add_parser("list", help="list the latest entries")
+    command.add_argument("-n", "--count", type=int, default=10,
+                         help="the number of entries, 0 for all (default: 10)")
+    command.add_argument("--json", action="store_true", help="write a JSON object per entry")
+    command.set_defaults(func=listEntries)
+
+    command = commands.add_parser("search", help="search the entries")
+    command.add_argument("text", help="the words the entries need to contain")
+    command.add_argument("-n", "--count", type=int, default=10,
+                         help="the maximum number of entries (default: 10)")
+    command.add_argument("--json", action="store_true", help="write a JSON object per entry")
+    command.set_defaults(func=searchEntries)
+
+    command = commands.add_parser("show", help="write the full text of an entry")
+    command.add_argument("id", type=int, help="the id of the entry")
+    command.add_argument("--json", action="store_true", help="write the entry as a JSON object")
+    command.set_defaults(func=showEntry)
+
+    command = commands.add_parser("copy", help="set the clipboard to an entry")
+    command.add_argument("id", type=int, help="the id of the entry")
+    command.set_defaults(func=copyEntry)
+
+    command = commands.add_parser("stats", help="write the statistics of the history")
+    command.add_argument("--json", action="store_true", help="write the statistics as a JSON object")
+    command.set_defaults(func=showStats)
+
+    command = commands.add_parser("export", help="write the whole history to a file")
+    command.add_argument("file", help="the file to write, compressed if it ends in .gz")
+    command.add_argument("--batch-size", type=int, default=archive.BATCH_SIZE,
+                         help="the number of entries read at a time (default: %d)" % archive.BATCH_SIZE)
+    command.set_defaults(func=exportHistory)
+
+    command = commands.add_parser("import", help="add the entries of an exported file to the history")
+    command.add_argument("file", help="the file to read, compressed if it ends in .gz")
+    command.add_argument("--batch-size", type=int, default=archive.BATCH_SIZE,
+                         help="the number of entries added at a time (default: %d)" % archive.BATCH_SIZE)
+    command.add_argument("--large-payload-kb", type=float, default=256,
+                         help="the size above which entries are stored outside of the database, "
+                              "0 to store all in it (default: 256)")
+    command.set_defaults(func=importHistory)
+
+    command = commands.add_parser("vacuum", help="rewrite the database, so the retention limits can shrink it, "
+                                                 "best run while the application is closed")
+    command.set_defaults(func=vacuumHistory)
+
+    args = parser.parse_args(argv)
+
+    # The files are relative to where the command is run from, not to the
+    # directory of the history
+    if getattr(args, "file", None):
+        args.file = os.path.abspath(args.file)
+
+    # The package may have been imported through a relative path, so the
+    # backend is imported before changing the directory
+    if args.func is copyEntry:
+        from vsClipboard.backends.windows import WindowsBackend
+        args.backend = WindowsBackend
+
+    if not os.path.isdir(args.directory):
+        parser.error("There is no directory %s" % args.directory)
+    os.chdir(args.directory)
+    if args.func is not importHistory and not os.path.exists(database.DATABASE_FILE):
+        sys.exit("There is no clipboard history in %s" % os.path.abspath(args.directory))
+
+    try:
+        args.func(args)
+    except IOError as e:
+        # e.g. the output is piped to head, which exits early
+        if e.errno != 32:
+            raise
+    finally:
+        database.closeConnection()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,21 +2,32 @@
 
 All the modules are tied into the UI in the start function.
 
-We are spawning 2 threads
+We are spawning 5 threads
 
-- one to monitor the clipboard
+- one running the task of monitoring the clipboard
+- one running the task of enforcing the history retention policies
+- one to write the clipboard history to the database
 - one to listen for paste events and handle them
+- one to search the clipboard history
+
+When running as the front end of the daemon, the clipboard is
+captured by the daemon process instead, so only the paste thread
+and a thread sending the searches to the daemon are spawned.
 
 Additionally, a functionality of saving and reloading the
-preferences while running is set up.
+preferences while running is set up. The config file is watched,
+so editing it applies the changes as well.
 
 Once the application exits, we make sure the threads are
 terminated fully.
 '''
 from ui import Main, Paste
 import hotkey
-import clipboard
 import config
+import daemon
+import tracing
+from capture import Capture
+from history import LocalHistory
 
 from PySide.QtGui import *
 from PySide.QtCore import *
@@ -24,18 +35,37 @@ from functools import partial
 import win32api
 import win32con
 import win32gui
+import ctypes
 import sys
+import time
 
 
-def start():
+def start(measureStartup=False, frontend=False):
     '''Creates and runs the application
 
     This function initializes a QApplication instance, sets up
     the threads needed for it to operate and runs them untill
     an application exit is registered, when all the processes
     are terminated.
+
+    The threads capturing the clipboard are started first, while
+    the Paste widget and the threads which only matter once
+    Ctrl + V is pressed are created once the event loop is idle,
+    so the clipboard is captured as soon as possible after login.
+
+    Args:
+        measureStartup: Whether to exit as soon as the clipboard is
+        being captured and print how long that took (default: {False})
+        frontend: Whether to leave capturing the clipboard to the
+        daemon, starting it if it is not running (default: {False})
     '''
-    parsedConfig = config.parse()
+    # Letting windows know that this is an application
+    # on it's own, instead of just pythonw.exe
+    # source - https://stackoverflow.com/questions/1551605/how-to-set-applications-taskbar-icon-in-windows-7
+    myappid = u'vsClipboard.v_0_1'
+    ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+
+    parsedConfig = config.reload()
 
     # Create the application
     app = QApplication(sys.argv)
@@ -44,66 +74,117 @@ def start():
     app.setQuitOnLastWindowClosed(False)
     app.setWindowIcon(QIcon("icon.png"))
 
-    # Create all pieces of the UI
-    mainUI = Main(parsedConfig)
-    pasteUI = Paste(parsedConfig)
-
-    QApplication.instance().installEventFilter(pasteUI)
-
-    mainUI.show()
+    # The stylesheet is read and parsed once for all windows
+    with open("vsClipboard/ui/styles.css", "r") as f:
+        app.setStyleSheet(f.read())
 
     ######################
-    # Register the custom clipboard format used for recognizing
-    # internal clipboard changes
-    clipboard.registerCustomClipboardFormat()
+    # Start capturing the clipboard, either in this process
+    # or in the daemon.
+    #
+    # Capturing happens on the task thread, while the retention
+    # task and the search thread are started once the event loop
+    # is idle. See the capture module.
+    #
+    # As the front end, the searches are sent to the daemon
+    # from a search thread of our own. If the daemon is not
+    # running, it is started without waiting for it, and the
+    # history is empty until it is up
+    if frontend:
+        capture = None
+        history = daemon.connect(wait=False)
+        searcher = daemon.RemoteSearcher(history)
+
+        searchThread = QThread()
+        searchThread.run = searcher.run
+
+        tracing.sinceMark("startup", "startup")
+    else:
+        capture = Capture()
+        capture.start()
+        history = LocalHistory(capture.cache)
+        searcher = capture.searcher
 
     ######################
     # Defining the functions that are being ran on pressing
     # and releasing the hotkey combination
 
     def pastePress():
-        t = QThread.currentThread()
-        getattr(t, "showPaste").emit(clipboard.getHistory())
-        setattr(t, "foregroundWindow", win32gui.GetForegroundWindow())
+        with tracing.span("paste_press"):
+            t = QThread.currentThread()
+            tracing.mark("showPaste")
+            getattr(t, "showPaste").emit(history.snapshot())
+            setattr(t, "foregroundWindow", win32gui.GetForegroundWindow())
 
     def pasteRelease():
-        t = QThread.currentThread()
-        getattr(t, "hidePaste").emit()
-        win32gui.SetForegroundWindow(getattr(t, "foregroundWindow"))
-        hotkey.sendPasteMessage()
+        with tracing.span("paste_release"):
+            t = QThread.currentThread()
+            getattr(t, "hidePaste").emit()
+            win32gui.SetForegroundWindow(getattr(t, "foregroundWindow"))
+            hotkey.sendPasteMessage()
 
     ######################
-    # Create the two threads we need:
-    #   1 - Monitoring thread
-    #       Polls the clipboard for changes
-    #   2 - Paste thread
-    #       Listens for the Ctrl + V hotkey and handles the
-    #       paste mechanism.
-    clipboardMonitorThread = QThread()
-    clipboardMonitorThread.run = clipboard.monitorClipboard
-    clipboardMonitorThread.config = parsedConfig
-    clipboardMonitorThread.start()
-
+    # The paste thread listens for the Ctrl + V hotkey and
+    # handles the paste mechanism
     pasteThread = QThread()
     pasteThread.run = partial(hotkey.listenForPaste, pastePress, pasteRelease)
-    pasteThread.showPaste = pasteUI.showPaste
-    pasteThread.hidePaste = pasteUI.hidePaste
-    pasteThread.config = parsedConfig
-    pasteThread.start()
+
+    # Create the preferences window, which is shown on start
+    mainUI = Main(parsedConfig)
+    mainUI.show()
+
+    # The Paste widget is created, and the rest of the threads are
+    # started, once the event loop is idle
+    lazy = {}
+
+    def createPaste():
+        pasteUI = Paste(config.current, searcher, history)
+        QApplication.instance().installEventFilter(pasteUI)
+        lazy["pasteUI"] = pasteUI
+
+        pasteThread.showPaste = pasteUI.showPaste
+        pasteThread.hidePaste = pasteUI.hidePaste
+        pasteThread.start()
+
+        if capture is not None:
+            capture.startBackground()
+        else:
+            searchThread.start()
+
+    QTimer.singleShot(0, createPaste)
 
     #######################
-    # Handle updating the preferences in all threads, so
-    # changes can be reflected on pressing the "Save"
-    # (preferences) button
+    # Handle updating the preferences, so changes can be reflected
+    # on pressing the "Save" (preferences) button or editing the
+    # config file. The threads read config.current, so only the
+    # widgets need to know about the change
+
+    def updateConfig(snapshot):
+        mainUI.showConfig(snapshot)
+        if "pasteUI" in lazy:
+            lazy["pasteUI"].initConfig(snapshot)
 
-    def updateConfig():
-        parsedConfig = config.parse()
-        pasteUI.initConfig(parsedConfig)
-        clipboardMonitorThread.config = parsedConfig
-        pasteThread.config = parsedConfig
+    configWatcher = config.ConfigWatcher()
+    configWatcher.changed.connect(updateConfig)
 
-    # Connect the update function to the update signal
-    mainUI.updatePreferences.connect(updateConfig)
+    # Saving the preferences reloads the config straight away,
+    # instead of waiting for the file system notification
+    mainUI.updatePreferences.connect(configWatcher.check)
+
+    #######################
+    # When measuring the startup, exit once the monitoring task
+    # has polled the clipboard for the first time
+
+    def reportStartup():
+        startup = tracing.summary().get("startup")
+        if startup is not None:
+            print "Capturing clipboard %.0f ms after starting" % startup["max"]
+            app.quit()
+
+    if measureStartup:
+        startupTimer = QTimer()
+        startupTimer.timeout.connect(reportStartup)
+        startupTimer.start(10)
 
     #########################
     # Run the app
@@ -111,19 +192,24 @@ def start():
 
     # Once we exit we need to take care of the threads
     #
-    # Set do_run to false as it's being checked against
-    # in the while loop, so it causes it to break
-    clipboardMonitorThread.do_run = False
-
     # Send the WM_QUIT message to the paste thread which
     # is being listened for in the while loop and it's
-    # causing it to break
-    win32api.PostThreadMessage(getattr(pasteThread, "threadId"), win32con.WM_QUIT, 0, 0)
+    # causing it to break. If the app exits right after the
+    # paste thread is started, wait for it to register the hotkey
+    if pasteThread.isRunning():
+        while not hasattr(pasteThread, "threadId"):
+            time.sleep(.01)
+        win32api.PostThreadMessage(getattr(pasteThread, "threadId"), win32con.WM_QUIT, 0, 0)
 
     # Join the threads in the main one to make sure they
     # are completely terminated
-    clipboardMonitorThread.wait()
     pasteThread.wait()
 
+    if capture is not None:
+        capture.stop()
+    else:
+        searcher.stop()
+        searchThread.wait()
+
     # Exit
     sys.exit()
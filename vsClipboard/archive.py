@@ -0,0 +1,291 @@
+'''Exporting and importing the clipboard history.
+
+The history is exported as a line-delimited JSON file, a JSON object per
+line, which can be read without knowing anything about the database or
+about Python, unlike copying clipboard_database itself. Files ending in
+.gz are compressed with gzip.
+
+The first line is a header with the format and its version, followed by
+an entry per line, oldest first
+
+    {"format": "vsClipboard", "version": 1}
+    {"created": 1700000000.0, "unicode": "some text", "preview": "some text", ...}
+    {"created": 1700000001.0, "files": ["C:\\\\some\\\\file.txt"], ...}
+
+The "text" and "html" data are stored as strings if they are valid utf-8,
+and base64 encoded in the "text_base64" and "html_base64" keys otherwise.
+The list of files of file entries is stored in the "files" key. Images
+are file entries of the images in the clipboard_images directory, which
+is not part of the export.
+
+Both exporting and importing work a batch of entries at a time, so the
+memory used does not depend on the size of the history. Importing skips
+the entries which are already in the history, and if the imported entries
+are older than the newest ones in it, the history is renumbered in the
+order the entries were recorded.
+
+Attributes:
+    FORMAT_VERSION: The version of the export format
+    BATCH_SIZE: The default number of entries read or written at a time
+'''
+import base64
+import gzip
+import io
+import itertools
+import json
+import os
+
+import database
+from cache import entrySize
+
+
+FORMAT_VERSION = 1
+
+BATCH_SIZE = 1000
+
+_HEADER = {"format": "vsClipboard", "version": FORMAT_VERSION}
+
+
+class ArchiveError(Exception):
+    '''Raised when a file is not a valid export of the clipboard history.
+    '''
+
+
+def openFile(path, mode):
+    '''Opens an export file, compressed with gzip if it ends in .gz.
+
+    Args:
+        path: The path of the file
+        mode: "rb" or "wb"
+
+    Returns:
+        file
+    '''
+    if path.endswith(".gz"):
+        return io.BufferedReader(gzip.open(path, mode)) if mode == "rb" else gzip.open(path, mode)
+    return open(path, mode)
+
+
+def _putBytes(record, key, data):
+    '''Stores bytes data in a record, as a string if it is valid utf-8 or
+    base64 encoded otherwise.
+
+    Args:
+        record: The record to store the data in
+        key: The key of the data
+        data: The data
+    '''
+    if data is None:
+        return
+
+    try:
+        record[key] = data.decode("utf-8")
+    except UnicodeDecodeError:
+        record[key + "_base64"] = base64.b64encode(data)
+
+
+def _getBytes(record, key):
+    '''Returns bytes data stored in a record by _putBytes.
+
+    Args:
+        record: The record
+        key: The key of the data
+
+    Returns:
+        The data or None if it is not in the record
+        str
+    '''
+    if key + "_base64" in record:
+        return base64.b64decode(record[key + "_base64"])
+    if record.get(key) is not None:
+        return record[key].encode("utf-8")
+    return None
+
+
+def toRecord(entry, created):
+    '''Converts a clipboard history entry to the object written to the export.
+
+    Args:
+        entry: A clipboard history entry with its data loaded
+        created: The unix timestamp of when the entry was recorded
+
+    Returns:
+        dict
+    '''
+    record = {
+        "created": created,
+        "preview": entry["preview"],
+        "lines": entry["lines"],
+        "chars": entry["chars"]
+    }
+
+    if entry["hasFile"]:
+        record["files"] = list(entry["text"] or ())
+        if entry["hasImage"]:
+            record["hasImage"] = True
+    else:
+        _putBytes(record, "text", entry["text"])
+    if entry["unicode"] is not None:
+        record["unicode"] = entry["unicode"]
+    _putBytes(record, "html", entry["html"])
+
+    return record
+
+
+def fromRecord(record, largePayloadBytes=None):
+    '''Converts an object read from an export back to a clipboard history entry.
+
+    Args:
+        record: The object read from the export
+        largePayloadBytes: The size above which the data is stored outside
+        of the database, or None to always store it in it (default: {None})
+
+    Returns:
+        A tuple of the clipboard history entry and the unix timestamp of
+        when it was recorded
+        tuple
+    '''
+    hasFile = "files" in record
+    data = {
+        "text": tuple(record["files"]) if hasFile else _getBytes(record, "text"),
+        "unicode": record.get("unicode"),
+        "html": _getBytes(record, "html"),
+        "hasFile": hasFile
+    }
+
+    if record.get("hasImage"):
+        data["hasImage"] = True
+        if data["text"] and os.path.exists(data["text"][0]):
+            data["imageBytes"] = os.path.getsize(data["text"][0])
+
+    # Without a preview, database.write creates one
+    if record.get("preview") is not None:
+        data.update(preview=record["preview"], lines=record["lines"], chars=record["chars"])
+
+    data["external"] = largePayloadBytes is not None and entrySize(data) > largePayloadBytes
+
+    return data, record["created"]
+
+
+def _batches(iterable, batchSize):
+    '''Splits an iterable into lists.
+
+    Args:
+        iterable: The iterable to split
+        batchSize: The maximum length of the lists
+
+    Yields:
+        list
+    '''
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, batchSize))
+        if not batch:
+            return
+        yield batch
+
+
+def exportHistory(f, batchSize=BATCH_SIZE, funcProgress=None):
+    '''Writes the whole history to a file, oldest first.
+
+    The data of payloads stored in files is read one entry at a time, as
+    it is written.
+
+    Args:
+        f: The file to write to, opened in binary mode
+        batchSize: The number of entries read from the database at a time (default: {BATCH_SIZE})
+        funcProgress: A callable to execute with the number of entries and bytes
+        written so far after every batch (default: {None})
+
+    Returns:
+        A tuple of the number of written entries and bytes
+        tuple
+    '''
+    written = json.dumps(_HEADER) + "\n"
+    f.write(written)
+
+    count = 0
+    size = len(written)
+    for batch in database.iterHistory(batchSize):
+        for entry, created in batch:
+            loaded = database.loadPayload(entry)
+            if loaded is None:
+                continue
+
+            line = json.dumps(toRecord(loaded, created), separators=(",", ":")) + "\n"
+            f.write(line)
+
+            count += 1
+            size += len(line)
+
+        if funcProgress is not None:
+            funcProgress(count, size)
+
+    return count, size
+
+
+def importHistory(f, largePayloadBytes=None, batchSize=BATCH_SIZE, funcProgress=None):
+    '''Adds the entries of an export to the history.
+
+    Every batch of entries is added in a transaction of its own, skipping
+    the entries which are already in the history. Once all entries are
+    added, the history is sorted by when the entries were recorded, if
+    any of them is older than the newest entry before importing.
+
+    Args:
+        f: The file to read from, opened in binary mode
+        largePayloadBytes: The size above which the data is stored outside
+        of the database, or None to always store it in it (default: {None})
+        batchSize: The number of entries added at a time (default: {BATCH_SIZE})
+        funcProgress: A callable to execute with the number of entries and bytes
+        read so far after every batch (default: {None})
+
+    Returns:
+        A tuple of the number of read entries, added entries and read bytes
+        tuple
+
+    Raises:
+        ArchiveError: If the file is not an export or is of a newer version
+    '''
+    header = f.readline()
+    try:
+        header = json.loads(header)
+    except ValueError:
+        header = None
+
+    if not isinstance(header, dict) or header.get("format") != _HEADER["format"]:
+        raise ArchiveError("Not a vsClipboard export")
+    if header.get("version") > FORMAT_VERSION:
+        raise ArchiveError("Unsupported export version %s" % header.get("version"))
+
+    newest = database.newestCreated()
+    oldest = None
+
+    count = 0
+    added = 0
+    size = 0
+    for lines in _batches(f, batchSize):
+        entries = []
+        for line in lines:
+            size += len(line)
+            if not line.strip():
+                continue
+
+            try:
+                entries.append(fromRecord(json.loads(line), largePayloadBytes))
+            except (ValueError, KeyError, TypeError) as e:
+                raise ArchiveError("Invalid entry %d: %s" % (count + len(entries) + 1, e))
+
+        added += database.importMany(entries)
+        count += len(entries)
+        for _, created in entries:
+            if oldest is None or created < oldest:
+                oldest = created
+
+        if funcProgress is not None:
+            funcProgress(count, size)
+
+    if added and newest is not None and oldest < newest:
+        database.sortHistory()
+
+    return count, added, size
@@ -0,0 +1,2 @@
+from backend import Backend, Snapshot
+from memory import MemoryBackend
\ No newline at end of file
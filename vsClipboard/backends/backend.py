@@ -0,0 +1,138 @@
+from collections import namedtuple
+
+
+class Snapshot(namedtuple("Snapshot", "sequence internal text unicode html hasFile image")):
+    '''An immutable state of the clipboard at a single point in time.
+
+    Attributes:
+        sequence: The clipboard sequence number when the snapshot was taken
+        internal: Whether the clipboard data was set from within the application
+        text: The text data
+        unicode: The unicode data
+        html: The html data
+        hasFile: Whether the text data is a list of files
+        image: The data of a bitmap on the clipboard, if there is no other data
+    '''
+    __slots__ = ()
+
+    @classmethod
+    def fromData(cls, sequence, internal, data):
+        '''Creates a snapshot out of a clipboard data dictionary.
+
+        Args:
+            sequence: The clipboard sequence number
+            internal: Whether the clipboard data was set from within the application
+            data: A dictionary in the format returned by Backend.getData
+
+        Returns:
+            The snapshot
+            Snapshot
+        '''
+        if not data:
+            return cls(sequence, internal, None, None, None, False, None)
+        return cls(sequence, internal, data["text"], data["unicode"], data["html"], data["hasFile"],
+                   data.get("image"))
+
+    @property
+    def data(self):
+        '''The clipboard data of the snapshot as a dictionary.
+
+        Returns:
+            A dictionary in the format returned by Backend.getData or an empty
+            dictionary if there was no recognizable data
+            dict
+        '''
+        if not (self.text or self.unicode or self.html or self.image):
+            return {}
+        return {
+            "text": self.text,
+            "html": self.html,
+            "unicode": self.unicode,
+            "hasFile": self.hasFile,
+            "image": self.image
+        }
+
+
+class Backend(object):
+    '''The interface every clipboard backend implements.
+
+    A backend gives access to the system clipboard. Besides reading and
+    setting the clipboard data, it exposes a sequence number which changes
+    whenever the clipboard changes, so it can be polled cheaply without
+    opening the clipboard and reading the data.
+
+    The data is passed around as dictionaries of the form
+    {
+        "text" : the text data,
+        "html" : the html data,
+        "unicode" : the unicode data,
+        "hasFile" : a boolean value of whether the text contained is a path to a file,
+        "image" : the data of a bitmap, only read if there is no other data
+    }
+
+    Entries of the history read back from the database have a "hasImage"
+    key instead of the image data, see the images module.
+    '''
+
+    def sequenceNumber(self):
+        '''Returns a number which changes on every change of the clipboard.
+
+        Returns:
+            The clipboard sequence number
+            int
+        '''
+        raise NotImplementedError
+
+    def idleTime(self):
+        '''Returns the time since the user last interacted with the computer.
+
+        Backends which can not tell always return 0, which means the user
+        is never considered idle.
+
+        Returns:
+            The time since the last user input (in seconds)
+            float
+        '''
+        return 0
+
+    def getData(self):
+        '''Retrieves the data from the clipboard.
+
+        Returns:
+            A dictionary containing the current clipboard data or an empty
+            dictionary if there is no recognizable data
+            dict
+        '''
+        raise NotImplementedError
+
+    def snapshot(self):
+        '''Reads the sequence number, the internal state and the data of the
+        clipboard at once.
+
+        Backends which can read all of them in a single access to the
+        clipboard should override this.
+
+        Returns:
+            The current state of the clipboard
+            Snapshot
+        '''
+        sequence = self.sequenceNumber()
+        internal = self.isInternal()
+        return Snapshot.fromData(sequence, internal, self.getData() if not internal else {})
+
+    def isInternal(self):
+        '''Checks whether the current clipboard data is set by the set method.
+
+        Returns:
+            True if the clipboard change is internal, False otherwise
+            bool
+        '''
+        raise NotImplementedError
+
+    def set(self, data):
+        '''Sets the clipboard to the passed in data from the history.
+
+        Args:
+            data: The data received from the clipboard history
+        '''
+        raise NotImplementedError
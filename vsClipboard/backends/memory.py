@@ -0,0 +1,93 @@
+'''An in-memory clipboard backend.
+
+It does not touch the system clipboard at all, which makes it possible
+to run the clipboard monitoring and storage on any platform, e.g. for
+testing.
+'''
+import threading
+
+from backend import Backend, Snapshot
+
+
+class MemoryBackend(Backend):
+    '''Keeps the clipboard data in memory.
+
+    Changes made by other applications are simulated through the copy
+    method, while the set method behaves like setting the clipboard from
+    within vsClipboard.
+    '''
+
+    def __init__(self):
+        '''Constructs the backend with an empty clipboard.
+        '''
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._data = {}
+        self._internal = False
+
+    def _replace(self, data, internal):
+        '''Replaces the clipboard data and bumps the sequence number.
+
+        Args:
+            data: The new clipboard data
+            internal: Whether the change is internal
+        '''
+        with self._lock:
+            self._data = dict(data)
+            self._internal = internal
+            self._sequence += 1
+
+    def copy(self, data):
+        '''Simulates another application copying the passed in data.
+
+        Args:
+            data: The new clipboard data
+        '''
+        self._replace(data, False)
+
+    def sequenceNumber(self):
+        '''Returns the number of changes of the clipboard so far.
+
+        Returns:
+            The clipboard sequence number
+            int
+        '''
+        return self._sequence
+
+    def getData(self):
+        '''Retrieves a copy of the clipboard data.
+
+        Returns:
+            A dictionary containing the current clipboard data
+            dict
+        '''
+        with self._lock:
+            return dict(self._data)
+
+    def snapshot(self):
+        '''Reads the sequence number, the internal state and the data of the
+        clipboard at once.
+
+        Returns:
+            The current state of the clipboard
+            Snapshot
+        '''
+        with self._lock:
+            return Snapshot.fromData(self._sequence, self._internal, self._data)
+
+    def isInternal(self):
+        '''Checks whether the current clipboard data is set by the set method.
+
+        Returns:
+            True if the clipboard change is internal, False otherwise
+            bool
+        '''
+        return self._internal
+
+    def set(self, data):
+        '''Sets the clipboard to the passed in data from the history.
+
+        Args:
+            data: The data received from the clipboard history
+        '''
+        self._replace(dict((key, data[key]) for key in ("text", "html", "unicode", "hasFile")), True)
@@ -0,0 +1,390 @@
+'''The Windows clipboard backend.
+
+This module contains the functions used for reading and setting the
+Windows clipboard through the win32 api.
+
+Attributes:
+    u32: A shortened namespace for ctypes.windll.user32
+'''
+import ctypes
+import win32clipboard
+import pywintypes
+import logging
+
+import time
+
+from backend import Backend, Snapshot
+from ..imageFiles import fromBitmapFile
+
+
+u32 = ctypes.windll.user32  # Make it easier to access the namespace
+
+
+class LASTINPUTINFO(ctypes.Structure):
+    '''The structure filled in by GetLastInputInfo.'''
+    _fields_ = [("cbSize", ctypes.c_uint), ("dwTime", ctypes.c_uint)]
+
+
+def registerCustomClipboardFormat():
+    '''Registers a custom clipbord format to detect internal clipboard
+    changes.
+
+    We need to be able to detec whether a clipboard change is due to our 
+    own functions or an outside source, in order to make sure that pasting
+    does not add entries to the clipboard history.
+
+    Returns:
+        The id of the custom format
+        int
+
+    Raises:
+        RuntimeError: Raises an error if for any reason we can't register
+        a clipboard format.
+    '''
+    customFormatID = win32clipboard.RegisterClipboardFormat("vsClipboardPaste")
+    if customFormatID == 0:
+        raise RuntimeError("Could not register custom clipboard format")
+    return customFormatID
+
+
+def getClipboardFormats():
+    '''Returns a list containing the integer codes for the various formats currently
+    in the clipboard
+
+    Returns:
+        list of formats currently in the clipboard
+        list
+    '''
+    openClipboard()
+
+    available = _enumClipboardFormats()
+
+    win32clipboard.CloseClipboard()
+
+    return available
+
+
+def _enumClipboardFormats():
+    '''Returns a list containing the integer codes for the various formats currently
+    in the clipboard, without opening it.
+
+    The clipboard needs to be already open.
+
+    Returns:
+        list of formats currently in the clipboard
+        list
+    '''
+    available = []
+    nextAvailable = win32clipboard.EnumClipboardFormats(0)
+    while nextAvailable:
+        available.append(nextAvailable)
+        nextAvailable = win32clipboard.EnumClipboardFormats(nextAvailable)
+
+    return available
+
+
+def isImage(existingFormats):
+    '''Checks whether there is image data in the list of formats currently in the
+    clipboard.
+
+    Args:
+        existingFormats: list of the current formats in the clipboard
+
+    Returns:
+        True if an image exists in the clipboard formats, else False
+        bool
+    '''
+    if 8 in existingFormats or 2 in existingFormats or 17 in existingFormats:
+        return True
+    return False
+
+
+def isFile(existingFormats):
+    '''Checks whether there is file data in the list of formats currently in the
+    clipboard.
+
+    Args:
+        existingFormats: list of the current formats in the clipboard
+
+    Returns:
+        True if a file exists in the clipboard formats, else False
+        bool
+    '''
+    if 15 in existingFormats:
+        return True
+    return False
+
+
+def isText(existingFormats):
+    '''Checks whether there is text data in the list of formats currently in the
+    clipboard.
+
+    Args:
+        existingFormats: list of the current formats in the clipboard
+
+    Returns:
+        True if text exists in the clipboard formats, else False
+        bool
+    '''
+    if 1 in existingFormats:
+        return True
+    return False
+
+
+def isUnicode(existingFormats):
+    '''Checks whether there is unicode data in the list of formats currently in the
+    clipboard.
+
+    Args:
+        existingFormats: list of the current formats in the clipboard
+
+    Returns:
+        True if unicode exists in the clipboard formats, else False
+        bool
+    '''
+    if 13 in existingFormats:
+        return True
+    return False
+
+
+def isHTML(existingFormats):
+    '''Checks whether there is HTML data in the list of formats currently in the
+    clipboard.
+
+    Args:
+        existingFormats: list of the current formats in the clipboard
+
+    Returns:
+        True if HTML exists in the clipboard formats, else False
+        bool
+    '''
+    if 49416 in existingFormats:
+        return True
+    return False
+
+
+def openClipboard():
+    '''Opens the windows clipboard.
+
+    The win32clipboard.OpenClipboard() function needs to be wrapped in a try
+    and except loop as it is possible that the clipboard is currently in
+    operation when we try to access it, which would error with access denied.
+    '''
+    try:
+        win32clipboard.OpenClipboard()
+        return
+    except pywintypes.error:
+        startTime = time.time()
+        while (time.time() - startTime) < 2:
+            try:
+                win32clipboard.OpenClipboard()
+                return
+            except pywintypes.error:
+                logging.debug("Could not open clipboard. Trying again...")
+                time.sleep(.05)
+        logging.error("Failed opening clipboard.")
+
+
+def _readData(existing):
+    '''Reads the recognizable formats out of the clipboard, without opening it.
+
+    The clipboard needs to be already open.
+
+    Args:
+        existing: list of the current formats in the clipboard
+
+    Returns:
+        A dictionary containing the clipboard data in the format specified in
+        WindowsBackend.getData or an empty dictionary
+        dict
+    '''
+    hasText = isText(existing)
+    hasUnicode = isUnicode(existing)
+    hasFile = isFile(existing)
+    hasImage = isImage(existing)
+    hasHtml = isHTML(existing)
+
+    if not hasUnicode and not hasText and not hasFile and not hasHtml and not hasImage:
+        return {}
+
+    text = win32clipboard.GetClipboardData(win32clipboard.CF_TEXT) if hasText else None
+    _unicode = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT) if hasUnicode else None
+
+    html = None
+    if hasHtml:
+        html = win32clipboard.GetClipboardData(49416)
+
+    if hasFile:
+        text = win32clipboard.GetClipboardData(15)
+
+    # Applications often put a bitmap of what has been copied next to
+    # the text, e.g. copying cells of a spreadsheet, so images are only
+    # read if there is nothing else. Windows converts between the bitmap
+    # formats, so the device independent bitmap is always there
+    image = None
+    if hasImage and not hasText and not hasUnicode and not hasFile:
+        image = win32clipboard.GetClipboardData(win32clipboard.CF_DIB)
+
+    d = {
+        "text": text,
+        "html": html,
+        "unicode": _unicode,
+        "hasFile": hasFile,
+        "image": image
+    }
+
+    return d
+
+
+class WindowsBackend(Backend):
+    '''Reads and sets the Windows clipboard.
+
+    The custom clipboard format used for recognizing internal clipboard
+    changes is registered once on construction.
+
+    Attributes:
+        customFormatID: The id of the custom clipboard format
+    '''
+
+    def __init__(self):
+        '''Constructs the backend and registers the custom clipboard format.
+        '''
+        self.customFormatID = registerCustomClipboardFormat()
+
+    def sequenceNumber(self):
+        '''Returns the Windows clipboard sequence number.
+
+        Windows increments it on every change of the clipboard, so it can be
+        read without opening the clipboard.
+
+        Returns:
+            The clipboard sequence number
+            int
+        '''
+        return u32.GetClipboardSequenceNumber()
+
+    def idleTime(self):
+        '''Returns the time since the last keyboard or mouse input of the session.
+
+        Returns:
+            The time since the last user input (in seconds)
+            float
+        '''
+        info = LASTINPUTINFO()
+        info.cbSize = ctypes.sizeof(info)
+        if not u32.GetLastInputInfo(ctypes.byref(info)):
+            return 0
+
+        # Both are milliseconds since boot, wrapping around every 49.7 days
+        ticks = (ctypes.windll.kernel32.GetTickCount() - info.dwTime) & 0xFFFFFFFF
+        return ticks / 1000.0
+
+    def getData(self):
+        '''Retrieves the data from the clipboard and returns it as a dictionary.
+
+        The dictionary that is returned is of the form
+        {
+            "text" : the text data,
+            "html" : the html data,
+            "unicode" : the unicode data,
+            "hasFile" : a boolean value of whether the text contained is a path to a file,
+            "image" : the data of the CF_DIB format, if there is no text or file
+        }
+
+        Images are saved to a file by clipboard.save, after which their history
+        entry is a file entry with an additional "hasImage" key, so the paste
+        function knows how to handle it.
+
+        Returns:
+            A dictionary containing the current clipboard data in the above specified format.
+            If no recognizable data is found - text, file, html, image
+            an empty dictionary is returned.
+            dict
+        '''
+        openClipboard()
+
+        data = _readData(_enumClipboardFormats())
+
+        win32clipboard.CloseClipboard()
+
+        return data
+
+    def snapshot(self):
+        '''Reads the clipboard as a single snapshot.
+
+        The formats are enumerated, the internal clipboard format is checked
+        and the data is read while the clipboard is open only once. The data
+        of internal changes is not read at all, as it is never saved.
+
+        Returns:
+            The current state of the clipboard
+            Snapshot
+        '''
+        sequence = self.sequenceNumber()
+
+        openClipboard()
+
+        existing = _enumClipboardFormats()
+        internal = self.customFormatID in existing
+        data = _readData(existing) if not internal else {}
+
+        win32clipboard.CloseClipboard()
+
+        return Snapshot.fromData(sequence, internal, data)
+
+    def isInternal(self):
+        '''Checks whether the current clipboard data is set from withing the application.
+
+        Using the custom clipboard format we have registered, we detect whether the change
+        of the clipboard is due to internal reasons, in which case it is being skipped in
+        the monitorClipboard function.
+
+        Returns:
+            True if the clipboard change is internal, False otherwise
+            bool
+        '''
+        if self.customFormatID in getClipboardFormats():
+            return True
+        return False
+
+    def set(self, data):
+        '''Sets the clipboard to the passed in data from the history.
+
+        If a file has been copied only the path to it is set to clipboard.
+
+        Images are read from their file and set as bitmaps, together with
+        the path to the file.
+
+        In the future, I might find I prefer pasting actual files,
+        instead of just paths, in which case, all I need to do is check
+        if there is a file stored, read that and put it on the clipboard.
+
+        Args:
+            data: The data received from the clipboard history in the
+            same format as in the getData function
+        '''
+        openClipboard()
+
+        win32clipboard.EmptyClipboard()
+
+        # Setting the actual clipboard data
+        if data["unicode"]:
+            win32clipboard.SetClipboardData(win32clipboard.CF_UNICODETEXT, data["unicode"])
+
+        if data["text"]:
+            win32clipboard.SetClipboardData(win32clipboard.CF_TEXT,
+                                            data["text"] if isinstance(data["text"], basestring) else str(data["text"][0]))
+
+        if data["html"]:
+            win32clipboard.SetClipboardData(49416, data["html"])
+
+        if data.get("hasImage"):
+            try:
+                win32clipboard.SetClipboardData(win32clipboard.CF_DIB, fromBitmapFile(data["text"][0]))
+            except IOError:
+                logging.error("Could not read clipboard image %s" % data["text"][0])
+
+        # Setting custom clipboard format to identify that it's an internal change
+        win32clipboard.SetClipboardData(self.customFormatID, "1")
+
+        win32clipboard.CloseClipboard()
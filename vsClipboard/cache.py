@@ -0,0 +1,186 @@
+'''Keeping the latest clipboard history entries in memory.
+
+Showing the history on Ctrl + V needs only the latest entries, so instead
+of reading them from the database every time, the monitoring thread keeps
+them in a HistoryCache shared by the whole process.
+
+Every change of the cache publishes a new immutable HistorySnapshot with
+an incremented version, by replacing a single reference. Readers on other
+threads just grab the current snapshot, so they never need to lock, and
+can skip any work if the version is the same as the last one they saw.
+
+The pinned entries are part of the snapshots as well. There are only a
+few of them, so all of them are always kept, regardless of the bounds.
+
+Attributes:
+    MAX_ENTRIES: The default maximum number of cached entries
+    MAX_BYTES: The default maximum total size of the cached entries
+'''
+from collections import namedtuple
+import threading
+
+
+MAX_ENTRIES = 200
+
+MAX_BYTES = 16 * 1024 * 1024
+
+
+class HistorySnapshot(namedtuple("HistorySnapshot", "version entries pinned")):
+    '''An immutable state of the cached history.
+
+    The entries are dictionaries in the format returned by
+    database.readLatest and should not be modified.
+
+    Attributes:
+        version: The version of the cache the snapshot was taken at
+        entries: A tuple of the cached entries, newest first
+        pinned: A tuple of the pinned entries, the latest pinned first
+    '''
+    __slots__ = ()
+
+
+def entrySize(entry):
+    '''Returns the approximate size of the data of an entry in bytes.
+
+    Args:
+        entry: A dictionary representing a clipboard history entry
+
+    Returns:
+        The size in bytes
+        int
+    '''
+    size = 0
+    for key in ("text", "unicode", "html"):
+        value = entry[key]
+        if isinstance(value, tuple):
+            size += sum(len(each) for each in value)
+        elif value:
+            size += len(value)
+    return size
+
+
+class HistoryCache(object):
+    '''The latest entries of the clipboard history, bounded by count and size.
+
+    Only a single thread is expected to add entries, while any thread can
+    pin entries and read the snapshots.
+    '''
+
+    def __init__(self, maxEntries=MAX_ENTRIES, maxBytes=MAX_BYTES):
+        '''Constructs an empty cache.
+
+        Args:
+            maxEntries: The maximum number of cached entries (default: {MAX_ENTRIES})
+            maxBytes: The maximum total size of the cached entries (default: {MAX_BYTES})
+        '''
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+
+        self._lock = threading.Lock()
+        self._snapshot = HistorySnapshot(0, (), ())
+
+    def snapshot(self):
+        '''Returns the current state of the cache.
+
+        Returns:
+            The current snapshot
+            HistorySnapshot
+        '''
+        return self._snapshot
+
+    def latestHash(self):
+        '''Returns the hash of the newest cached entry.
+
+        Returns:
+            The hash or None if the cache is empty
+            str
+        '''
+        entries = self._snapshot.entries
+        return entries[0]["hash"] if entries else None
+
+    def _publish(self, entries, pinned=None):
+        '''Evicts the oldest entries outside of the bounds and publishes the
+        rest as a new snapshot.
+
+        The newest entry is always kept, even if it is larger than maxBytes.
+
+        Args:
+            entries: A list of entries, newest first
+            pinned: A tuple of the pinned entries or None to keep the current
+            ones (default: {None})
+        '''
+        if pinned is None:
+            pinned = self._snapshot.pinned
+
+        entries = entries[:self.maxEntries]
+
+        total = 0
+        for i, entry in enumerate(entries):
+            total += entrySize(entry)
+            if total > self.maxBytes and i:
+                entries = entries[:i]
+                break
+
+        self._snapshot = HistorySnapshot(self._snapshot.version + 1, tuple(entries), pinned)
+
+    def load(self, entries):
+        '''Replaces the cached entries, e.g. with the latest entries from the
+        database on startup.
+
+        Args:
+            entries: A list of entries, newest first, in the format returned
+            by database.readLatest
+        '''
+        with self._lock:
+            self._publish(list(entries))
+
+    def add(self, data, dataHash):
+        '''Adds a new entry at the top of the cache.
+
+        If an entry with the same data is already cached, it is moved to the
+        top instead.
+
+        Args:
+            data: A dictionary representing a clipboard history entry
+            dataHash: The hash of the data as returned by database.hashData
+        '''
+        entry = dict(data, id=None, hash=dataHash)
+
+        with self._lock:
+            entries = [each for each in self._snapshot.entries if each["hash"] != dataHash]
+            entries.insert(0, entry)
+            self._publish(entries)
+
+    def loadPinned(self, entries):
+        '''Replaces the pinned entries, e.g. with the pinned entries from the
+        database on startup.
+
+        Args:
+            entries: A list of entries, the latest pinned first, in the format
+            returned by database.readPinned
+        '''
+        with self._lock:
+            self._publish(list(self._snapshot.entries), tuple(entries))
+
+    def pin(self, entry):
+        '''Adds an entry to the top of the pinned entries, unless it is already
+        pinned.
+
+        Args:
+            entry: A clipboard history entry
+        '''
+        with self._lock:
+            pinned = self._snapshot.pinned
+            if any(each["hash"] == entry["hash"] for each in pinned):
+                return
+            self._publish(list(self._snapshot.entries), (entry,) + pinned)
+
+    def unpin(self, dataHash):
+        '''Removes an entry from the pinned entries.
+
+        Args:
+            dataHash: The hash of the data of the entry
+        '''
+        with self._lock:
+            pinned = tuple(each for each in self._snapshot.pinned if each["hash"] != dataHash)
+            self._publish(list(self._snapshot.entries), pinned)
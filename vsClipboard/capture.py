@@ -0,0 +1,120 @@
+'''Capturing and storing the clipboard history.
+
+The same threads capture the clipboard history whether they run in the
+application itself, or in the daemon process
+
+- one running the tasks of monitoring the clipboard, writing the new
+  entries to the database and enforcing the history retention policies,
+  see the tasks module
+- one to search the clipboard history, which also fills in the
+  trigram index
+
+The tasks do their work in short steps, e.g. retention deletes a small
+batch of entries at a time, so they can share a thread without holding
+up the polling. Searching stays on a thread of its own, as it blocks on
+long running queries.
+'''
+from functools import partial
+
+import clipboard
+import database
+import retention
+from backends.windows import WindowsBackend
+from cache import HistoryCache
+from search import Searcher
+from tasks import TaskLoop
+from trigram import TrigramIndex
+from writer import Writer
+
+from PySide.QtCore import QThread
+
+
+class Capture(object):
+    '''The clipboard backend, the in-memory history and the threads
+    capturing the clipboard.
+
+    Attributes:
+        cache: The cache.HistoryCache of the latest entries
+        index: The trigram.TrigramIndex of the history
+        searcher: The search.Searcher of the history
+        writer: The writer.Writer storing new entries
+    '''
+
+    def __init__(self):
+        '''Sets up the clipboard module and creates the threads, without
+        starting them.
+        '''
+        # Access the Windows clipboard. Creating the backend registers
+        # the custom clipboard format used for recognizing internal
+        # clipboard changes
+        clipboard.setBackend(WindowsBackend())
+
+        # Keep the latest and the pinned history entries in memory, so
+        # showing the history on Ctrl + V never has to read the database.
+        # The monitoring task adds new entries to it
+        self.cache = HistoryCache()
+        self.cache.load(database.readLatest(self.cache.maxEntries))
+        self.cache.loadPinned(database.readPinned())
+        clipboard.setCache(self.cache)
+
+        # The trigram index is filled in on the search thread, while
+        # new entries are added to it by the monitoring task and
+        # expired ones removed by the retention task
+        self.index = TrigramIndex()
+        clipboard.setIndex(self.index)
+        retention.setIndex(self.index)
+        self.searcher = Searcher(index=self.index)
+
+        self.tasks = TaskLoop(clipboard.monitorClipboard)
+        clipboard.setTasks(self.tasks)
+
+        self.writer = Writer(self.tasks)
+        clipboard.setWriter(self.writer)
+
+        self.taskThread = QThread()
+        self.taskThread.run = self.tasks.run
+
+        self.searchThread = QThread()
+        self.searchThread.run = self.searcher.run
+
+    def start(self):
+        '''Starts capturing the clipboard.
+        '''
+        self.taskThread.start()
+
+    def startBackground(self):
+        '''Starts what is not needed for capturing the clipboard, enforcing
+        the retention policies and searching.
+        '''
+        self.tasks.spawn(partial(retention.compactHistory, self._historyMigrated))
+        self.searchThread.start()
+
+    def _historyMigrated(self):
+        '''Reloads the cache and the trigram index once the entries of older
+        versions have been migrated, as they were filled in before.
+
+        It runs on the task thread, which is the one adding new entries to
+        the cache, so the entries which are not written yet are kept on top.
+        '''
+        entries = database.readLatest(self.cache.maxEntries)
+        written = set(entry["hash"] for entry in entries)
+        unwritten = [entry for entry in self.cache.snapshot().entries
+                     if entry["id"] is None and entry["hash"] not in written]
+        self.cache.load(unwritten + entries)
+
+        self.searcher.reindex()
+
+    def stop(self):
+        '''Stops all threads and waits for them to exit.
+        '''
+        # Cancelling the tasks stops them where they are waiting,
+        # so no poll or retention batch is ever left half done
+        self.tasks.stop()
+        self.taskThread.wait()
+
+        # Only once the monitoring task has stopped adding new
+        # entries, write the remaining ones
+        self.writer.close()
+
+        self.searcher.stop()
+        self.searchThread.wait()
@@ -1,362 +1,324 @@
 '''Clipboard getting and setting.
 
-This module contains functions used for reading and polling the 
+This module contains functions used for reading and polling the
 current clipboard data, as well as, for setting the current
 clipboard to an entry from the history.
 
-Attributes:
-    u32: A shortened namespace for ctypes.windll.user32
+The actual access to the clipboard goes through a backend, see the
+backends package. The Windows backend is used, unless a different one
+is specified through setBackend.
+
+If a writer.Writer is specified through setWriter, new entries are
+written to the database through it instead of on the calling thread.
+
+If a cache.HistoryCache is specified through setCache, new entries are
+added to it as well and it is used for checking whether the clipboard
+data is already the latest entry.
+Pinning and unpinning entries updates it as well.
+
+If a trigram.TrigramIndex is specified through setIndex, new entries are
+added to it as well, so they can be searched straight away.
+
+Images are stored on the threads of the QThreadPool. If the tasks.TaskLoop
+monitoring the clipboard is specified through setTasks, the stored images
+are added to the history back on its thread, so entries are only ever
+added by a single thread, in the order they were captured in.
+
+Unless the "large_payload_threshold_kb" config is 0, entries larger than
+it are stored outside of the database and only their previews are kept in the cache.
+Their data is read back only when they are set to the clipboard.
 '''
-import ctypes
-import win32clipboard
-import pywintypes
 import logging
 
-import time
-
-import database
 import config
+import database
+import images
+import tracing
+from cache import entrySize
+from trigram import indexText
+from scheduler import PollScheduler
+from preview import makePreview
 
-from PySide.QtCore import QThread
 
+_backend = None
 
-u32 = ctypes.windll.user32  # Make it easier to access the namespace
+_writer = None
 
+_cache = None
 
-def registerCustomClipboardFormat():
-    '''Registers a custom clipbord format to detect internal clipboard
-    changes.
+_index = None
 
-    We need to be able to detec whether a clipboard change is due to our 
-    own functions or an outside source, in order to make sure that pasting
-    does not add entries to the clipboard history.
+_tasks = None
 
-    Returns:
-        The id of the custom format
-        int
 
-    Raises:
-        RuntimeError: Raises an error if for any reason we can't register
-        a clipboard format.
+def setBackend(backend):
+    '''Sets the backend used for accessing the clipboard.
+
+    Args:
+        backend: An instance of a backends.Backend subclass
     '''
-    customFormatID = win32clipboard.RegisterClipboardFormat("vsClipboardPaste")
-    if customFormatID == 0:
-        raise RuntimeError("Could not register custom clipboard format")
-    return customFormatID
+    global _backend
+    _backend = backend
+
 
+def getBackend():
+    '''Returns the backend used for accessing the clipboard.
 
-def getClipboardFormats():
-    '''Returns a list containing the integer codes for the various formats currently
-    in the clipboard
+    If no backend has been set, the Windows backend is created.
 
     Returns:
-        list of formats currently in the clipboard
-        list
+        The clipboard backend
+        backends.Backend
     '''
-    openClipboard()
+    if _backend is None:
+        from backends.windows import WindowsBackend
+        setBackend(WindowsBackend())
+    return _backend
 
-    available = []
-    nextAvailable = win32clipboard.EnumClipboardFormats(0)
-    while nextAvailable:
-        available.append(nextAvailable)
-        nextAvailable = win32clipboard.EnumClipboardFormats(nextAvailable)
 
-    win32clipboard.CloseClipboard()
-
-    return available
+def setWriter(writer):
+    '''Sets the write-behind queue used for saving entries.
 
+    Args:
+        writer: A writer.Writer instance or None to write directly
+    '''
+    global _writer
+    _writer = writer
 
-def isInternal():
-    '''Checks whether the current clipboard data is set from withing the application.
 
-    Using the custom clipboard format we have registered, we detect whether the change
-    of the clipboard is due to internal reasons, in which case it is being skipped in
-    the monitorClipboard function.
+def setCache(cache):
+    '''Sets the in-memory cache of the latest history entries.
 
-    Returns:
-        True if the clipboard change is internal, False otherwise
-        bool
+    Args:
+        cache: A cache.HistoryCache instance or None
     '''
-    t = QThread.currentThread()
-
-    if not hasattr(t, "customClipboardFormatID"):
-        t.customClipboardFormatID = registerCustomClipboardFormat()
+    global _cache
+    _cache = cache
 
-    if getattr(t, "customClipboardFormatID") in getClipboardFormats():
-        return True
-    return False
 
-
-def isImage(existingFormats):
-    '''Checks whether there is image data in the list of formats currently in the
-    clipboard.
+def setIndex(index):
+    '''Sets the trigram index of the history entries.
 
     Args:
-        existingFormats: list of the current formats in the clipboard
-
-    Returns:
-        True if an image exists in the clipboard formats, else False
-        bool
+        index: A trigram.TrigramIndex instance or None
     '''
-    if 8 in existingFormats or 2 in existingFormats or 17:
-        return True
-    return False
+    global _index
+    _index = index
 
 
-def isFile(existingFormats):
-    '''Checks whether there is file data in the list of formats currently in the
-    clipboard.
+def setTasks(tasks):
+    '''Sets the task loop monitoring the clipboard, which stored images are
+    added to the history on.
 
     Args:
-        existingFormats: list of the current formats in the clipboard
-
-    Returns:
-        True if a file exists in the clipboard formats, else False
-        bool
+        tasks: A tasks.TaskLoop instance or None to add them on the thread
+        storing them
     '''
-    if 15 in existingFormats:
-        return True
-    return False
+    global _tasks
+    _tasks = tasks
 
 
-def isText(existingFormats):
-    '''Checks whether there is text data in the list of formats currently in the
-    clipboard.
+def getData():
+    '''Retrieves the data from the clipboard and returns it as a dictionary.
 
-    Args:
-        existingFormats: list of the current formats in the clipboard
+    See backends.Backend for the format of the dictionary.
 
     Returns:
-        True if text exists in the clipboard formats, else False
-        bool
+        A dictionary containing the current clipboard data or an empty
+        dictionary if there is no recognizable data
+        dict
     '''
-    if 1 in existingFormats:
-        return True
-    return False
+    return getBackend().getData()
 
 
-def isUnicode(existingFormats):
-    '''Checks whether there is unicode data in the list of formats currently in the
-    clipboard.
-
-    Args:
-        existingFormats: list of the current formats in the clipboard
+def snapshot():
+    '''Reads the whole state of the clipboard while accessing it only once.
 
     Returns:
-        True if unicode exists in the clipboard formats, else False
-        bool
+        An immutable snapshot of the clipboard
+        backends.Snapshot
     '''
-    if 13 in existingFormats:
-        return True
-    return False
-
+    return getBackend().snapshot()
 
-def isHTML(existingFormats):
-    '''Checks whether there is HTML data in the list of formats currently in the
-    clipboard.
 
-    Args:
-        existingFormats: list of the current formats in the clipboard
+def isInternal():
+    '''Checks whether the current clipboard data is set from withing the application.
 
     Returns:
-        True if HTML exists in the clipboard formats, else False
+        True if the clipboard change is internal, False otherwise
         bool
     '''
-    if 49416 in existingFormats:
-        return True
-    return False
+    return getBackend().isInternal()
 
 
-def getData():
-    '''Retrieves the data from the clipboard and returns it as a dictionary.
+def monitorClipboard():
+    '''Polls the clipboard for changes and saves them to the history.
 
-    The dictionary that is returned is of the form
-    {
-        "text" : the text data,
-        "html" : the html data,
-        "unicode" : the unicode data,
-        "hasFile" : a boolean value of whether the text contained is a path to a file
-    }
+    Only the clipboard sequence number is polled, which does not require
+    opening the clipboard, and a snapshot is read only once it changes.
 
-    In the future the "hasFile" key will also be true if there is an image on the clipboard,
-    as the way images are going to be handled is that they are going to be saved to a file
-    whenever they are detected in the clipboard. An additional "hasImage" key will be added,
-    so the paste function knows how to handle it.
+    The time between polls is decided by a PollScheduler, based on the
+    recent clipboard activity.
 
-    Returns:
-        A dictionary containing the current clipboard data in the above specified format.
-        If no recognizable data is found - text, file, html, image (images are not currently supported)
-        an empty dictionary is returned.
-        dict
+    This is a task run by a tasks.TaskLoop, yielding the time to wait
+    before the next poll, until it is cancelled.
     '''
-    existing = getClipboardFormats()
+    backend = getBackend()
+    scheduler = PollScheduler()
 
-    hasText = isText(existing)
-    hasUnicode = isUnicode(existing)
-    hasFile = isFile(existing)
-    hasImage = isImage(existing)
-    hasHtml = isHTML(existing)
+    sequence = None
+    while True:
+        newSequence = backend.sequenceNumber()
+        changed = newSequence != sequence
+        if changed:
+            clipboardSnapshot = backend.snapshot()
+            if not clipboardSnapshot.internal:
+                save(clipboardSnapshot)
+        sequence = newSequence
 
-    if not hasUnicode and not hasText and not hasFile and not hasHtml:  # Once image support is addes hasImage needs to be added here
-        return {}
+        # Only recorded on the first poll, after the app has started
+        tracing.sinceMark("startup", "startup")
 
-    openClipboard()
+        yield scheduler.next(changed, backend.idleTime())
 
-    text = win32clipboard.GetClipboardData(win32clipboard.CF_TEXT) if hasText else None
-    _unicode = win32clipboard.GetClipboardData(win32clipboard.CF_UNICODETEXT) if hasUnicode else None
 
-    html = None
-    if hasHtml:
-        html = win32clipboard.GetClipboardData(49416)
+def save(clipboardSnapshot=None):
+    '''Saves the clipboard data to history.
 
-    if hasFile:
-        text = win32clipboard.GetClipboardData(15)
+    The data is taken from the passed in snapshot, or if there is none,
+    from a new snapshot of the clipboard, and is then added to the
+    existing clipboard history. If it is already the latest entry in
+    the history nothing is saved, while if it is an older entry, that
+    entry is moved to the top.
 
-    if hasImage:
-        pass
+    The preview of the entry is created here, so it never has to be
+    created from the full data again.
 
-    win32clipboard.CloseClipboard()
+    Images are stored by the images module in the background and are
+    added to the history once they are saved.
 
-    d = {
-        "text": text,
-        "html": html,
-        "unicode": _unicode,
-        # "hasFile" : hasFile or hasImage
-        "hasFile": hasFile
-    }
+    Args:
+        clipboardSnapshot: The snapshot to save (default: {None})
+    '''
+    if clipboardSnapshot is None:
+        clipboardSnapshot = snapshot()
+    data = clipboardSnapshot.data
+    if not data:
+        return
 
-    return d
+    image = data.pop("image", None)
+    if image is not None:
+        images.store(image, _addImage)
+        return
 
+    _add(data, config.current.large_payload_threshold_kb * 1024 or None)
 
-def monitorClipboard():
-    '''Polls the clipboard for changes and saves them to the history.
 
-    The while loop exits once the "do_run" attribute of the current thread
-    is set to False from the main thread.
+def _addImage(data):
+    '''Adds a stored image to the history, on the thread monitoring the
+    clipboard if there is a task loop set.
 
-    On exit we are checking whether we have a database connection stored on the
-    thread and if we do, we close it.
+    Args:
+        data: The history entry of the image
     '''
-    t = QThread.currentThread()
-
-    history = getHistory()
-    data = history[-1] if history else {}
-    while getattr(t, "do_run", True):
-        newData = getData()
-        if newData and newData != data and not isInternal():
-            save()
-        data = newData
-        time.sleep(config.get("poll_clipboard_interval"))
-
-    if hasattr(t, "dbConnection"):
-        getattr(t, "dbConnection").close()
-        logging.info("Closed dbConnection in clipboard thread")
+    if _tasks is not None:
+        _tasks.call(_add, data)
+    else:
+        _add(data)
 
 
-def save():
-    '''Saves the current clipboard data to history.
+def _add(data, largePayloadBytes=None):
+    '''Adds the clipboard data to the history, unless it is already the
+    latest entry.
 
-    The data is retrieved using getData() and is then appended
-    to the existing clipboard history.
+    Args:
+        data: A dictionary representing a clipboard history entry
+        largePayloadBytes: The size above which the data is stored outside
+        of the database, or None to always store it in it (default: {None})
     '''
-    data = getData()
-    old = getHistory()
-
-    old = old[-1] if old else {}
-
-    if data:
-        startTime = time.time()
-
-        # If the data that needs to be saved is exactly the same
-        # as the latest data in the history, give it 1 second
-        # to make sure changes have been reflected and if
-        # there is still no change return
-
-        # Otherwise carry on saving the data, as
-        # it can be assumed that it is different
-        # than the latest one in the history
-        while data == old:
-            if time.time() - startTime > 1:
-                logging.error("Failed to save")
-                return
-            time.sleep(.01)
-            data = getData()
+    data.update(makePreview(data))
+    dataHash = database.hashData(data)
+    data["external"] = largePayloadBytes is not None and entrySize(data) > largePayloadBytes
+
+    if _cache is not None:
+        latestHash = _cache.latestHash()
+    elif _writer is not None:
+        latestHash = _writer.latestHash()
+    else:
+        latestHash = database.latestHash()
+
+    if dataHash == latestHash:
+        return
+
+    if _writer is not None:
+        _writer.put(data, dataHash)
+    else:
         database.write(data)
 
+    if _index is not None:
+        _index.add(dataHash, indexText(data))
 
-def set(data):
-    '''Sets the clipboard to the passed in data from the history.
+    if _cache is not None:
+        if data["external"]:
+            data = dict(data, text=None, unicode=None, html=None)
+        _cache.add(data, dataHash)
 
-    Currently, only the text data is supported, so if a file has been copied
-    only the path to it would be set to clipboard.
 
-    Once image support is added, similar to the file case, only a path to
-    the saved image file would be set to the clipboard.
+def set(data):
+    '''Sets the clipboard to the passed in data from the history.
 
-    In the future, I might find I prefer pasting actual files and images,
-    instead of just paths, in which case, all I need to do is check
-    if there is a file or image stored, read that and put it
-    on the clipboard.
+    The data of entries stored outside of the database is read first.
 
     Args:
         data: The data received from the clipboard history in the
         same format as in the getData function
     '''
-    t = QThread.currentThread()
+    with tracing.span("clipboard_set"):
+        data = database.loadPayload(data)
+        if data is None:
+            logging.error("Could not load the clipboard history entry")
+            return
 
-    if not hasattr(t, "customClipboardFormatID"):
-        t.customClipboardFormatID = registerCustomClipboardFormat()
+        getBackend().set(data)
 
-    openClipboard()
 
-    win32clipboard.EmptyClipboard()
+def pin(data):
+    '''Pins an entry, so it is always shown at the top of the history and
+    never deleted by the retention policies.
 
-    # Setting the actual clipboard data
-    if data["unicode"]:
-        win32clipboard.SetClipboardData(win32clipboard.CF_UNICODETEXT, data["unicode"])
+    Args:
+        data: The data received from the clipboard history, with its "hash"
+    '''
+    database.pin(data["hash"])
 
-    if data["text"]:
-        win32clipboard.SetClipboardData(win32clipboard.CF_TEXT,
-                                        data["text"] if isinstance(data["text"], basestring) else str(data["text"][0]))
+    if _cache is not None:
+        _cache.pin(data)
 
-    if data["html"]:
-        win32clipboard.SetClipboardData(49416, data["html"])
 
-    # Setting custom clipboard format to identify that it's an internal change
-    win32clipboard.SetClipboardData(getattr(t, "customClipboardFormatID"), "1")
+def unpin(data):
+    '''Unpins an entry.
 
-    win32clipboard.CloseClipboard()
+    Args:
+        data: The data received from the clipboard history, with its "hash"
+    '''
+    database.unpin(data["hash"])
+
+    if _cache is not None:
+        _cache.unpin(data["hash"])
 
 
-def getHistory():
-    '''Returns the list containing the existing clipboard history.
+def getHistory(count):
+    '''Returns the list containing the latest entries of the clipboard history.
 
-    The list contains dictionaries in the format specified in the getData function.
+    The list contains dictionaries in the format specified in the getData function,
+    with additional "id" and "hash" keys identifying the entry in the database. They are
+    ordered from oldest to newest.
+
+    Args:
+        count: The maximum number of entries to return
 
     Returns:
         A list of dict elements containing entries in the clipboard history
         list
     '''
-    return database.read()
-
-
-def openClipboard():
-    '''Opens the windows clipboard.
-
-    The win32clipboard.OpenClipboard() function needs to be wrapped in a try
-    and except loop as it is possible that the clipboard is currently in
-    operation when we try to access it, which would error with access denied.
-    '''
-    try:
-        win32clipboard.OpenClipboard()
-        return
-    except pywintypes.error:
-        startTime = time.time()
-        while (time.time() - startTime) < 2:
-            try:
-                win32clipboard.OpenClipboard()
-                return
-            except pywintypes.error:
-                logging.debug("Could not open clipboard. Trying again...")
-                time.sleep(.05)
-        logging.error("Failed opening clipboard.")
+    return list(reversed(database.readLatest(count)))
@@ -7,60 +7,174 @@ running.
 If the file does not exist, the defaults stored in the _config
 dictionary.
 
+The preferences in use are a Config snapshot stored in the current
+attribute of this module. Snapshots are never modified, instead a new
+one is assigned to current whenever the config file changes, so the
+threads can read the preferences as plain attributes
+
+    config.current.hold_before_showing
+
+without any locking, and always see a complete, validated config.
+
 Attributes:
+    CONFIG_FILE: The path of the config file
+    current: The Config snapshot in use
     _config: Default configuration
 '''
 import json
-from PySide.QtCore import QThread
+import logging
+import os
+
+from PySide.QtCore import QObject, QFileSystemWatcher, Signal
 
-import ctypes 
-# Letting windows know that this is an application
-# on it's own, instead of just pythonw.exe
-# source - https://stackoverflow.com/questions/1551605/how-to-set-applications-taskbar-icon-in-windows-7
-myappid = u'vsClipboard.v_0_1' 
-ctypes.windll.shell32.SetCurrentProcessExplicitAppUserModelID(myappid)
+
+CONFIG_FILE = "config.json"
 
 _config = {
     "history_length": 10,
     "hold_before_showing": .15,
-    "poll_clipboard_interval": .5
+    "poll_clipboard_interval_min": .05,
+    "poll_clipboard_interval_max": 1,
+    "max_history_entries": 0,
+    "max_history_size_mb": 0,
+    "max_history_age_days": 0,
+    "large_payload_threshold_kb": 256
+}
+
+# The type and the minimum value of each preference
+_types = {
+    "history_length": (int, 1),
+    "hold_before_showing": (float, .01),
+    "poll_clipboard_interval_min": (float, .01),
+    "poll_clipboard_interval_max": (float, .01),
+    "max_history_entries": (int, 0),
+    "max_history_size_mb": (float, 0),
+    "max_history_age_days": (float, 0),
+    "large_payload_threshold_kb": (float, 0)
 }
 
 
+def _validate(key, value):
+    '''Converts a preference to its type, falling back to the default if it
+    is not valid.
+
+    Args:
+        key: The name of the preference
+        value: The value read from the config file
+
+    Returns:
+        The value of the preference
+    '''
+    valueType, minimum = _types[key]
+    if isinstance(value, (int, long, float)) and not isinstance(value, bool):
+        if valueType is float or float(value).is_integer():
+            if value >= minimum:
+                return valueType(value)
+
+    logging.warning("Invalid value %r of %s in %s, using the default %r" % (value, key, CONFIG_FILE, _config[key]))
+    return valueType(_config[key])
+
+
+class Config(object):
+    '''An immutable snapshot of the preferences.
+
+    Every preference is a validated attribute of the same name, e.g.
+    history_length. Unknown keys are ignored and invalid values are
+    replaced by the defaults.
+    '''
+    __slots__ = tuple(sorted(_config))
+
+    def __init__(self, values=None):
+        '''Constructs the snapshot.
+
+        Args:
+            values: A dictionary of the preferences, any missing ones are
+            filled in from the defaults (default: {None})
+        '''
+        values = values or {}
+        for key in self.__slots__:
+            object.__setattr__(self, key, _validate(key, values.get(key, _config[key])))
+
+    def __setattr__(self, key, value):
+        raise AttributeError("Config snapshots can not be modified")
+
+    def __delattr__(self, key):
+        raise AttributeError("Config snapshots can not be modified")
+
+    def asDict(self):
+        '''Returns the preferences as a dictionary.
+
+        Returns:
+            dict
+        '''
+        return dict((key, getattr(self, key)) for key in self.__slots__)
+
+
+current = Config()
+
+
+def _read():
+    '''Reads the config file.
+
+    Returns:
+        A dictionary of the preferences in the config file, which is empty
+        if there is no config file
+        dict
+
+    Raises:
+        IOError: If the config file can not be read
+        ValueError: If the config file is not a valid JSON object
+    '''
+    if not os.path.exists(CONFIG_FILE):
+        return {}
+
+    with open(CONFIG_FILE, "r") as f:
+        values = json.loads(f.read())
+
+    if not isinstance(values, dict):
+        raise ValueError("The config is not a JSON object")
+    return values
+
+
 def parse():
     '''Reads, parses and returns the config file.
 
+    Any keys missing from the config file are filled in from the
+    defaults, so older config files keep working.
+
     Returns:
         A dictionary representing the config file
         dict
     '''
+    config = dict(_config)
     try:
-        with open("config.json", "r") as f:
-            config = json.loads(f.read())
-    except:
-        config = _config
+        config.update(_read())
+    except (IOError, ValueError):
+        logging.exception("Could not read %s" % CONFIG_FILE)
     return config
 
 
-def get(key=None):
-    '''Returns either the full config or a single key.
+def reload():
+    '''Reads the config file and makes it the current config.
 
-    This function always returns the most up to date config
-    stored on the thread object.
-
-    Args:
-        key: The key we are interested in (default: {None})
+    If the config file can not be read, e.g. while it is being written,
+    the current config is kept.
 
     Returns:
-        Either the value of the key specified or if no key is
-        specified the full config dict is returned.
-        dict
+        The current Config snapshot
+        Config
     '''
-    t = QThread.currentThread()
-    if not key:
-        return getattr(t, "config")
-    else:
-        return getattr(t, "config")[key]
+    global current
+
+    values = dict(_config)
+    try:
+        values.update(_read())
+    except (IOError, ValueError):
+        logging.exception("Could not read %s, keeping the current config" % CONFIG_FILE)
+        return current
+
+    current = Config(values)
+    return current
 
 
 def save(new):
@@ -74,7 +188,74 @@ def save(new):
         config.json file.
     '''
     try:
-        with open("config.json", "w") as f:
+        with open(CONFIG_FILE, "w") as f:
             f.write(json.dumps(new, sort_keys=1, indent=4))
     except:
         raise IOError("Could not save new configuration to the config file.")
+
+
+class ConfigWatcher(QObject):
+    '''Reloads the config whenever the config file changes, so edits are
+    applied without saving the preferences.
+
+    The directory of the config file is watched as well, as editors often
+    replace the file instead of writing to it, and the file might not
+    exist yet.
+
+    Attributes:
+        changed: a custom signal emitted with the new Config snapshot
+    '''
+    changed = Signal(object)
+
+    def __init__(self, parent=None):
+        '''Constructs the watcher and starts watching the config file.
+
+        Args:
+            parent: The parent object (default: {None})
+        '''
+        super(ConfigWatcher, self).__init__(parent)
+
+        self._stamp = self._fileStamp()
+
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.addPath(os.path.dirname(os.path.abspath(CONFIG_FILE)))
+        self._watchFile()
+
+        self.watcher.fileChanged.connect(self.check)
+        self.watcher.directoryChanged.connect(self.check)
+
+    def _fileStamp(self):
+        '''Returns the modification time and size of the config file, or None
+        if it does not exist.
+        '''
+        try:
+            stat = os.stat(CONFIG_FILE)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    def _watchFile(self):
+        '''Watches the config file, if it exists and is not watched already.
+        '''
+        path = os.path.abspath(CONFIG_FILE)
+        if os.path.exists(path) and path not in self.watcher.files():
+            self.watcher.addPath(path)
+
+    def check(self, path=None):
+        '''Reloads the config if the config file has changed.
+
+        Args:
+            path: The changed path, as passed by the QFileSystemWatcher signals (default: {None})
+        '''
+        self._watchFile()
+
+        stamp = self._fileStamp()
+        if stamp == self._stamp:
+            return
+        self._stamp = stamp
+
+        previous = current
+        snapshot = reload()
+        if snapshot is not previous:
+            logging.info("Reloaded %s" % CONFIG_FILE)
+            self.changed.emit(snapshot)
@@ -0,0 +1,504 @@
+'''Capturing the clipboard history in a separate process.
+
+When running as a daemon, the clipboard monitoring, the database and
+the rest of the capture.Capture threads live in a headless process,
+while the ui and the hotkey handling run in another one, which talks
+to the daemon through a local named pipe. A slow rebuild of the Paste
+widget can then never delay capturing the clipboard, and the ui can
+be restarted without the daemon missing any clipboard changes.
+
+Requests are tuples of a command and its arguments, sent through a
+multiprocessing.connection, and are answered with ("ok", result) or
+("error", message)
+
+- ping() - returns True
+- snapshot(version) - returns the cached cache.HistorySnapshot, or None
+  if its version is the passed in one
+- readLatest(count, beforeId) - see database.readLatest
+- entryId(dataHash) - see database.entryId
+- search(text) - returns the entries best matching the text
+- set(entry) - sets the clipboard to an entry
+- pin(entry), unpin(entry) - pins or unpins an entry
+- quit() - stops the daemon
+
+The daemon writes a random key to KEY_FILE on start, which clients need
+to read in order to connect.
+
+Attributes:
+    ADDRESS: The address the daemon listens on
+    KEY_FILE: The file holding the key of the running daemon
+    POLL_INTERVAL: How often (in seconds) connections check whether the daemon is stopping
+    START_TIMEOUT: How long (in seconds) to wait for a started daemon to answer
+'''
+from multiprocessing.connection import Listener, Client, AuthenticationError
+from functools import partial
+import logging
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import clipboard
+import config
+import database
+from cache import HistorySnapshot
+from capture import Capture
+from search import Searcher
+
+from PySide.QtCore import QCoreApplication, QObject, QThread, Signal
+
+
+ADDRESS = r"\\.\pipe\vsClipboard"
+
+KEY_FILE = "daemon.key"
+
+POLL_INTERVAL = .5
+
+START_TIMEOUT = 10
+
+_DETACHED_PROCESS = 0x00000008
+
+_CREATE_NEW_PROCESS_GROUP = 0x00000200
+
+
+class DaemonError(Exception):
+    '''Raised when the daemon can not be reached or a request fails.
+    '''
+
+
+class DaemonUnreachable(DaemonError):
+    '''Raised when the daemon can not be reached, as opposed to a request
+    failing in a running daemon.
+    '''
+
+
+class DaemonServer(QObject):
+    '''Answers the requests of the clients of the daemon.
+
+    The run method is the body of the server thread, which accepts the
+    connections, while each connection is served on its own thread.
+
+    Attributes:
+        quitRequested: a custom signal emitted when a client asks the daemon to stop
+    '''
+    quitRequested = Signal()
+
+    def __init__(self, cache, searcher, address=ADDRESS):
+        '''Constructs the server.
+
+        Args:
+            cache: The cache.HistoryCache of the latest entries
+            searcher: The search.Searcher of the history
+            address: The address to listen on (default: {ADDRESS})
+        '''
+        super(DaemonServer, self).__init__()
+
+        self.cache = cache
+        self.searcher = searcher
+        self.address = address
+        self.authkey = os.urandom(32)
+
+        self._running = True
+        self._threads = []
+
+        self._commands = {
+            "ping": lambda: True,
+            "snapshot": self._snapshot,
+            "readLatest": database.readLatest,
+            "entryId": database.entryId,
+            "search": self.searcher.find,
+            "set": clipboard.set,
+            "pin": clipboard.pin,
+            "unpin": clipboard.unpin,
+            "quit": self.quitRequested.emit
+        }
+
+    def _snapshot(self, version):
+        '''Returns the cached history, unless the client already has it.
+
+        Args:
+            version: The version of the snapshot the client has
+
+        Returns:
+            cache.HistorySnapshot or None
+        '''
+        snapshot = self.cache.snapshot()
+        return None if snapshot.version == version else snapshot
+
+    def _handle(self, request):
+        '''Runs a request.
+
+        Args:
+            request: A tuple of the command and its arguments
+
+        Returns:
+            A tuple of "ok" and the result or "error" and the error message
+            tuple
+        '''
+        if request[0] not in self._commands:
+            return "error", "Unknown command %s" % request[0]
+
+        try:
+            return "ok", self._commands[request[0]](*request[1:])
+        except Exception as e:
+            logging.exception("Daemon request %r failed" % (request[:1],))
+            return "error", str(e)
+
+    def _serve(self, connection):
+        '''Answers the requests of a client until it disconnects or the
+        daemon stops.
+
+        Args:
+            connection: The multiprocessing.connection of the client
+        '''
+        try:
+            while self._running:
+                if connection.poll(POLL_INTERVAL):
+                    connection.send(self._handle(connection.recv()))
+        except (EOFError, IOError):
+            pass
+        finally:
+            connection.close()
+
+            database.closeConnection()
+
+    def run(self):
+        '''Accepts connections until stop is called.
+
+        The key of the daemon is written to KEY_FILE before listening.
+        '''
+        with open(KEY_FILE, "wb") as f:
+            f.write(self.authkey)
+
+        listener = Listener(self.address, authkey=self.authkey)
+        logging.info("Daemon listening on %s" % self.address)
+
+        while self._running:
+            try:
+                connection = listener.accept()
+            except (EOFError, IOError, AuthenticationError):
+                if self._running:
+                    logging.exception("Could not accept a daemon connection")
+                continue
+
+            if not self._running:
+                connection.close()
+                break
+
+            thread = QThread()
+            thread.run = partial(self._serve, connection)
+            thread.start()
+
+            self._threads = [each for each in self._threads if each.isRunning()] + [thread]
+
+        listener.close()
+
+        for thread in self._threads:
+            thread.wait()
+
+    def stop(self):
+        '''Lets the server thread and the connection threads exit.
+
+        The server thread is woken up from waiting for a connection by
+        connecting to it.
+        '''
+        self._running = False
+        try:
+            Client(self.address, authkey=self.authkey).close()
+        except Exception:
+            pass
+
+
+class DaemonClient(object):
+    '''Talks to the daemon, providing the same methods as history.LocalHistory.
+
+    Every thread gets its own connection, so e.g. a search never delays
+    showing the history. If the daemon has been restarted, the request is
+    retried on a new connection.
+
+    If the daemon can not be reached at all, e.g. because it has crashed,
+    the methods used by the ui log the error and start a new daemon in
+    the background instead of raising, so the hotkey keeps working. Until
+    the daemon is back, the last received history is shown.
+    '''
+
+    def __init__(self, address=ADDRESS):
+        '''Constructs the client, without connecting.
+
+        Args:
+            address: The address of the daemon (default: {ADDRESS})
+        '''
+        self.address = address
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._snapshot = HistorySnapshot(0, (), ())
+        self._daemonVersion = None
+        self._lastRestart = None
+
+    def _connection(self):
+        '''Returns the connection of the current thread, connecting if needed.
+
+        Returns:
+            multiprocessing.connection.Connection
+        '''
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            with open(KEY_FILE, "rb") as f:
+                authkey = f.read()
+            connection = self._local.connection = Client(self.address, authkey=authkey)
+        return connection
+
+    def close(self):
+        '''Closes the connection of the current thread.
+        '''
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection.close()
+
+    def call(self, command, *args):
+        '''Sends a request to the daemon and returns its result.
+
+        Args:
+            command: The name of the command
+            *args: The arguments of the command
+
+        Returns:
+            The result of the command
+
+        Raises:
+            DaemonUnreachable: If the daemon can not be reached
+            DaemonError: If the command fails
+        '''
+        for attempt in range(2):
+            try:
+                connection = self._connection()
+                connection.send((command,) + args)
+                status, result = connection.recv()
+                break
+            except (EOFError, IOError, OSError, AuthenticationError) as e:
+                # The daemon might have been restarted, so the cached
+                # history can not be trusted either
+                self.close()
+                self._daemonVersion = None
+                if attempt:
+                    raise DaemonUnreachable("Could not reach the daemon: %s" % e)
+
+        if status != "ok":
+            raise DaemonError(result)
+        return result
+
+    def _restart(self):
+        '''Starts a new daemon, unless one has been started within the last
+        START_TIMEOUT seconds.
+
+        This does not wait for the daemon to start.
+        '''
+        now = time.time()
+        if self._lastRestart is not None and now - self._lastRestart < START_TIMEOUT:
+            return
+
+        self._lastRestart = now
+        logging.info("Starting the daemon")
+        spawn()
+
+    def _tryCall(self, default, command, *args):
+        '''Sends a request to the daemon, restarting the daemon if it can not
+        be reached.
+
+        A request failing in a running daemon, e.g. setting an entry whose
+        data is missing, is only logged.
+
+        Args:
+            default: The result to return if the request fails
+            command: The name of the command
+            *args: The arguments of the command
+
+        Returns:
+            The result of the command or the default
+        '''
+        try:
+            return self.call(command, *args)
+        except DaemonUnreachable as e:
+            logging.error("Daemon request %s failed: %s" % (command, e))
+            self._restart()
+            return default
+        except DaemonError as e:
+            logging.error("Daemon request %s failed: %s" % (command, e))
+            return default
+
+    def ping(self):
+        '''Checks whether the daemon is running.
+
+        Returns:
+            bool
+        '''
+        try:
+            return self.call("ping")
+        except DaemonError:
+            return False
+
+    def snapshot(self):
+        '''Returns the latest entries, only transferring them if they
+        changed since the last call.
+
+        The versions of the returned snapshots are counted by the client,
+        so they keep increasing even if the daemon is restarted.
+
+        Returns:
+            The latest snapshot, or the last received one if the daemon
+            can not be reached
+            cache.HistorySnapshot
+        '''
+        with self._lock:
+            remote = self._tryCall(None, "snapshot", self._daemonVersion)
+            if remote is not None:
+                self._daemonVersion = remote.version
+                self._snapshot = HistorySnapshot(self._snapshot.version + 1, remote.entries, remote.pinned)
+            return self._snapshot
+
+    def readLatest(self, count, beforeId=None):
+        '''Returns the latest entries stored in the database, see database.readLatest.
+        '''
+        return self._tryCall([], "readLatest", count, beforeId)
+
+    def entryId(self, dataHash):
+        '''Returns the id of an entry, see database.entryId.
+        '''
+        return self._tryCall(None, "entryId", dataHash)
+
+    def search(self, text):
+        '''Returns the entries best matching the text, see search.Searcher.find.
+
+        Returns None, the same as a cancelled search, if the daemon can not
+        be reached.
+        '''
+        return self._tryCall(None, "search", text)
+
+    def set(self, entry):
+        '''Sets the clipboard to an entry, see clipboard.set.
+        '''
+        self._tryCall(None, "set", entry)
+
+    def pin(self, entry):
+        '''Pins an entry, see clipboard.pin.
+        '''
+        self._tryCall(None, "pin", entry)
+
+    def unpin(self, entry):
+        '''Unpins an entry, see clipboard.unpin.
+        '''
+        self._tryCall(None, "unpin", entry)
+
+
+class RemoteSearcher(Searcher):
+    '''A search.Searcher running the queries in the daemon.
+
+    The queries can not be cancelled once sent, but the results of
+    replaced queries are still dropped.
+    '''
+
+    def __init__(self, client):
+        '''Constructs the searcher without a query.
+
+        Args:
+            client: The DaemonClient to search through
+        '''
+        super(RemoteSearcher, self).__init__()
+        self.client = client
+
+    def find(self, text, cancelled=None):
+        '''Returns the entries best matching the text, found by the daemon.
+
+        Args:
+            text: The text to search for
+            cancelled: A callable returning True to cancel the search (default: {None})
+
+        Returns:
+            A list of clipboard history entries, best match first, or None if
+            the search has been cancelled
+            list
+        '''
+        entries = self.client.search(text)
+        if cancelled is not None and cancelled():
+            return None
+        return entries
+
+
+def spawn():
+    '''Starts the daemon in a new process, detached from this one.
+    '''
+    if getattr(sys, "frozen", False):
+        command = [sys.executable, "--daemon"]
+    else:
+        command = [sys.executable, os.path.abspath(sys.argv[0]), "--daemon"]
+
+    subprocess.Popen(command, close_fds=True,
+                     creationflags=_DETACHED_PROCESS | _CREATE_NEW_PROCESS_GROUP)
+
+
+def connect(address=ADDRESS, wait=True):
+    '''Returns a client of the daemon, starting the daemon if it is not running.
+
+    Args:
+        address: The address of the daemon (default: {ADDRESS})
+        wait: Whether to wait for a started daemon to answer (default: {True})
+
+    Returns:
+        DaemonClient
+
+    Raises:
+        DaemonUnreachable: If waiting and the started daemon does not answer within START_TIMEOUT
+    '''
+    client = DaemonClient(address)
+    if client.ping():
+        return client
+
+    client._restart()
+    if not wait:
+        return client
+
+    deadline = time.time() + START_TIMEOUT
+    while not client.ping():
+        if time.time() > deadline:
+            raise DaemonUnreachable("The daemon did not start")
+        time.sleep(.1)
+    return client
+
+
+def run(address=ADDRESS):
+    '''Runs the daemon until a client asks it to quit.
+
+    If a daemon is already running, this returns straight away.
+
+    Args:
+        address: The address to listen on (default: {ADDRESS})
+    '''
+    if DaemonClient(address).ping():
+        logging.info("The daemon is already running")
+        return
+
+    app = QCoreApplication(sys.argv)
+
+    config.reload()
+    configWatcher = config.ConfigWatcher()
+
+    capture = Capture()
+    capture.start()
+    capture.startBackground()
+
+    server = DaemonServer(capture.cache, capture.searcher, address)
+    server.quitRequested.connect(app.quit)
+
+    serverThread = QThread()
+    serverThread.run = server.run
+    serverThread.start()
+
+    app.exec_()
+
+    server.stop()
+    serverThread.wait()
+
+    capture.stop()
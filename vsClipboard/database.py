@@ -1,40 +1,250 @@
+'''Storing and reading the clipboard history.
+
+The history is stored in a sqlite database called clipboard_database in
+the same directory where the application is running.
+
+Every thread has its own connection to the database, which it closes
+with closeConnection before exiting. This module does not depend on Qt,
+so the command line can read the history without importing PySide.
+
+The clipboard data is stored once per unique content in the payloads
+table, keyed by a sha1 hash of the data, with the different clipboard
+formats in separate columns, alongside some metadata used for displaying
+and expiring entries without having to load the actual clipboard data.
+
+Payloads larger than the configured threshold are stored compressed in
+files in the clipboard_payloads directory instead, with only their
+metadata in the payloads table. Entries read from the database do not
+contain the data of such payloads, which is read by loadPayload only once
+it is actually needed.
+
+The history table lists the entries in the order they were copied, each
+referencing its payload by hash. Copying something which is already in
+the history moves its entry to the top instead of storing it again.
+
+The history is searchable through the history_search full-text index,
+which is kept up to date by triggers on the history table, so every
+write updates it in the same transaction. Payloads stored in files are
+only searchable by their preview. If sqlite is built without FTS5, the
+search falls back to scanning the history.
+
+Entries can be pinned, which adds their hash to the small pins table.
+Pinned entries are read all at once by readPinned and are never deleted
+by the retention policies.
+
+Older versions of the application stored the entries as pickled
+dictionaries in a table called entries. Those are moved over to the
+history table in the background by migrateLegacy().
+
+Attributes:
+    FLAG_TEXT: Type flag for entries containing text data
+    FLAG_UNICODE: Type flag for entries containing unicode data
+    FLAG_HTML: Type flag for entries containing HTML data
+    FLAG_FILE: Type flag for entries containing a list of files
+    FLAG_EXTERNAL: Flag for payloads stored in files outside of the database
+    FLAG_IMAGE: Type flag for file entries of images stored by the images module
+    DATABASE_FILE: The path of the database
+    PAYLOADS_DIR: The directory the external payloads are stored in
+'''
 import cPickle
+import hashlib
+import logging
+import os
 import sqlite3
+import threading
+import time
+import zlib
+
+from cache import entrySize
+from imageFiles import deleteImage
+from preview import makePreview
+
+
+FLAG_TEXT = 1
+FLAG_UNICODE = 2
+FLAG_HTML = 4
+FLAG_FILE = 8
+FLAG_EXTERNAL = 16
+FLAG_IMAGE = 32
 
-from PySide.QtCore import QThread
+DATABASE_FILE = "clipboard_database"
 
+PAYLOADS_DIR = "clipboard_payloads"
 
-def _createTable(connection):
-    '''Creates the entries table in the database
+_PARTS = ("text", "unicode", "html")
 
-    Creates a table called entries with the following
+_CHUNK_SIZE = 1024 * 1024
+
+_COLUMNS = "h.id, h.hash, p.text, p.unicode, p.html, p.flags, p.preview, p.lines, p.chars"
+
+_FROM = "history h JOIN payloads p ON p.hash = h.hash"
+
+# Images are searchable by their preview, instead of their path
+# Pinned entries are exempt from the retention policies
+_UNPINNED = "hash NOT IN (SELECT hash FROM pins)"
+
+_SEARCH_BODY = "CASE WHEN p.flags & %d THEN p.preview " \
+               "ELSE coalesce(p.unicode, CAST(p.text AS TEXT), p.preview) END" % FLAG_IMAGE
+
+_local = threading.local()
+
+
+def _createTables(connection):
+    '''Creates the payloads and history tables in the database
+
+    Creates a table called payloads with the following
     fields
 
-    - id - INTEGER PRIMARY KEY
-    - data - BLOB
+    - hash - TEXT PRIMARY KEY (sha1 of the clipboard data)
+    - size - INTEGER (size of the clipboard data in bytes)
+    - flags - INTEGER (combination of the FLAG_* type flags)
+    - preview - TEXT (a short version of the text for displaying)
+    - lines - INTEGER (number of lines of the text)
+    - chars - INTEGER (number of characters of the text)
+    - text - BLOB
+    - unicode - TEXT
+    - html - BLOB
+
+    and a table called history with the following fields
+
+    - id - INTEGER PRIMARY KEY AUTOINCREMENT
+    - created - REAL (unix timestamp of when the entry was recorded)
+    - hash - TEXT UNIQUE (the hash of the payload of the entry)
+
+    The ids are never reused, so they can be used for paging through
+    the history even while old entries are being deleted.
+
+    If there is a legacy entries table, the id sequence is started after
+    its last id, so the migrated entries keep their ids and order.
+
+    The database is switched to incremental auto vacuum before the
+    tables are created, so space freed by the retention policies can
+    be reclaimed without a full VACUUM.
 
     Args:
         connection: The connection to the database
     '''
     cursor = connection.cursor()
-    cursor.execute("CREATE TABLE entries(id INTEGER PRIMARY KEY, data BLOB)")
+    cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    cursor.execute("CREATE TABLE payloads("
+                   "hash TEXT PRIMARY KEY, "
+                   "size INTEGER NOT NULL, "
+                   "flags INTEGER NOT NULL, "
+                   "preview TEXT, "
+                   "lines INTEGER, "
+                   "chars INTEGER, "
+                   "text BLOB, "
+                   "unicode TEXT, "
+                   "html BLOB)")
+    cursor.execute("CREATE TABLE history("
+                   "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                   "created REAL NOT NULL, "
+                   "hash TEXT NOT NULL)")
+    cursor.execute("CREATE INDEX history_created ON history(created)")
+    cursor.execute("CREATE UNIQUE INDEX history_hash ON history(hash)")
+
+    if _hasTable(connection, "entries"):
+        lastId = cursor.execute("SELECT max(id) FROM entries").fetchone()[0]
+        cursor.execute("INSERT INTO sqlite_sequence(name, seq) VALUES ('history', ?)",
+                       [lastId or 0])
+
+    connection.commit()
+
+
+def _createSearch(connection):
+    '''Creates the full-text index of the history and fills it in
+
+    The index is a FTS5 table called history_search, with the rowids
+    matching the ids of the history entries, so the newest matches
+    can be read first. Triggers add and remove the entries from the
+    index together with the history.
+
+    Args:
+        connection: The connection to the database
+
+    Returns:
+        True if the index exists, False if FTS5 is not available
+        bool
+    '''
+    if _hasTable(connection, "history_search"):
+        return True
+
+    cursor = connection.cursor()
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE history_search USING fts5(body, prefix = '1 2 3')")
+    except sqlite3.OperationalError as e:
+        if "fts5" not in str(e):
+            raise
+        logging.info("FTS5 is not available, searching will scan the history")
+        return False
+
+    cursor.execute("CREATE TRIGGER history_search_insert AFTER INSERT ON history BEGIN "
+                   "INSERT INTO history_search(rowid, body) "
+                   "SELECT new.id, %s FROM payloads p WHERE p.hash = new.hash; "
+                   "END" % _SEARCH_BODY)
+    cursor.execute("CREATE TRIGGER history_search_delete AFTER DELETE ON history BEGIN "
+                   "DELETE FROM history_search WHERE rowid = old.id; "
+                   "END")
+    cursor.execute("INSERT INTO history_search(rowid, body) SELECT h.id, %s FROM %s" % (_SEARCH_BODY, _FROM))
+    connection.commit()
+
+    return True
+
+
+def _createPins(connection):
+    '''Creates the pins table if it does not already exist
+
+    Creates a table called pins with the following fields
+
+    - hash - TEXT PRIMARY KEY (the hash of the payload of the pinned entry)
+    - pinned - REAL (unix timestamp of when the entry was pinned)
+
+    Args:
+        connection: The connection to the database
+    '''
+    if _hasTable(connection, "pins"):
+        return
+
+    connection.execute("CREATE TABLE pins(hash TEXT PRIMARY KEY, pinned REAL NOT NULL)")
     connection.commit()
 
 
+def _hasTable(connection, name):
+    '''Checks whether a table exists in the database
+
+    Args:
+        connection: The connection to the database
+        name: The name of the table
+
+    Returns:
+        True if the table exists, False otherwise
+        bool
+    '''
+    return connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = ?",
+                              [name]).fetchone() is not None
+
+
 def _initConnection():
     '''Connects to the database
 
-    Also creates the entries table if it does not already
-    exist.
+    Also creates the tables if they do not already exist.
+
+    The database uses write-ahead logging, so reading never waits on
+    writing and commits do not need to wait for a full sync to disk.
 
     Returns:
         Database connection
         sqlite3.Connection
     '''
-    connection = sqlite3.connect("clipboard_database")
+    connection = sqlite3.connect(DATABASE_FILE)
+
+    if not _hasTable(connection, "history"):
+        _createTables(connection)
+    _createSearch(connection)
+    _createPins(connection)
 
-    if not connection.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
-        _createTable(connection)
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
 
     return connection
 
@@ -42,7 +252,7 @@ def _initConnection():
 def _getConnection():
     '''Gets or creates a database connection and returns it
 
-    The connection is stored on the thread so we don't have to
+    The connection is stored per thread so we don't have to
     create and close it every time we need to use the database,
     as that happens multiple times a second.
 
@@ -50,15 +260,231 @@ def _getConnection():
         Database connection
         sqlite3.Connection
     '''
-    t = QThread.currentThread()
-    if not hasattr(t, "dbConnection"):
-        setattr(t, "dbConnection", _initConnection())
-    return getattr(t, "dbConnection")
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        connection = _local.connection = _initConnection()
+    return connection
+
+
+def closeConnection():
+    '''Closes the database connection of the current thread, if it has one
+
+    Returns:
+        Whether there was a connection to close
+        bool
+    '''
+    connection = getattr(_local, "connection", None)
+    if connection is None:
+        return False
+
+    _local.connection = None
+    connection.close()
+    return True
+
+
+def _toRow(data):
+    '''Converts a clipboard history entry to the columns of the payloads table
+
+    The list of files of file entries is stored in the text column as
+    utf-8 encoded lines.
+
+    The preview is normally created on capture, see clipboard.save, and is
+    only created here for entries which come without one.
+
+    If the entry has the "external" key set, the data is meant to be
+    stored in files, see _insert.
+
+    The size of image entries includes the size of the image file, passed
+    in the "imageBytes" key, so the images count towards the size limit of
+    the history.
+
+    Args:
+        data: A dictionary representing a clipboard history
+        entry
+
+    Returns:
+        A tuple of (hash, size, flags, preview, lines, chars, text, unicode, html)
+        tuple
+    '''
+    if "preview" not in data:
+        data = dict(data, **makePreview(data))
+
+    text = data["text"]
+    _unicode = data["unicode"]
+    html = data["html"]
+
+    flags = 0
+    if data["hasFile"]:
+        flags |= FLAG_FILE
+        text = u"\n".join(text)
+    if text:
+        flags |= FLAG_TEXT
+        text = text.encode("utf-8") if isinstance(text, unicode) else text
+    if _unicode:
+        flags |= FLAG_UNICODE
+    if html:
+        flags |= FLAG_HTML
+    if data.get("hasImage"):
+        flags |= FLAG_IMAGE
+
+    h = hashlib.sha1(str(flags))
+    size = 0
+    for each in (text, _unicode.encode("utf-8") if _unicode else None, html):
+        each = each or ""
+        h.update("%d:" % len(each))
+        h.update(each)
+        size += len(each)
+    size += data.get("imageBytes", 0)
+
+    # Where the payload is stored does not change its hash
+    if data.get("external"):
+        flags |= FLAG_EXTERNAL
+
+    return (h.hexdigest(), size, flags, data["preview"], data["lines"], data["chars"],
+            sqlite3.Binary(text) if text else None,
+            _unicode or None,
+            sqlite3.Binary(html) if html else None)
+
+
+def _payloadPath(dataHash, part):
+    '''Returns the path of the file storing a part of an external payload
+
+    Args:
+        dataHash: The hash of the payload
+        part: One of "text", "unicode" or "html"
+
+    Returns:
+        The path of the file
+        str
+    '''
+    return os.path.join(PAYLOADS_DIR, "%s.%s.z" % (dataHash, part))
+
+
+def _writeExternal(dataHash, parts):
+    '''Stores the parts of a payload as compressed files
+
+    The data is compressed a chunk at a time, so no compressed copy of
+    the whole payload is ever kept in memory.
+
+    Args:
+        dataHash: The hash of the payload
+        parts: A tuple of the text, unicode (utf-8 encoded) and html data
+    '''
+    if not os.path.isdir(PAYLOADS_DIR):
+        os.makedirs(PAYLOADS_DIR)
+
+    for part, data in zip(_PARTS, parts):
+        if not data:
+            continue
+
+        compressor = zlib.compressobj(1)
+        with open(_payloadPath(dataHash, part), "wb") as f:
+            for i in xrange(0, len(data), _CHUNK_SIZE):
+                f.write(compressor.compress(buffer(data, i, _CHUNK_SIZE)))
+            f.write(compressor.flush())
+
+
+def _deleteExternal(dataHashes):
+    '''Deletes the files of external payloads
+
+    Args:
+        dataHashes: A list of the hashes of the payloads
+    '''
+    for dataHash in dataHashes:
+        for part in _PARTS:
+            path = _payloadPath(dataHash, part)
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    logging.error("Could not delete payload file %s" % path)
+
+
+def loadPayload(entry):
+    '''Returns the entry with its data read from the payload files if it is
+    stored externally
+
+    The files are decompressed a chunk at a time.
+
+    Args:
+        entry: A dictionary representing a clipboard history entry
+
+    Returns:
+        The entry with its data or None if its payload files are missing
+        dict
+    '''
+    if not entry.get("external"):
+        return entry
+
+    loaded = dict(entry, external=False)
+    for part in _PARTS:
+        path = _payloadPath(entry["hash"], part)
+        if not os.path.exists(path):
+            loaded[part] = None
+            continue
+
+        decompressor = zlib.decompressobj()
+        chunks = []
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(_CHUNK_SIZE), ""):
+                chunks.append(decompressor.decompress(chunk))
+        chunks.append(decompressor.flush())
+        loaded[part] = "".join(chunks)
+
+    if not (loaded["text"] or loaded["unicode"] or loaded["html"]):
+        logging.error("Missing payload files of entry %s" % entry["hash"])
+        return None
+
+    if loaded["unicode"]:
+        loaded["unicode"] = loaded["unicode"].decode("utf-8")
+    if loaded["hasFile"] and loaded["text"]:
+        loaded["text"] = tuple(loaded["text"].decode("utf-8").split(u"\n"))
+
+    return loaded
+
+
+def _fromRow(row):
+    '''Converts a row of the payloads table back to a clipboard history entry
+
+    Args:
+        row: A tuple of the columns listed in _COLUMNS
+
+    Returns:
+        A dictionary representing a clipboard history entry, in the format
+        specified in clipboard.getData, with additional "id", "hash", "preview",
+        "lines", "chars" and "external" keys. The data of external entries
+        is None, until they are passed to loadPayload.
+        dict
+    '''
+    _id, _hash, text, _unicode, html, flags, preview, lines, chars = row
+
+    text = str(text) if text is not None else None
+    if flags & FLAG_FILE and text is not None:
+        text = tuple(text.decode("utf-8").split(u"\n"))
+
+    return {
+        "id": _id,
+        "hash": str(_hash),
+        "text": text,
+        "unicode": _unicode,
+        "html": str(html) if html is not None else None,
+        "hasFile": bool(flags & FLAG_FILE),
+        "hasImage": bool(flags & FLAG_IMAGE),
+        "preview": preview,
+        "lines": lines,
+        "chars": chars,
+        "external": bool(flags & FLAG_EXTERNAL)
+    }
 
 
 def read():
     '''Reads the database and returns all entries as list
 
+    This loads the full history, so it should only be used when
+    all of it is actually needed. For displaying the history use
+    readLatest, which stays fast regardless of the size of the
+    table.
+
     Returns:
         A list of clipboard history entries
         list
@@ -66,26 +492,673 @@ def read():
     connection = _getConnection()
 
     cursor = connection.cursor()
-    cursor.execute("SELECT data from entries")
+    cursor.execute("SELECT %s FROM %s ORDER BY h.id" % (_COLUMNS, _FROM))
 
-    data = [cPickle.loads(str(row[0])) for row in cursor.fetchall()]
+    data = [_fromRow(row) for row in cursor.fetchall()]
 
     return data
 
 
+def readLatest(count, beforeId=None):
+    '''Reads the newest entries in the database, newest first
+
+    Only the requested amount of rows is read, as the rows are walked
+    backwards through the primary key index.
+
+    Passing beforeId allows for paging through older entries, by
+    passing the id of the oldest entry of the previous page.
+
+    Each entry has additional "id" and "hash" keys containing the id of
+    the row it was read from and the hash of its data, as well as the
+    "preview", "lines" and "chars" created on capture.
+
+    Args:
+        count: The maximum amount of entries to read
+        beforeId: Only read entries older than this id (default: {None})
+
+    Returns:
+        A list of clipboard history entries, newest first
+        list
+    '''
+    connection = _getConnection()
+
+    cursor = connection.cursor()
+    if beforeId is None:
+        cursor.execute("SELECT %s FROM %s ORDER BY h.id DESC LIMIT ?" % (_COLUMNS, _FROM), [count])
+    else:
+        cursor.execute("SELECT %s FROM %s WHERE h.id < ? ORDER BY h.id DESC LIMIT ?" % (_COLUMNS, _FROM),
+                       [beforeId, count])
+
+    return [_fromRow(row) for row in cursor.fetchall()]
+
+
+def iterLatest(beforeId=None):
+    '''Iterates over the entries in the database, newest first
+
+    The rows are read from the cursor as they are consumed, so walking
+    the whole history runs in constant memory. The cursor is held open
+    until the iteration is finished.
+
+    Args:
+        beforeId: Only read entries older than this id (default: {None})
+
+    Yields:
+        The clipboard history entries, newest first, in the same format as
+        returned by readLatest
+        dict
+    '''
+    cursor = _getConnection().cursor()
+    if beforeId is None:
+        cursor.execute("SELECT %s FROM %s ORDER BY h.id DESC" % (_COLUMNS, _FROM))
+    else:
+        cursor.execute("SELECT %s FROM %s WHERE h.id < ? ORDER BY h.id DESC" % (_COLUMNS, _FROM), [beforeId])
+
+    try:
+        for row in cursor:
+            yield _fromRow(row)
+    finally:
+        cursor.close()
+
+
+def iterHistory(batchSize=1000):
+    '''Iterates over the whole history in batches, oldest first
+
+    Each batch is read with a query of its own, continuing after the id
+    of the last entry of the previous batch, so no cursor is held open
+    in between batches and the memory used only depends on the size of
+    a batch.
+
+    Args:
+        batchSize: The maximum number of entries per batch (default: {1000})
+
+    Yields:
+        A list of (entry, created) tuples, where entry is a clipboard history
+        entry in the same format as returned by readLatest and created is the
+        unix timestamp of when it was recorded
+        list
+    '''
+    lastId = 0
+    while True:
+        rows = _getConnection().execute(
+            "SELECT %s, h.created FROM %s WHERE h.id > ? ORDER BY h.id LIMIT ?" % (_COLUMNS, _FROM),
+            [lastId, batchSize]).fetchall()
+        if not rows:
+            return
+
+        lastId = rows[-1][0]
+        yield [(_fromRow(row[:-1]), row[-1]) for row in rows]
+
+
+def readPinned():
+    '''Reads the pinned entries, the latest pinned first
+
+    Returns:
+        A list of clipboard history entries, in the same format as returned
+        by readLatest
+        list
+    '''
+    cursor = _getConnection().execute(
+        "SELECT %s FROM pins n JOIN payloads p ON p.hash = n.hash LEFT JOIN history h ON h.hash = n.hash "
+        "ORDER BY n.pinned DESC" % _COLUMNS)
+    return [_fromRow(row) for row in cursor.fetchall()]
+
+
+def pin(dataHash):
+    '''Pins an entry, unless it is already pinned
+
+    Args:
+        dataHash: The hash of the data of the entry
+    '''
+    connection = _getConnection()
+    connection.execute("INSERT OR IGNORE INTO pins(hash, pinned) VALUES (?, ?)", [dataHash, time.time()])
+    connection.commit()
+
+
+def unpin(dataHash):
+    '''Unpins an entry, leaving it to the retention policies again
+
+    Args:
+        dataHash: The hash of the data of the entry
+    '''
+    connection = _getConnection()
+    connection.execute("DELETE FROM pins WHERE hash = ?", [dataHash])
+    connection.commit()
+
+
+def readEntry(entryId):
+    '''Reads a single entry by its id
+
+    Args:
+        entryId: The id of the entry
+
+    Returns:
+        The clipboard history entry, in the same format as returned by
+        readLatest, or None if there is no such entry
+        dict
+    '''
+    row = _getConnection().execute("SELECT %s FROM %s WHERE h.id = ?" % (_COLUMNS, _FROM),
+                                   [entryId]).fetchone()
+    return _fromRow(row) if row else None
+
+
+def stats():
+    '''Returns statistics of the stored history
+
+    Returns:
+        A dictionary with the number of "entries", their total "size" in
+        bytes, the number of "external", "image" and "pinned" entries, the
+        unix timestamps of the "oldest" and "newest" entries and the size
+        of the database file in "databaseBytes"
+        dict
+    '''
+    row = _getConnection().execute(
+        "SELECT count(*), coalesce(sum(p.size), 0), "
+        "coalesce(sum((p.flags & ?) != 0), 0), coalesce(sum((p.flags & ?) != 0), 0), "
+        "min(h.created), max(h.created) FROM %s" % _FROM, [FLAG_EXTERNAL, FLAG_IMAGE]).fetchone()
+
+    return {
+        "entries": row[0],
+        "size": row[1],
+        "external": row[2],
+        "image": row[3],
+        "pinned": _getConnection().execute("SELECT count(*) FROM pins").fetchone()[0],
+        "oldest": row[4],
+        "newest": row[5],
+        "databaseBytes": os.path.getsize(DATABASE_FILE)
+    }
+
+
+def _searchQuery(text):
+    '''Converts the text typed by the user to a FTS5 query
+
+    Every word of the text is matched as a prefix, so the results are
+    narrowed down while the user is typing.
+
+    Args:
+        text: The text to search for
+
+    Returns:
+        The FTS5 query
+        unicode
+    '''
+    return u" ".join(u'"%s"*' % word.replace(u'"', u'""') for word in text.split())
+
+
+def search(text, count, cancelled=None):
+    '''Searches the history for entries containing all words of the text,
+    newest first
+
+    The matching ids are read straight from the full-text index in
+    reverse order, so only the requested amount of entries is ever
+    looked at.
+
+    The search can be cancelled, e.g. once the user has typed some more,
+    by passing a callable which returns True once the results are no
+    longer needed. It is checked periodically while the query runs.
+
+    Args:
+        text: The text to search for
+        count: The maximum amount of entries to return
+        cancelled: A callable returning True to cancel the search (default: {None})
+
+    Returns:
+        A list of clipboard history entries, newest first, or None if
+        the search has been cancelled
+        list
+    '''
+    words = text.split()
+    if not words:
+        return []
+
+    connection = _getConnection()
+    if cancelled is not None:
+        connection.set_progress_handler(cancelled, 1000)
+
+    cursor = connection.cursor()
+    try:
+        if _hasTable(connection, "history_search"):
+            cursor.execute("SELECT %s FROM %s WHERE h.id IN "
+                           "(SELECT rowid FROM history_search WHERE history_search MATCH ? "
+                           "ORDER BY rowid DESC LIMIT ?) "
+                           "ORDER BY h.id DESC" % (_COLUMNS, _FROM),
+                           [_searchQuery(text), count])
+        else:
+            cursor.execute("SELECT %s FROM %s WHERE %s ORDER BY h.id DESC LIMIT ?" % (
+                           _COLUMNS, _FROM, " AND ".join(["%s LIKE ?" % _SEARCH_BODY] * len(words))),
+                           [u"%%%s%%" % word for word in words] + [count])
+        return [_fromRow(row) for row in cursor.fetchall()]
+    except sqlite3.OperationalError:
+        if cancelled is not None and cancelled():
+            return None
+        raise
+    finally:
+        if cancelled is not None:
+            connection.set_progress_handler(None, 1000)
+
+
+def readSearchText(chars, batchSize=1000, afterId=0):
+    '''Reads the beginning of the text of entries, oldest first
+
+    The text is the same which gets indexed by the full-text index,
+    truncated to the requested amount of characters.
+
+    Args:
+        chars: The maximum amount of characters to read for each entry
+        batchSize: The maximum amount of entries to read (default: {1000})
+        afterId: Only read entries newer than this id (default: {0})
+
+    Returns:
+        A list of (id, hash, text) tuples, oldest first
+        list
+    '''
+    cursor = _getConnection().execute(
+        "SELECT h.id, h.hash, substr(%s, 1, ?) FROM %s WHERE h.id > ? ORDER BY h.id LIMIT ?" % (
+            _SEARCH_BODY, _FROM),
+        [chars, afterId, batchSize])
+    return [(_id, str(_hash), text or u"") for _id, _hash, text in cursor.fetchall()]
+
+
+def readByHashes(hashes):
+    '''Reads the entries with the passed in hashes
+
+    Args:
+        hashes: A list of the hashes of the entries
+
+    Returns:
+        A list of clipboard history entries in the order of the hashes.
+        Hashes which are not in the history are skipped.
+        list
+    '''
+    if not hashes:
+        return []
+
+    cursor = _getConnection().execute(
+        "SELECT %s FROM %s WHERE h.hash IN (%s)" % (_COLUMNS, _FROM, ", ".join("?" * len(hashes))),
+        hashes)
+    entries = dict((entry["hash"], entry) for entry in (_fromRow(row) for row in cursor.fetchall()))
+    return [entries[each] for each in hashes if each in entries]
+
+
+def hashData(data):
+    '''Returns the hash identifying the passed in data in the database
+
+    Args:
+        data: A dictionary representing a clipboard history
+        entry
+
+    Returns:
+        The sha1 hash of the data as a hex string
+        str
+    '''
+    return _toRow(data)[0]
+
+
+def latestHash():
+    '''Returns the hash of the newest entry in the history
+
+    Returns:
+        The hash of the newest entry or None if the history is empty
+        str
+    '''
+    row = _getConnection().execute("SELECT hash FROM history ORDER BY id DESC LIMIT 1").fetchone()
+    return str(row[0]) if row else None
+
+
+def entryId(dataHash):
+    '''Returns the id of the entry with the passed in hash
+
+    Args:
+        dataHash: The hash of the data of the entry
+
+    Returns:
+        The id of the entry or None if it is not in the history
+        int
+    '''
+    row = _getConnection().execute("SELECT id FROM history WHERE hash = ?", [dataHash]).fetchone()
+    return row[0] if row else None
+
+
+def _insert(cursor, row, created, _id=None):
+    '''Inserts an entry to the history, storing its payload if it is new
+
+    If the payload is already referenced by a newer entry, nothing is
+    inserted in the history.
+
+    External payloads are written to files, unless they are already
+    stored, and their data columns are left empty.
+
+    Args:
+        cursor: The cursor to execute the statements with
+        row: The payload columns of the entry as returned by _toRow
+        created: The unix timestamp of when the entry was recorded
+        _id: The id of the entry or None to use the next one (default: {None})
+    '''
+    if row[2] & FLAG_EXTERNAL:
+        if not cursor.execute("SELECT 1 FROM payloads WHERE hash = ?", [row[0]]).fetchone():
+            _unicode = row[7].encode("utf-8") if row[7] else None
+            _writeExternal(row[0], (row[6], _unicode, row[8]))
+        row = row[:6] + (None, None, None)
+
+    cursor.execute("INSERT OR IGNORE INTO payloads(hash, size, flags, preview, lines, chars, text, unicode, html) "
+                   "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+    cursor.execute("INSERT OR IGNORE INTO history(id, created, hash) VALUES (?, ?, ?)",
+                   [_id, created, row[0]])
+
+
 def write(data):
     '''Writes the passed in data to the database
 
+    If the same data is already in the history, its entry is moved
+    to the top instead of storing the data again.
+
     Args:
         data: A dictionary representing a clipboard history
         entry
     '''
+    writeMany([(data, time.time())])
+
+
+def writeMany(entries):
+    '''Writes multiple entries to the database in a single transaction
+
+    The entries are written in order, so the last one ends up at the
+    top of the history.
+
+    If writing fails, the transaction is rolled back, so the entries can
+    be written again.
+
+    Args:
+        entries: A list of (data, created) tuples, where data is a
+        dictionary representing a clipboard history entry and created
+        is the unix timestamp of when it was recorded
+    '''
+    connection = _getConnection()
+
+    cursor = connection.cursor()
+
+    try:
+        for data, created in entries:
+            row = _toRow(data)
+            cursor.execute("DELETE FROM history WHERE hash = ?", [row[0]])
+            _insert(cursor, row, created)
+    except Exception:
+        connection.rollback()
+        raise
+
+    connection.commit()
+
+
+def importMany(entries):
+    '''Adds entries to the history in a single transaction, skipping the
+    ones which are already in it
+
+    Unlike writeMany, entries which are already in the history are left
+    where they are, so importing the same entries twice does not change
+    the history.
+
+    Args:
+        entries: A list of (data, created) tuples, where data is a
+        dictionary representing a clipboard history entry and created
+        is the unix timestamp of when it was recorded
+
+    Returns:
+        The number of added entries
+        int
+    '''
     connection = _getConnection()
 
-    pickledData = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
+    cursor = connection.cursor()
+
+    added = 0
+    for data, created in entries:
+        row = _toRow(data)
+        if cursor.execute("SELECT 1 FROM history WHERE hash = ?", [row[0]]).fetchone():
+            continue
+
+        _insert(cursor, row, created)
+        added += 1
+
+    connection.commit()
+
+    return added
+
+
+def newestCreated():
+    '''Returns when the newest entry in the history was recorded
+
+    Returns:
+        The unix timestamp of the newest entry or None if the history is empty
+        float
+    '''
+    return _getConnection().execute("SELECT max(created) FROM history").fetchone()[0]
+
+
+def sortHistory():
+    '''Gives the entries new ids in the order they were recorded
+
+    Entries added by importMany get ids above the rest of the history,
+    even if they were recorded before it, so once an older history is
+    imported the entries are renumbered to keep the newest ones on top.
+    The new ids continue after the highest id ever used, so ids are
+    still never reused.
+
+    The whole history is rewritten in a single transaction, so this is
+    only meant to be run after importing.
+    '''
+    connection = _getConnection()
 
     cursor = connection.cursor()
 
-    cursor.execute("INSERT INTO entries(data) VALUES (?)", [sqlite3.Binary(pickledData)])
+    lastId = cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = 'history'").fetchone()
+    cursor.execute("DROP TABLE IF EXISTS temp.history_sorted")
+    cursor.execute("CREATE TEMP TABLE history_sorted(id INTEGER PRIMARY KEY, created REAL, hash TEXT)")
+
+    try:
+        cursor.execute("INSERT INTO history_sorted(created, hash) "
+                       "SELECT created, hash FROM history ORDER BY created, id")
+        cursor.execute("DELETE FROM history")
+        cursor.execute("INSERT INTO history(id, created, hash) SELECT id + ?, created, hash FROM history_sorted",
+                       [lastId[0] if lastId else 0])
+    except Exception:
+        connection.rollback()
+        raise
 
     connection.commit()
+    cursor.execute("DROP TABLE history_sorted")
+
+
+def migrateLegacy(batchSize=100, largePayloadBytes=None):
+    '''Moves a single batch of entries from the legacy entries table to the history table
+
+    The newest entries are moved first and keep their ids, so the most
+    relevant part of the history is available straight away. Once the
+    legacy table is empty it is dropped.
+
+    Call it repeatedly until it returns 0 to migrate all entries.
+
+    Args:
+        batchSize: The maximum number of entries to move (default: {100})
+        largePayloadBytes: The size above which the data is stored outside
+        of the database, or None to always store it in it (default: {None})
+
+    Returns:
+        The number of moved entries
+        int
+    '''
+    connection = _getConnection()
+
+    if not _hasTable(connection, "entries"):
+        return 0
+
+    cursor = connection.cursor()
+
+    # Databases created before the created column was introduced
+    # have no timestamps, so those entries are stamped with the
+    # time of migration
+    columns = [row[1] for row in connection.execute("PRAGMA table_info(entries)")]
+    created = "coalesce(created, %f)" % time.time() if "created" in columns else str(time.time())
+
+    rows = cursor.execute("SELECT id, data, %s FROM entries ORDER BY id DESC LIMIT ?" % created,
+                          [batchSize]).fetchall()
+
+    if not rows:
+        cursor.execute("DROP TABLE entries")
+        connection.commit()
+        return 0
+
+    for _id, blob, timestamp in rows:
+        data = cPickle.loads(str(blob))
+        data["external"] = largePayloadBytes is not None and entrySize(data) > largePayloadBytes
+        _insert(cursor, _toRow(data), timestamp, _id)
+
+    cursor.execute("DELETE FROM entries WHERE id >= ?", [rows[-1][0]])
+    connection.commit()
+
+    return len(rows)
+
+
+def _retentionCutoff(connection, maxEntries, maxBytes):
+    '''Finds the newest entry id which falls outside the count and size policies
+
+    Every entry with an id lower than or equal to the returned one has
+    expired, except for the pinned entries, which are neither counted
+    nor deleted.
+
+    Args:
+        connection: The connection to the database
+        maxEntries: The maximum number of entries to keep, 0 for no limit
+        maxBytes: The maximum total size of the kept entries, 0 for no limit
+
+    Returns:
+        The id of the newest expired entry or 0 if nothing has expired
+        int
+    '''
+    cutoffs = [0]
+
+    if maxEntries:
+        row = connection.execute("SELECT id FROM history WHERE %s ORDER BY id DESC LIMIT 1 OFFSET ?" % _UNPINNED,
+                                 [maxEntries]).fetchone()
+        if row:
+            cutoffs.append(row[0])
+
+    # Summing the sizes in SQL first skips walking the history
+    # while it is within the limit
+    if maxBytes and connection.execute("SELECT coalesce(sum(p.size), 0) FROM %s WHERE h.%s"
+                                       % (_FROM, _UNPINNED)).fetchone()[0] > maxBytes:
+        total = 0
+        for _id, size in connection.execute("SELECT h.id, p.size FROM %s WHERE h.%s ORDER BY h.id DESC"
+                                            % (_FROM, _UNPINNED)):
+            total += size
+            if total > maxBytes:
+                cutoffs.append(_id)
+                break
+
+    return max(cutoffs)
+
+
+def deleteExpired(maxEntries, maxBytes, maxAge, batchSize=100, funcDeleted=None):
+    '''Deletes a single batch of entries falling outside the retention policies
+
+    The oldest entries are deleted first, skipping the pinned ones. Deleting in small batches keeps
+    the write lock short, so the other threads are never blocked for long.
+    Call it repeatedly until it returns 0 to enforce the policies fully.
+
+    The count and size policies are turned into an id cutoff, while the
+    age policy is applied to the time each entry was recorded, as
+    imported entries can be older than entries with lower ids.
+
+    Args:
+        maxEntries: The maximum number of entries to keep, 0 for no limit
+        maxBytes: The maximum total size of the kept entries, 0 for no limit
+        maxAge: The maximum age (in seconds) of the kept entries, 0 for no limit
+        batchSize: The maximum number of entries to delete (default: {100})
+        funcDeleted: A callable to execute with the list of the hashes of the
+        deleted entries, e.g. to remove them from an index (default: {None})
+
+    Returns:
+        The number of deleted entries
+        int
+    '''
+    connection = _getConnection()
+
+    cutoff = _retentionCutoff(connection, maxEntries, maxBytes)
+    createdCutoff = time.time() - maxAge if maxAge else 0
+    if not cutoff and not createdCutoff:
+        return 0
+
+    # The expired entries are selected and deleted in a single write
+    # transaction, so the writer can not move one of them to a new id
+    # in between and be left pointing at deleted files
+    cursor = connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        stored = cursor.execute("SELECT h.id, h.hash, p.flags, CASE WHEN p.flags & ? THEN p.text END FROM %s "
+                                "WHERE (h.id <= ? OR h.created < ?) AND h.%s ORDER BY h.id LIMIT ?"
+                                % (_FROM, _UNPINNED),
+                                [FLAG_IMAGE, cutoff, createdCutoff, batchSize]).fetchall()
+
+        # Every payload is referenced by a single entry, so the payloads
+        # can be deleted together with their entries
+        cursor.executemany("DELETE FROM payloads WHERE hash = ?", [[_hash] for _, _hash, _, _ in stored])
+        cursor.executemany("DELETE FROM history WHERE id = ?", [[_id] for _id, _, _, _ in stored])
+    except Exception:
+        connection.rollback()
+        raise
+
+    connection.commit()
+
+    # The files are only deleted once their rows are, so an entry is
+    # never left pointing at missing files
+    _deleteExternal([str(_hash) for _, _hash, flags, _ in stored if flags & FLAG_EXTERNAL])
+    for _, _, flags, path in stored:
+        if flags & FLAG_IMAGE and path is not None:
+            deleteImage(str(path).decode("utf-8"))
+
+    if funcDeleted is not None:
+        funcDeleted([str(_hash) for _, _hash, _, _ in stored])
+
+    return len(stored)
+
+
+def enableIncrementalVacuum():
+    '''Switches a database created without auto vacuum to incremental auto vacuum
+
+    The mode of an existing database can only be changed by a full
+    VACUUM, which rewrites the whole file, needs about twice its size
+    on disk and locks out writing while it runs. It is therefore never
+    done by the application itself, see the vacuum command of the
+    command line.
+
+    Returns:
+        True if the database was vacuumed, False if it already used incremental auto vacuum
+        bool
+    '''
+    connection = _getConnection()
+
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        return False
+
+    connection.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    connection.execute("VACUUM")
+    return True
+
+
+def vacuum(pages=100):
+    '''Returns up to the specified number of free pages back to the file system
+
+    Databases which do not use incremental auto vacuum are left as
+    they are, with the free pages reused by later writes.
+
+    Args:
+        pages: The maximum number of pages to free (default: {100})
+
+    Returns:
+        The number of free pages left to return to the file system
+        int
+    '''
+    connection = _getConnection()
+    if connection.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return 0
+
+    connection.execute("PRAGMA incremental_vacuum(%d)" % pages).fetchall()
+    return connection.execute("PRAGMA freelist_count").fetchone()[0]
@@ -0,0 +1,55 @@
+'''Access to the clipboard history for the ui.
+
+The ui reads and pastes the clipboard history through a history object,
+which is either a LocalHistory, when the clipboard is captured in the
+same process, or a daemon.DaemonClient, when it is captured by the
+daemon. Both provide the same methods.
+'''
+import clipboard
+import database
+
+
+class LocalHistory(object):
+    '''The clipboard history captured in this process.
+    '''
+
+    def __init__(self, cache=None):
+        '''Constructs the history.
+
+        Args:
+            cache: The cache.HistoryCache of the latest entries (default: {None})
+        '''
+        self.cache = cache
+
+    def snapshot(self):
+        '''Returns the latest entries.
+
+        Returns:
+            cache.HistorySnapshot
+        '''
+        return self.cache.snapshot()
+
+    def readLatest(self, count, beforeId=None):
+        '''Returns the latest entries stored in the database, see database.readLatest.
+        '''
+        return database.readLatest(count, beforeId)
+
+    def entryId(self, dataHash):
+        '''Returns the id of an entry, see database.entryId.
+        '''
+        return database.entryId(dataHash)
+
+    def set(self, entry):
+        '''Sets the clipboard to an entry, see clipboard.set.
+        '''
+        clipboard.set(entry)
+
+    def pin(self, entry):
+        '''Pins an entry, see clipboard.pin.
+        '''
+        clipboard.pin(entry)
+
+    def unpin(self, entry):
+        '''Unpins an entry, see clipboard.unpin.
+        '''
+        clipboard.unpin(entry)
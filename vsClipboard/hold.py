@@ -0,0 +1,188 @@
+'''Detecting whether the paste hotkey is tapped or held.
+
+The detection is a state machine driven by two events - the hotkey being
+pressed and a periodic tick while it is active. Nothing in here blocks or
+waits, so the thread driving it can keep handling its messages.
+
+    IDLE -> PRESSED -> HOLDING -> SHOWN -> RELEASED -> IDLE
+                  \\          \\
+                   -> RELEASED -> IDLE (tapped)
+
+The state of the keys is read through a KeyStateProvider, so the state
+machine can be driven by fake key presses, e.g. for testing.
+'''
+import timeit
+
+import tracing
+
+
+class KeyStateProvider(object):
+    '''The interface for reading the state of keyboard keys.
+    '''
+
+    def isDown(self, keyCode):
+        '''Checks whether a key is currently held down.
+
+        Args:
+            keyCode: The virtual key code of the key
+
+        Returns:
+            True if the key is down, False otherwise
+            bool
+        '''
+        raise NotImplementedError
+
+
+class FakeKeyState(KeyStateProvider):
+    '''Key states which are set by hand instead of read from the keyboard.
+    '''
+
+    def __init__(self):
+        '''Constructs the provider with all keys released.
+        '''
+        self.down = set()
+
+    def press(self, *keyCodes):
+        '''Marks the passed in keys as down.
+
+        Args:
+            *keyCodes: The virtual key codes of the keys
+        '''
+        self.down.update(keyCodes)
+
+    def release(self, *keyCodes):
+        '''Marks the passed in keys as released.
+
+        Args:
+            *keyCodes: The virtual key codes of the keys
+        '''
+        self.down.difference_update(keyCodes)
+
+    def isDown(self, keyCode):
+        '''Checks whether a key is marked as down.
+
+        Args:
+            keyCode: The virtual key code of the key
+
+        Returns:
+            True if the key is down, False otherwise
+            bool
+        '''
+        return keyCode in self.down
+
+
+class HoldStateMachine(object):
+    '''Tracks a single press of a hotkey combination.
+
+    If the keys are released before the hold time has passed, funcTap is
+    executed. Otherwise funcPress is executed once the hold time passes,
+    followed by funcRelease once the keys are released.
+
+    Attributes:
+        IDLE: The hotkey is not pressed
+        PRESSED: The hotkey has just been pressed
+        HOLDING: The hotkey is held, but not for long enough to show
+        SHOWN: The hotkey has been held long enough and funcPress has run
+        RELEASED: The hotkey has been released
+        state: The current state
+    '''
+    IDLE = "idle"
+    PRESSED = "pressed"
+    HOLDING = "holding"
+    SHOWN = "shown"
+    RELEASED = "released"
+
+    def __init__(self, keys, keyState, funcPress, funcRelease, funcTap, clock=timeit.default_timer):
+        '''Constructs the state machine in the idle state.
+
+        Args:
+            keys: The virtual key codes making up the hotkey combination
+            keyState: The KeyStateProvider to read the keys through
+            funcPress: A callable to execute once the keys are held for the hold time
+            funcRelease: A callable to execute once the keys are released after funcPress
+            funcTap: A callable to execute if the keys are released before the hold time
+            clock: A callable returning the current time in seconds (default: {timeit.default_timer})
+        '''
+        self.keys = keys
+        self.keyState = keyState
+        self.funcPress = funcPress
+        self.funcRelease = funcRelease
+        self.funcTap = funcTap
+        self.clock = clock
+
+        self.state = HoldStateMachine.IDLE
+        self.startTime = None
+        self.holdTime = None
+
+    def isActive(self):
+        '''Checks whether the state machine needs to be ticked.
+
+        Returns:
+            True if a press is being tracked, False otherwise
+            bool
+        '''
+        return self.state != HoldStateMachine.IDLE
+
+    def _keysDown(self):
+        '''Checks whether all keys of the combination are down.
+
+        Returns:
+            True if all keys are down, False otherwise
+            bool
+        '''
+        return all(self.keyState.isDown(key) for key in self.keys)
+
+    def press(self, holdTime):
+        '''Starts tracking a press of the hotkey.
+
+        The hotkey can be triggered by releasing a key which has been pressed
+        together with the combination, e.g. releasing A after pressing
+        Ctrl + A + V, in which case the press is ignored.
+
+        Args:
+            holdTime: The time (in seconds) the keys need to be held for
+
+        Returns:
+            True if the press is being tracked and needs to be ticked
+            bool
+        '''
+        if self.isActive() or not self._keysDown():
+            return self.isActive()
+
+        self.state = HoldStateMachine.PRESSED
+        self.startTime = self.clock()
+        self.holdTime = holdTime
+        return True
+
+    def tick(self):
+        '''Advances the state machine based on the current key states and time.
+
+        Returns:
+            True if the press is still being tracked and needs to be ticked
+            bool
+        '''
+        if not self.isActive():
+            return False
+
+        released = not self._keysDown()
+
+        if self.state in (HoldStateMachine.PRESSED, HoldStateMachine.HOLDING):
+            if released:
+                self.state = HoldStateMachine.RELEASED
+                self.funcTap()
+            elif self.clock() - self.startTime > self.holdTime:
+                self.state = HoldStateMachine.SHOWN
+                # How late the hold is noticed, compared to the hold time
+                tracing.record("hold_detection", self.clock() - self.startTime - self.holdTime)
+                self.funcPress()
+            else:
+                self.state = HoldStateMachine.HOLDING
+
+        elif self.state == HoldStateMachine.SHOWN and released:
+            self.state = HoldStateMachine.RELEASED
+            self.funcRelease()
+
+        if self.state == HoldStateMachine.RELEASED:
+            self.state = HoldStateMachine.IDLE
+
+        return self.isActive()
@@ -5,10 +5,16 @@ us with a way to non-destructively register a callback to be fired whenever
 Ctrl + V is pressed and held for more than a threshold (.15 seconds in this
 case).
 
+Detecting the hold is done by a hold.HoldStateMachine, ticked by a Windows
+timer while the hotkey is pressed, so the message loop of the thread is
+never blocked.
+
 Attributes:
     u32: A shortened namespace for ctypes.windll.user32
     V_KEY_CODE: The virtual key code for the "V" key specified in
     https://msdn.microsoft.com/en-us/library/windows/desktop/dd375731(v=vs.85).aspx
+    TICK_INTERVAL: How often (in milliseconds) to check the keys while the
+    hotkey is pressed
 '''
 from ctypes import wintypes
 from PySide.QtCore import *
@@ -19,69 +25,38 @@ import win32con
 import win32api
 
 import threading
-import time
 
 import config
+import database
+import tracing
+from hold import KeyStateProvider, HoldStateMachine
 
 u32 = ctypes.windll.user32  # Make it easier to access the namespace
 
 V_KEY_CODE = ord("V")  # The key code for the "V" key that needs to be passed to win functions
 
+TICK_INTERVAL = 10
 
-def _hold(funcPress, funcRelease):
-    '''This function is triggered on pressing the paste hotkey and waits for a release.
-
-    Whenever the user pesses the paste key combination, this function gets the current
-    state of the "V" key in order to detect whether the key was just tapped or is
-    being held down.
-
-    If it is just being tapped, then we wait for a release and just trigger the normal
-    paste functionality, before exiting.
-
-    If it is being held pressed down for more than .15 seconds, then the funcPress
-    callable is executed, followed by a while loop waiting for the key to be released.
-    Once it is released the funcRelease callable is executed.
 
-    Args:
-        funcPress: a callable to execute once the user is held the key down for more than .15 seconds
-        funcRelease: a callable to execute once the user has released the key after initially having
-        held it down for more than .15 seconds
+class Win32KeyState(KeyStateProvider):
+    '''Reads the physical state of the keyboard keys.
     '''
-    keyCode = V_KEY_CODE
-
-    vState = u32.GetKeyState(keyCode)
-    ctrlState = u32.GetKeyState(win32con.VK_CONTROL)
-    vPressed = (vState >> 8) & 1
-    ctrlPressed = (ctrlState >> 8) & 1
-
-    if not (vPressed and ctrlPressed):
-        # Getting around a bug where the hotkey is triggered by releasing a key which has 
-        # been pressed together with the Ctrl + V combination.
-        #
-        # Example - If I press Ctrl + A + V it triggers the Ctl + V hotkey. But if at any
-        # point I release A, it triggers it again, which means that after releasing the 
-        # Ctrl + V hotkey, the _hold function will be called again. 
-        return
-
-    released = True
-    startTime = time.time()
 
-    while u32.GetKeyState(keyCode) == vState and u32.GetKeyState(win32con.VK_CONTROL) == ctrlState:
-        if time.time() - startTime > config.get("hold_before_showing"):
-            released = False
-            break
-        # time.sleep(.01)
+    def isDown(self, keyCode):
+        '''Checks whether a key is currently held down.
 
-    if released:
-        sendPasteMessage()
-        return
+        GetAsyncKeyState is used instead of GetKeyState, as it reflects the
+        keyboard at the time of the call, rather than the messages this
+        thread has processed so far.
 
-    funcPress()
+        Args:
+            keyCode: The virtual key code of the key
 
-    while u32.GetKeyState(keyCode) == vState and u32.GetKeyState(win32con.VK_CONTROL) == ctrlState:
-        time.sleep(.01)
-
-    funcRelease()
+        Returns:
+            True if the key is down, False otherwise
+            bool
+        '''
+        return bool(u32.GetAsyncKeyState(keyCode) & 0x8000)
 
 
 def _registerHotkey():
@@ -133,10 +108,16 @@ def sendPasteMessage():
 
     The unregister and register limbo is needed to bypass our own callback
     as otherwise we are falling into an infinite loop.
+
+    This is the last stage of pasting, so the total time since the hotkey
+    was pressed is recorded here.
     '''
-    _unregisterHotkey()
-    _pressKey([win32con.VK_CONTROL, V_KEY_CODE])
-    _registerHotkey()
+    with tracing.span("send_paste_message"):
+        _unregisterHotkey()
+        _pressKey([win32con.VK_CONTROL, V_KEY_CODE])
+        _registerHotkey()
+
+    tracing.sinceMark("paste", "paste_total")
 
 
 def listenForPaste(funcPress, funcRelease):
@@ -148,11 +129,16 @@ def listenForPaste(funcPress, funcRelease):
     It registers the hotkey and sends the current thread's ID to the main thread,
     so we can send a QUIT message from the main to this one when we want to exit.
 
+    Whenever the hotkey is pressed, a timer is started which ticks the hold state
+    machine every TICK_INTERVAL milliseconds, until the hotkey is released. If it
+    is just tapped, the normal paste functionality is triggered.
+
     On exit we are checking whether we have a database connection stored on the
     thread and if we do, we close it.
 
     Args:
-        funcPress: A callable to be executed when the hotkey is pressed for more than .15 seconds
+        funcPress: A callable to be executed when the hotkey is held for more than
+        the "hold_before_showing" preference
         funcRelease: A callable to be executed when the hotkey is released after being triggered
     '''
     _registerHotkey()
@@ -160,20 +146,33 @@ def listenForPaste(funcPress, funcRelease):
     t = QThread.currentThread()
     t.threadId = threading.currentThread().ident
 
+    stateMachine = HoldStateMachine([win32con.VK_CONTROL, V_KEY_CODE], Win32KeyState(),
+                                    funcPress, funcRelease, sendPasteMessage)
+    timerId = None
+
     try:
         msg = wintypes.MSG()
         while u32.GetMessageA(ctypes.byref(msg), None, 0, 0) != 0:
             if msg.message == win32con.WM_HOTKEY:
-                _hold(funcPress, funcRelease)
+                if stateMachine.press(config.current.hold_before_showing) and timerId is None:
+                    tracing.mark("paste")
+                    timerId = u32.SetTimer(None, 0, TICK_INTERVAL, None)
+                continue
+            if msg.message == win32con.WM_TIMER and msg.wParam == timerId:
+                if not stateMachine.tick():
+                    u32.KillTimer(None, timerId)
+                    timerId = None
                 continue
             if msg.message == win32con.WM_QUIT:
                 break
             u32.TranslateMessage(ctypes.byref(msg))
             u32.DispatchMessageA(ctypes.byref(msg))
     finally:
+        if timerId is not None:
+            u32.KillTimer(None, timerId)
+
         u32.UnregisterHotKey(None, 1)
         logging.info("Unregistered the Ctrl + V hotkey")
 
-        if hasattr(t, "dbConnection"):
-            getattr(t, "dbConnection").close()
+        if database.closeConnection():
             logging.info("Closed dbConnection in paste thread")
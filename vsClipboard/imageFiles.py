@@ -0,0 +1,55 @@
+'''The files of the images stored by the images module.
+
+Unlike the images module, this does not depend on Qt, so the database
+module can delete the files of expired images and the clipboard can be
+set to an image, even from the command line, which never imports PySide.
+
+Attributes:
+    IMAGES_DIR: The directory the images are stored in
+'''
+import logging
+import os
+
+
+IMAGES_DIR = "clipboard_images"
+
+
+def thumbnailPath(path):
+    '''Returns the path of the thumbnail of an image.
+
+    Args:
+        path: The path of the image
+
+    Returns:
+        The path of the thumbnail
+        str
+    '''
+    return os.path.splitext(path)[0] + ".thumb.png"
+
+
+def deleteImage(path):
+    '''Deletes an image and its thumbnail.
+
+    Args:
+        path: The path of the image
+    '''
+    for each in (path, thumbnailPath(path)):
+        if os.path.exists(each):
+            try:
+                os.remove(each)
+            except OSError:
+                logging.error("Could not delete image file %s" % each)
+
+
+def fromBitmapFile(path):
+    '''Reads a bitmap file as a device independent bitmap.
+
+    Args:
+        path: The path of the bitmap file
+
+    Returns:
+        The data for the CF_DIB clipboard format
+        str
+    '''
+    with open(path, "rb") as f:
+        return f.read()[14:]
@@ -0,0 +1,136 @@
+'''Storing images copied to the clipboard.
+
+Images are saved as bitmap files in the clipboard_images directory, named
+after the sha1 hash of their data, so copying the same image again does
+not store it twice. A small thumbnail is saved next to each image, so the
+Paste widget never needs to decode the full image.
+
+Hashing and saving a large image, e.g. a 4K screenshot, takes a while,
+so it is done by a QRunnable in the global QThreadPool instead of on
+the monitoring thread, which then carries on polling straight away.
+
+History entries of images are file entries with the path to the image as
+their only file and an additional "hasImage" key.
+
+The paths of the images and their thumbnails, deleting them and reading
+them back for the clipboard are in the imageFiles module, which does not
+depend on Qt.
+
+Attributes:
+    THUMBNAIL_SIZE: The maximum width and height of the thumbnails
+'''
+import hashlib
+import logging
+import os
+import struct
+
+from PySide.QtCore import QRunnable, QThreadPool, Qt
+from PySide.QtGui import QImage
+
+from imageFiles import IMAGES_DIR, thumbnailPath
+
+
+THUMBNAIL_SIZE = 128
+
+_BI_BITFIELDS = 3
+
+
+def _dibHeader(dib):
+    '''Reads the size and the offset of the pixels of a device independent bitmap.
+
+    Args:
+        dib: The data of the CF_DIB clipboard format
+
+    Returns:
+        A tuple of the width, height and the offset of the pixels from
+        the start of the data
+        tuple
+    '''
+    headerSize, width, height, _, bitCount, compression = struct.unpack_from("<IiiHHI", dib)
+    colorsUsed = struct.unpack_from("<I", dib, 32)[0]
+
+    if bitCount <= 8:
+        colors = colorsUsed or 1 << bitCount
+    elif compression == _BI_BITFIELDS and headerSize == 40:
+        colors = 3
+    else:
+        colors = colorsUsed
+
+    return width, abs(height), headerSize + colors * 4
+
+
+def toBitmapFile(dib):
+    '''Returns the contents of a bitmap file of the passed in device independent
+    bitmap, by prepending the file header to it.
+
+    Args:
+        dib: The data of the CF_DIB clipboard format
+
+    Returns:
+        The contents of the bitmap file
+        str
+    '''
+    offset = _dibHeader(dib)[2]
+    return struct.pack("<2sIHHI", "BM", 14 + len(dib), 0, 0, 14 + offset) + dib
+
+
+class _StoreImage(QRunnable):
+    '''Saves an image and its thumbnail and passes its history entry on.
+    '''
+
+    def __init__(self, dib, funcStored):
+        '''Constructs the task.
+
+        Args:
+            dib: The data of the CF_DIB clipboard format
+            funcStored: A callable to execute with the history entry of the image
+        '''
+        super(_StoreImage, self).__init__()
+        self.dib = dib
+        self.funcStored = funcStored
+
+    def run(self):
+        '''Saves the image, unless it is already stored, and its thumbnail.
+        '''
+        try:
+            width, height, _ = _dibHeader(self.dib)
+            size = 14 + len(self.dib)
+            path = os.path.join(IMAGES_DIR, hashlib.sha1(self.dib).hexdigest() + ".bmp")
+
+            if not os.path.exists(path):
+                if not os.path.isdir(IMAGES_DIR):
+                    os.makedirs(IMAGES_DIR)
+                with open(path, "wb") as f:
+                    f.write(toBitmapFile(self.dib))
+
+                image = QImage(path)
+                if image.width() > THUMBNAIL_SIZE or image.height() > THUMBNAIL_SIZE:
+                    image = image.scaled(THUMBNAIL_SIZE, THUMBNAIL_SIZE,
+                                         Qt.KeepAspectRatio, Qt.SmoothTransformation)
+                image.save(thumbnailPath(path))
+        except Exception:
+            logging.exception("Could not store the clipboard image")
+            return
+        finally:
+            self.dib = None
+
+        self.funcStored({
+            "text": (unicode(path),),
+            "html": None,
+            "unicode": None,
+            "hasFile": True,
+            "hasImage": True,
+            "imageSize": (width, height),
+            "imageBytes": size
+        })
+
+
+def store(dib, funcStored):
+    '''Saves an image in the background.
+
+    Args:
+        dib: The data of the CF_DIB clipboard format
+        funcStored: A callable to execute with the history entry of the image,
+        once it has been saved. It is executed on one of the threads of the pool
+    '''
+    QThreadPool.globalInstance().start(_StoreImage(dib, funcStored))
@@ -0,0 +1,78 @@
+'''Creating the short previews of clipboard history entries.
+
+The preview of an entry is the text displayed for it in the Paste widget.
+It is created once, when the entry is captured, and stored alongside it,
+so displaying the history never has to go through the full data, which
+can be megabytes of text.
+
+Attributes:
+    PREVIEW_CHARS: The maximum number of characters of a preview
+    PREVIEW_LINES: The maximum number of lines of a preview
+'''
+import re
+
+
+PREVIEW_CHARS = 100
+
+PREVIEW_LINES = 2
+
+_NON_SPACE = re.compile(r"\S")
+
+
+def makePreview(data):
+    '''Creates the preview of the passed in clipboard data.
+
+    The text is cleaned up to be displayed nicely in the ui
+    - leading spaces are stripped out
+    - the length is clamped to PREVIEW_CHARS characters
+    - the new lines are limited to PREVIEW_LINES
+
+    Only the beginning of the text is ever looked at, apart from counting
+    its lines, so it takes about the same time no matter the size of the
+    data.
+
+    Args:
+        data: A dictionary representing a clipboard history entry
+
+    Returns:
+        A dictionary with the "preview" text, the number of "lines" and
+        the number of "chars" of the full text. For files, the preview and
+        the number of characters are of the first path and the number of
+        lines is the number of files. Images are previewed by their size,
+        without any lines or characters.
+        dict
+    '''
+    if data.get("hasImage"):
+        size = data.get("imageSize")
+        return {
+            "preview": u"Image %dx%d" % size if size else u"Image",
+            "lines": None,
+            "chars": None
+        }
+
+    # As nothing else but text is currently supported, we need to check
+    # the data type in order to pick the correct portion to display
+    text = data["unicode"] if data["unicode"] else data["text"]
+    if data["hasFile"]:
+        lines = len(text)
+        text = text[0] if text else ""
+    else:
+        text = text or ""
+        lines = text.count("\n") + 1 if text else 0
+
+    match = _NON_SPACE.search(text)
+    start = match.start() if match else len(text)
+
+    preview = text[start:start + PREVIEW_CHARS + 1]
+    if not isinstance(preview, unicode):
+        preview = preview.decode("utf-8", "replace")
+
+    preview = preview[:PREVIEW_CHARS] + "..." if len(preview) > PREVIEW_CHARS else preview.rstrip()
+    preview = "\n".join(preview.split("\n")[:PREVIEW_LINES]) + "..." \
+        if len(preview.split("\n")) > PREVIEW_LINES else preview
+
+    return {
+        "preview": preview,
+        "lines": lines,
+        "chars": len(text)
+    }
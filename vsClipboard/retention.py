@@ -0,0 +1,122 @@
+'''Enforcing the history retention policies in the background.
+
+The clipboard history only ever grows through database.write(), so
+this module periodically deletes the entries which fall outside the
+configured limits and gives the freed space back to the file system.
+
+The same task also moves entries stored by older versions of the
+application over to the current database schema.
+
+The work is done by a task on the same thread as the clipboard polling
+and the writing of new entries, see the tasks module and capture.Capture.
+Both migrating and deleting are done in small batches, yielding to the
+other tasks in between, so the polling is never held up for long, even
+on large histories. Nothing is done while all limits are 0.
+
+The freed space is only given back to the file system by databases
+using incremental auto vacuum. Databases made by older versions are
+switched to it by the vacuum command of the command line, as that
+rewrites the whole file.
+
+If a trigram.TrigramIndex is specified through setIndex, the deleted
+entries are removed from it as well, so it does not keep growing.
+
+Attributes:
+    COMPACT_INTERVAL: How often (in seconds) to enforce the policies
+    BATCH_SIZE: How many entries to delete in a single transaction
+'''
+import logging
+
+import database
+import config
+
+
+COMPACT_INTERVAL = 60
+
+BATCH_SIZE = 100
+
+_index = None
+
+
+def setIndex(index):
+    '''Sets the trigram index the deleted entries are removed from.
+
+    Args:
+        index: The trigram.TrigramIndex of the history
+    '''
+    global _index
+    _index = index
+
+
+def compact():
+    '''Deletes all expired entries and reclaims the freed space.
+
+    The deletion is done in batches, yielding shortly between them to
+    let the other tasks and threads get to the database.
+    '''
+    snapshot = config.current
+    maxEntries = snapshot.max_history_entries
+    maxBytes = snapshot.max_history_size_mb * 1024 * 1024
+    maxAge = snapshot.max_history_age_days * 24 * 60 * 60
+    if not maxEntries and not maxBytes and not maxAge:
+        return
+
+    deleted = 0
+    while True:
+        batch = database.deleteExpired(maxEntries, maxBytes, maxAge, BATCH_SIZE,
+                                       _index.remove if _index is not None else None)
+        if not batch:
+            break
+        deleted += batch
+        yield .05
+
+    if deleted:
+        while database.vacuum():
+            yield .05
+        logging.info("Deleted %d expired clipboard history entries" % deleted)
+
+
+def migrate(funcMigrated=None):
+    '''Moves all entries stored by older versions over to the current schema.
+
+    Similarly to compact, the entries are moved in batches, yielding
+    shortly between them.
+
+    Args:
+        funcMigrated: A callable to execute once entries have been migrated,
+        e.g. to reload what was read from the database before (default: {None})
+    '''
+    largePayloadBytes = config.current.large_payload_threshold_kb * 1024 or None
+
+    migrated = 0
+    while True:
+        batch = database.migrateLegacy(BATCH_SIZE, largePayloadBytes)
+        if not batch:
+            break
+        migrated += batch
+        yield .05
+
+    if migrated:
+        logging.info("Migrated %d legacy clipboard history entries" % migrated)
+        if funcMigrated is not None:
+            funcMigrated()
+
+
+def compactHistory(funcMigrated=None):
+    '''Enforces the retention policies every COMPACT_INTERVAL seconds.
+
+    Before that, any legacy entries are migrated to the current schema.
+
+    This is a task run by a tasks.TaskLoop, until it is cancelled.
+
+    Args:
+        funcMigrated: A callable to execute once legacy entries have been
+        migrated (default: {None})
+    '''
+    for delay in migrate(funcMigrated):
+        yield delay
+
+    while True:
+        for delay in compact():
+            yield delay
+        yield COMPACT_INTERVAL
@@ -0,0 +1,94 @@
+'''Deciding how often to poll the clipboard.
+
+Polling at a fixed interval means either wasting CPU time while nothing
+is being copied or missing quick successive copies. Instead the interval
+adapts to the clipboard activity
+
+- right after a change the clipboard is polled as often as allowed
+- once there have been no changes for a while, the interval grows
+  exponentially up to the maximum
+- while the user is away from the computer, polling is suspended to a
+  slow rate
+
+Attributes:
+    BURST_WINDOW: How long (in seconds) to keep polling at the minimum
+    interval after a change
+    BACKOFF: The factor the interval grows by on every poll without changes
+    SUSPEND_AFTER: How long (in seconds) without any user input before
+    polling is suspended
+    SUSPENDED_INTERVAL: The interval (in seconds) used while suspended
+'''
+import time
+
+import config
+
+
+BURST_WINDOW = 2
+
+BACKOFF = 1.5
+
+SUSPEND_AFTER = 300
+
+SUSPENDED_INTERVAL = 5
+
+
+class PollScheduler(object):
+    '''Keeps track of the clipboard activity and returns the time to wait
+    before the next poll.
+
+    The bounds of the interval are read from the "poll_clipboard_interval_min"
+    and "poll_clipboard_interval_max" preferences.
+
+    Attributes:
+        ACTIVE: State while changes have happened within the BURST_WINDOW
+        BACKOFF: State while the interval is growing because of no changes
+        SUSPENDED: State while the user has been idle for SUSPEND_AFTER
+        state: The current state
+        interval: The current polling interval
+    '''
+    ACTIVE = "active"
+    BACKOFF = "backoff"
+    SUSPENDED = "suspended"
+
+    def __init__(self):
+        '''Constructs the scheduler in the active state.
+        '''
+        self.state = PollScheduler.ACTIVE
+        self.interval = config.current.poll_clipboard_interval_min
+        self.lastChange = time.time()
+
+    def next(self, changed, idleTime=0):
+        '''Registers the result of a poll and returns how long to wait before the
+        next one.
+
+        Args:
+            changed: Whether the clipboard changed since the previous poll
+            idleTime: The time (in seconds) since the last user input (default: {0})
+
+        Returns:
+            The time to wait (in seconds)
+            float
+        '''
+        snapshot = config.current
+        minInterval = snapshot.poll_clipboard_interval_min
+        maxInterval = max(minInterval, snapshot.poll_clipboard_interval_max)
+
+        now = time.time()
+        if changed:
+            self.lastChange = now
+
+        if idleTime > SUSPEND_AFTER and not changed:
+            self.state = PollScheduler.SUSPENDED
+            self.interval = max(maxInterval, SUSPENDED_INTERVAL)
+        elif now - self.lastChange < BURST_WINDOW:
+            self.state = PollScheduler.ACTIVE
+            self.interval = minInterval
+        else:
+            # Coming back from suspension starts from the minimum interval,
+            # as the user is likely to copy something soon
+            if self.state == PollScheduler.SUSPENDED:
+                self.interval = minInterval
+            self.state = PollScheduler.BACKOFF
+            self.interval = min(max(self.interval * BACKOFF, minInterval), maxInterval)
+
+        return self.interval
@@ -0,0 +1,188 @@
+'''Searching the clipboard history in the background.
+
+The Paste widget searches the history while the user is typing, so the
+queries run on a dedicated thread instead of blocking the ui.
+
+Only the latest query matters. Every new query cancels the one which is
+currently running, and any queries which have been replaced before they
+even started are skipped.
+
+If a trigram.TrigramIndex is passed to the Searcher, it is filled in from
+the database on the search thread, in between queries, and once ready,
+its fuzzy substring matches are returned first, followed by the matches
+of the full-text index of the database.
+'''
+import logging
+import threading
+
+import database
+import trigram
+
+
+class Searcher(object):
+    '''Runs the latest search query in the background.
+
+    The run method is the body of the search thread.
+
+    Attributes:
+        generation: The number of the latest query, incremented by every search
+    '''
+
+    def __init__(self, maxResults=100, index=None):
+        '''Constructs the searcher without a query.
+
+        Args:
+            maxResults: The maximum number of entries returned by a query (default: {100})
+            index: The trigram.TrigramIndex to search and fill in (default: {None})
+        '''
+        self.maxResults = maxResults
+        self.index = index
+        self.generation = 0
+
+        self._condition = threading.Condition()
+        self._pending = None
+        self._reindex = False
+        self._running = True
+
+    def search(self, text, funcFound):
+        '''Queues a query, cancelling any previous ones.
+
+        This never blocks.
+
+        Args:
+            text: The text to search for
+            funcFound: A callable to execute with the generation of the query and
+            the list of matching entries, best match first, once the query has finished
+
+        Returns:
+            The generation of the query
+            int
+        '''
+        with self._condition:
+            self.generation += 1
+            self._pending = (self.generation, text, funcFound)
+            self._condition.notify()
+            return self.generation
+
+    def reindex(self):
+        '''Fills in the index from the database again, e.g. once entries
+        have been added to the database behind its back.
+
+        This never blocks, the index is cleared and filled in on the search
+        thread.
+        '''
+        with self._condition:
+            self._reindex = True
+            self._condition.notify()
+
+    def stop(self):
+        '''Lets the search thread exit, cancelling the current query.
+        '''
+        with self._condition:
+            self._running = False
+            self.generation += 1
+            self._condition.notify()
+
+    def _takeQuery(self, wait):
+        '''Returns the latest query, if there is one.
+
+        Args:
+            wait: Whether to wait for a query if there is none
+
+        Returns:
+            A (generation, text, funcFound) tuple or None
+            tuple
+        '''
+        with self._condition:
+            while wait and self._running and self._pending is None and not self._reindex:
+                self._condition.wait()
+            query = self._pending
+            self._pending = None
+            return query
+
+    def _loadIndex(self, afterId):
+        '''Adds the next batch of entries from the database to the index.
+
+        Args:
+            afterId: The id of the last entry added to the index so far
+
+        Returns:
+            The id of the last entry added to the index
+            int
+        '''
+        batch = database.readSearchText(trigram.INDEX_CHARS, afterId=afterId)
+        if not batch:
+            self.index.finishLoading()
+            logging.info("Indexed %d clipboard history entries" % len(self.index))
+            return afterId
+
+        self.index.load([(dataHash, text.lower()) for _, dataHash, text in batch])
+        return batch[-1][0]
+
+    def find(self, text, cancelled=None):
+        '''Returns the entries best matching the text, on the calling thread.
+
+        Args:
+            text: The text to search for
+            cancelled: A callable returning True to cancel the search (default: {None})
+
+        Returns:
+            A list of clipboard history entries, best match first, or None if
+            the search has been cancelled
+            list
+        '''
+        entries = []
+        if self.index is not None and self.index.ready:
+            hashes = self.index.search(text, self.maxResults, cancelled)
+            if hashes is None:
+                return None
+            entries = database.readByHashes(hashes)
+
+        if len(entries) < self.maxResults:
+            more = database.search(text, self.maxResults, cancelled)
+            if more is None:
+                return None
+
+            found = set(entry["hash"] for entry in entries)
+            entries.extend(entry for entry in more if entry["hash"] not in found)
+
+        return entries[:self.maxResults]
+
+    def run(self):
+        '''Runs the queued queries until stop is called.
+
+        While the index is not filled in yet, it is filled in a batch at a
+        time, checking for new queries after each one.
+
+        On exit we are checking whether we have a database connection stored on the
+        thread and if we do, we close it.
+        '''
+        lastId = 0
+        while self._running:
+            with self._condition:
+                reindex, self._reindex = self._reindex, False
+            if reindex and self.index is not None:
+                self.index.clear()
+                lastId = 0
+
+            loading = self.index is not None and not self.index.ready
+            query = self._takeQuery(wait=not loading)
+
+            if query is None:
+                if loading:
+                    lastId = self._loadIndex(lastId)
+                continue
+
+            generation, text, funcFound = query
+            cancelled = lambda: self.generation != generation
+            try:
+                entries = self.find(text, cancelled)
+            except Exception:
+                logging.exception("Searching the clipboard history failed")
+                continue
+
+            if entries is not None and not cancelled():
+                funcFound(generation, entries)
+
+        if database.closeConnection():
+            logging.info("Closed dbConnection in search thread")
@@ -0,0 +1,213 @@
+'''Cooperative tasks on a Qt event loop.
+
+Polling the clipboard, writing the new entries and enforcing the
+retention policies spend nearly all of their time waiting, so instead of
+each blocking a thread of its own, they are tasks sharing a single
+thread, which waits in a Qt event loop until the next task is due.
+
+A task is a generator, which yields how long (in seconds) to wait before
+it is resumed
+
+    def poll():
+        while True:
+            check()
+            yield .5
+
+Cancelling a task closes its generator, so it stops at the point where
+it was waiting, never in the middle of its work, and its finally blocks
+run before the loop exits.
+'''
+from functools import partial
+import logging
+import threading
+
+import database
+
+from PySide.QtCore import QEventLoop, QObject, QTimer, Signal, Slot
+
+
+def _once(func, args):
+    '''A task calling a function once.
+
+    Args:
+        func: The function
+        args: A tuple of the arguments of the function
+    '''
+    func(*args)
+    return
+    yield
+
+
+class Task(object):
+    '''A generator resumed by a single shot QTimer.
+
+    Attributes:
+        name: The name of the task, used for logging
+        done: Whether the task has finished or has been cancelled
+    '''
+
+    def __init__(self, generator, name):
+        '''Constructs the task, without starting it.
+
+        It has to be constructed on the thread of the event loop it runs on.
+
+        Args:
+            generator: The generator yielding the times to wait
+            name: The name of the task
+        '''
+        self.generator = generator
+        self.name = name
+        self.done = False
+
+        self.timer = QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._step)
+
+    def start(self):
+        '''Runs the task as soon as the event loop gets to it.
+        '''
+        self.timer.start(0)
+
+    def _step(self):
+        '''Resumes the generator and schedules it to be resumed again.
+        '''
+        try:
+            delay = next(self.generator)
+        except StopIteration:
+            self.done = True
+            return
+        except Exception:
+            logging.exception("Task %s failed" % self.name)
+            self.done = True
+            return
+
+        self.timer.start(int(delay * 1000))
+
+    def cancel(self):
+        '''Stops the task, closing its generator.
+        '''
+        if self.done:
+            return
+
+        self.timer.stop()
+        self.done = True
+        try:
+            self.generator.close()
+        except Exception:
+            logging.exception("Task %s failed while being cancelled" % self.name)
+
+
+class _Bridge(QObject):
+    '''Lives on the thread of a TaskLoop, so the signals emitted from other
+    threads are handled on it.
+    '''
+    spawnRequested = Signal(object)
+    stopRequested = Signal()
+
+    def __init__(self, eventLoop):
+        '''Constructs the bridge.
+
+        Args:
+            eventLoop: The QEventLoop the tasks run on
+        '''
+        super(_Bridge, self).__init__()
+
+        self.eventLoop = eventLoop
+        self.tasks = []
+
+        self.spawnRequested.connect(self.spawn)
+        self.stopRequested.connect(self.stop)
+
+    @Slot(object)
+    def spawn(self, factory):
+        '''Starts a task.
+
+        Args:
+            factory: A callable returning the generator of the task
+        '''
+        task = Task(factory(), getattr(factory, "__name__", "task"))
+        self.tasks = [each for each in self.tasks if not each.done] + [task]
+        task.start()
+
+    @Slot()
+    def stop(self):
+        '''Cancels all tasks and exits the event loop.
+        '''
+        for task in self.tasks:
+            task.cancel()
+        self.eventLoop.quit()
+
+
+class TaskLoop(object):
+    '''Runs tasks on a thread of their own.
+
+    The run method is the body of the thread. Tasks can be spawned and the
+    loop stopped from any thread.
+    '''
+
+    def __init__(self, *factories):
+        '''Constructs the loop.
+
+        Args:
+            *factories: Callables returning the generators of the tasks to
+            start with
+        '''
+        self._pending = list(factories)
+        self._bridge = None
+        self._stopping = False
+        self._lock = threading.Lock()
+
+    def spawn(self, factory):
+        '''Starts a task on the loop.
+
+        Args:
+            factory: A callable returning the generator of the task
+        '''
+        with self._lock:
+            if self._bridge is None:
+                self._pending.append(factory)
+                return
+        self._bridge.spawnRequested.emit(factory)
+
+    def call(self, func, *args):
+        '''Calls a function once on the thread of the loop, in between the
+        steps of the other tasks.
+
+        Args:
+            func: The function
+            *args: The arguments of the function
+        '''
+        self.spawn(partial(_once, func, args))
+
+    def stop(self):
+        '''Cancels all tasks and lets the thread exit.
+        '''
+        with self._lock:
+            self._stopping = True
+            bridge = self._bridge
+        if bridge is not None:
+            bridge.stopRequested.emit()
+
+    def run(self):
+        '''Runs the tasks until stop is called.
+
+        On exit we are checking whether we have a database connection stored on the
+        thread and if we do, we close it.
+        '''
+        eventLoop = QEventLoop()
+        bridge = _Bridge(eventLoop)
+
+        with self._lock:
+            self._bridge = bridge
+            pending, self._pending = self._pending, []
+            stopping = self._stopping
+
+        for factory in pending:
+            bridge.spawn(factory)
+
+        if not stopping:
+            eventLoop.exec_()
+        bridge.stop()
+
+        if database.closeConnection():
+            logging.info("Closed dbConnection in task thread")
@@ -0,0 +1,225 @@
+'''Measuring the latency of the stages of pasting.
+
+The stages between pressing Ctrl + V and the text being pasted run on
+different threads, so each stage records its duration under its own
+name, while durations crossing threads are measured from a named mark
+set by the earlier stage.
+
+The durations are counted in histograms with logarithmic buckets, so
+recording is a few arithmetic operations and the memory used never
+grows, which keeps the tracing cheap enough to always be on. The
+percentiles are approximate, within the width of a bucket.
+
+    with tracing.span("clipboard_set"):
+        ...
+
+    tracing.mark("showPaste")           # on one thread
+    tracing.sinceMark("showPaste", "show_paste_signal")   # on another
+
+Attributes:
+    BUCKET_GROWTH: How much wider each bucket is than the previous one
+    MIN_DURATION: The upper bound (in seconds) of the first bucket
+    BUCKETS: The number of buckets, covering up to about 5 minutes
+    STAGES: The stages of pasting, in the order they happen
+'''
+from contextlib import contextmanager
+import json
+import math
+import threading
+import timeit
+
+
+BUCKET_GROWTH = 1.1
+
+MIN_DURATION = .00001
+
+BUCKETS = 180
+
+STAGES = [
+    "hold_detection",
+    "paste_press",
+    "show_paste_signal",
+    "paste_rebuild",
+    "clipboard_set",
+    "send_paste_message",
+    "paste_release",
+    "paste_total"
+]
+
+# The most precise clock available, time.clock on Windows
+timer = timeit.default_timer
+
+_LOG_GROWTH = math.log(BUCKET_GROWTH)
+
+
+class Histogram(object):
+    '''Counts durations in logarithmic buckets.
+
+    Attributes:
+        count: The number of recorded durations
+        total: The sum of the recorded durations
+        maximum: The longest recorded duration
+    '''
+
+    def __init__(self):
+        '''Constructs an empty histogram.
+        '''
+        self.buckets = [0] * BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.maximum = 0.
+
+    def record(self, duration):
+        '''Counts a duration.
+
+        Args:
+            duration: The duration (in seconds)
+        '''
+        if duration <= MIN_DURATION:
+            bucket = 0
+        else:
+            bucket = min(BUCKETS - 1, int(math.ceil(math.log(duration / MIN_DURATION) / _LOG_GROWTH)))
+
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += duration
+        self.maximum = max(self.maximum, duration)
+
+    def percentile(self, fraction):
+        '''Returns the duration below which the passed in fraction of the
+        recorded durations fall.
+
+        Args:
+            fraction: The fraction, between 0 and 1
+
+        Returns:
+            The upper bound (in seconds) of the bucket of the percentile
+            float
+        '''
+        if not self.count:
+            return 0.
+
+        target = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.buckets):
+            seen += count
+            if seen >= target:
+                return min(self.maximum, MIN_DURATION * BUCKET_GROWTH ** bucket)
+        return self.maximum
+
+    def summary(self):
+        '''Returns the statistics of the histogram.
+
+        Returns:
+            A dictionary with the "count" and the "mean", "p50", "p95", "p99"
+            and "max" durations (in milliseconds)
+            dict
+        '''
+        return {
+            "count": self.count,
+            "mean": self.total / self.count * 1000 if self.count else 0.,
+            "p50": self.percentile(.5) * 1000,
+            "p95": self.percentile(.95) * 1000,
+            "p99": self.percentile(.99) * 1000,
+            "max": self.maximum * 1000
+        }
+
+
+_lock = threading.Lock()
+
+_histograms = {}
+
+_marks = {}
+
+
+def record(stage, duration):
+    '''Records the duration of a stage.
+
+    Args:
+        stage: The name of the stage
+        duration: The duration (in seconds)
+    '''
+    with _lock:
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.record(duration)
+
+
+@contextmanager
+def span(stage):
+    '''Records the duration of the wrapped block as a stage.
+
+    Args:
+        stage: The name of the stage
+    '''
+    start = timer()
+    try:
+        yield
+    finally:
+        record(stage, timer() - start)
+
+
+def mark(name):
+    '''Remembers the current time, so a later stage can be measured from it,
+    possibly on another thread.
+
+    Args:
+        name: The name of the mark
+    '''
+    _marks[name] = timer()
+
+
+def sinceMark(name, stage, keep=False):
+    '''Records the time since a mark as a stage.
+
+    Nothing is recorded if the mark has not been set, e.g. if the stage
+    is reached without going through the one setting the mark.
+
+    Args:
+        name: The name of the mark
+        stage: The name of the stage
+        keep: Whether to keep the mark for measuring more stages (default: {False})
+    '''
+    start = _marks.get(name) if keep else _marks.pop(name, None)
+    if start is not None:
+        record(stage, timer() - start)
+
+
+def summary():
+    '''Returns the statistics of all recorded stages.
+
+    Returns:
+        A dictionary of the stage names and their statistics as returned by
+        Histogram.summary
+        dict
+    '''
+    with _lock:
+        return dict((stage, histogram.summary()) for stage, histogram in _histograms.iteritems())
+
+
+def formatSummary():
+    '''Returns the statistics of all recorded stages as a table.
+
+    Returns:
+        A line per stage, in the order the stages happen
+        str
+    '''
+    stats = summary()
+    stages = [stage for stage in STAGES if stage in stats] + sorted(set(stats) - set(STAGES))
+
+    lines = ["%-20s %6s %8s %8s %8s" % ("stage (ms)", "count", "p50", "p95", "p99")]
+    for stage in stages:
+        each = stats[stage]
+        lines.append("%-20s %6d %8.2f %8.2f %8.2f" % (stage, each["count"], each["p50"], each["p95"], each["p99"]))
+    return "\n".join(lines)
+
+
+def dump(path):
+    '''Writes the statistics of all recorded stages to a file as JSON.
+
+    Args:
+        path: The path of the file
+    '''
+    with open(path, "w") as f:
+        f.write(json.dumps(summary(), sort_keys=True, indent=4))
@@ -0,0 +1,308 @@
+'''Fuzzy substring matching of the clipboard history.
+
+The full-text index of the database only matches whole words and their
+beginnings, which misses parts of identifiers, paths and hashes. For
+those, the beginning of every entry is split into all of its three
+character sequences (trigrams) and kept in an in-memory TrigramIndex,
+which maps each trigram to the list of entries containing it.
+
+Every entry added to the index gets the next document number, so newer
+entries always have higher numbers. The lists of document numbers are
+arrays, which only ever get appended to, and they stay sorted without
+any extra work.
+
+A query is answered by counting how many of its trigrams each entry
+contains. Entries containing the query as it is rank first, followed by
+entries which contain enough of its trigrams, with newer entries ranked
+higher among entries of a similar quality.
+
+Attributes:
+    INDEX_CHARS: How many characters of the beginning of an entry are indexed
+    MIN_SIMILARITY: The minimum fraction of the trigrams of a query an entry needs to contain
+    RECENCY_WEIGHT: How much the age of an entry affects its score, compared to the match quality
+'''
+from array import array
+import heapq
+import math
+import threading
+
+
+INDEX_CHARS = 256
+
+MIN_SIMILARITY = .6
+
+RECENCY_WEIGHT = .2
+
+
+def indexText(data):
+    '''Returns the text of a clipboard history entry which gets indexed.
+
+    Args:
+        data: A dictionary representing a clipboard history entry
+
+    Returns:
+        The lowercase beginning of the text of the entry
+        unicode
+    '''
+    text = data["unicode"] or data["text"]
+    if data.get("hasImage"):
+        text = data["preview"]
+    elif data["hasFile"]:
+        text = u"\n".join(text or ())
+    if not text:
+        text = data.get("preview") or u""
+    if not isinstance(text, unicode):
+        text = text[:INDEX_CHARS * 4].decode("utf-8", "replace")
+    return text[:INDEX_CHARS].lower()
+
+
+def trigrams(text):
+    '''Returns the unique trigrams of a text.
+
+    Args:
+        text: The text to split
+
+    Returns:
+        A set of the three character sequences of the text
+        set
+    '''
+    return set(text[i:i + 3] for i in xrange(len(text) - 2))
+
+
+class TrigramIndex(object):
+    '''The trigrams of the clipboard history entries.
+
+    The entries are identified by their hashes. Adding an entry which is
+    already in the index moves it to the top, as it does in the history.
+
+    The index is filled in from the database in the background, so until
+    it is marked as ready, new entries are held back and added only after
+    all older entries.
+
+    Entries can be added and removed from any thread. Searching only holds
+    the lock while copying what it needs, so adding new entries never
+    waits on a long query.
+
+    Attributes:
+        ready: Whether the index contains all entries of the history
+    '''
+
+    def __init__(self):
+        '''Constructs an empty index.
+        '''
+        self.ready = False
+
+        self._lock = threading.Lock()
+        self._postings = {}
+        self._documents = {}
+        self._hashes = {}
+        self._pending = []
+        self._next = 0
+
+    def __len__(self):
+        '''Returns the number of indexed entries.
+
+        Returns:
+            int
+        '''
+        return len(self._hashes)
+
+    def _add(self, dataHash, text):
+        '''Adds an entry to the index, the lock needs to be held.
+
+        Args:
+            dataHash: The hash of the entry
+            text: The text to index as returned by indexText
+        '''
+        self._remove(dataHash)
+
+        # Entries moved to the top or removed leave their old document
+        # numbers behind, so once those are the majority, they are
+        # dropped from the lists
+        if self._next > 2 * len(self._documents) + 1000:
+            self._compact()
+
+        document = self._next
+        self._next += 1
+        self._documents[document] = (dataHash, text)
+        self._hashes[dataHash] = document
+
+        postings = self._postings
+        for trigram in trigrams(text):
+            if trigram in postings:
+                postings[trigram].append(document)
+            else:
+                postings[trigram] = array("i", [document])
+
+    def _compact(self):
+        '''Rebuilds the lists of trigrams from the entries still in the index,
+        the lock needs to be held.
+        '''
+        postings = {}
+        for document in sorted(self._documents):
+            for trigram in trigrams(self._documents[document][1]):
+                if trigram in postings:
+                    postings[trigram].append(document)
+                else:
+                    postings[trigram] = array("i", [document])
+        self._postings = postings
+
+    def _remove(self, dataHash):
+        '''Removes an entry from the index, the lock needs to be held.
+
+        Its document number is left in the lists of its trigrams and is
+        skipped when searching.
+
+        Args:
+            dataHash: The hash of the entry
+        '''
+        document = self._hashes.pop(dataHash, None)
+        if document is not None:
+            del self._documents[document]
+
+    def add(self, dataHash, text):
+        '''Adds an entry at the top of the index.
+
+        Args:
+            dataHash: The hash of the entry
+            text: The text to index as returned by indexText
+        '''
+        with self._lock:
+            if self.ready:
+                self._add(dataHash, text)
+            else:
+                self._pending.append((dataHash, text))
+
+    def remove(self, dataHashes):
+        '''Removes entries from the index, e.g. once they have expired.
+
+        Args:
+            dataHashes: The hashes of the entries
+        '''
+        dataHashes = set(dataHashes)
+        with self._lock:
+            for dataHash in dataHashes:
+                self._remove(dataHash)
+            if self._pending:
+                self._pending = [each for each in self._pending if each[0] not in dataHashes]
+
+    def load(self, entries):
+        '''Adds older entries from the database while the index is being filled in.
+
+        Entries which are already in the index are skipped.
+
+        Args:
+            entries: A list of (hash, text) tuples, oldest first
+        '''
+        with self._lock:
+            for dataHash, text in entries:
+                if dataHash not in self._hashes:
+                    self._add(dataHash, text)
+
+    def clear(self):
+        '''Removes all entries, so the index can be filled in again.
+
+        Until it is marked as ready again, new entries are held back.
+        '''
+        with self._lock:
+            self.ready = False
+            self._postings = {}
+            self._documents = {}
+            self._hashes = {}
+            self._next = 0
+
+    def finishLoading(self):
+        '''Marks the index as ready, adding the entries which were held back.
+        '''
+        with self._lock:
+            for dataHash, text in self._pending:
+                self._add(dataHash, text)
+            self._pending = []
+            self.ready = True
+
+    def _score(self, quality, document, total):
+        '''Combines the match quality and recency of an entry.
+
+        Args:
+            quality: How well the entry matches, between 0 and 1
+            document: The document number of the entry
+            total: The number of document numbers given out so far
+
+        Returns:
+            The score of the entry
+            float
+        '''
+        return quality + RECENCY_WEIGHT * (document + 1) / float(total)
+
+    def search(self, query, count, cancelled=None):
+        '''Finds the entries best matching the query.
+
+        Args:
+            query: The text to search for
+            count: The maximum number of entries to return
+            cancelled: A callable returning True to cancel the search (default: {None})
+
+        Returns:
+            A list of the hashes of the entries, best match first, or None
+            if the search has been cancelled
+            list
+        '''
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        # Too short to have trigrams, so the newest entries
+        # containing the query are all we can find
+        if len(query) < 3:
+            with self._lock:
+                documents = sorted(self._documents.iteritems(), reverse=True)
+
+            found = []
+            for document, (dataHash, text) in documents:
+                if query in text:
+                    found.append(dataHash)
+                    if len(found) == count:
+                        break
+            return found
+
+        queryTrigrams = trigrams(query)
+        required = int(math.ceil(len(queryTrigrams) * MIN_SIMILARITY))
+
+        # The lists only ever get appended to or replaced, so copies
+        # of them can be counted without holding the lock
+        with self._lock:
+            postings = [self._postings[trigram][:] if trigram in self._postings else ()
+                        for trigram in queryTrigrams]
+            total = self._next
+
+        # Start from the rarest trigrams, so if the query is not
+        # contained in enough entries, we know early
+        postings.sort(key=len)
+
+        hits = {}
+        for i, documentList in enumerate(postings):
+            if cancelled is not None and cancelled():
+                return None
+
+            # Entries not containing any of the trigrams so far can
+            # no longer reach the required amount
+            if len(postings) - i >= required:
+                for document in documentList:
+                    hits[document] = hits.get(document, 0) + 1
+            else:
+                for document in documentList:
+                    if document in hits:
+                        hits[document] += 1
+
+        # Only the entries which matched enough trigrams are looked up,
+        # skipping the ones removed in the meantime
+        with self._lock:
+            candidates = [(document, matched, self._documents[document]) for document, matched in hits.iteritems()
+                          if matched >= required and document in self._documents]
+
+        scored = []
+        for document, matched, (dataHash, text) in candidates:
+            quality = 1. if query in text else matched / (len(queryTrigrams) + 1.)
+            scored.append((self._score(quality, document, total), dataHash))
+
+        return [dataHash for _, dataHash in heapq.nlargest(count, scored)]
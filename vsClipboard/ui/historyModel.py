@@ -0,0 +1,227 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+from thumbnails import ThumbnailCache
+
+
+class HistoryModel(QAbstractListModel):
+    '''A list model of the clipboard history entries.
+
+    The model starts with the latest entries and, as the selection moves
+    past the end, older entries are read from the database a page at a time.
+
+    When showing search results, all matching entries are set at once
+    and nothing more is read from the database.
+
+    The pinned entries are listed first, above the latest entries, and are
+    displayed in bold wherever they are listed, e.g. in search results too.
+
+    Only the rows which are visible in the view are ever asked for their
+    display text, which is the preview stored with the entry, so the cost
+    of showing the list depends neither on how many entries have been
+    loaded, nor on their size.
+
+    Images are displayed with their thumbnails, which are read in the
+    background by a ThumbnailCache, and the rows are updated once they
+    are ready.
+
+    Attributes:
+        PAGE_SIZE: How many entries to read from the database at a time
+    '''
+    PAGE_SIZE = 50
+
+    def __init__(self, history, parent=None):
+        '''Constructs an empty model.
+
+        Args:
+            history: The history.LocalHistory or daemon.DaemonClient to read
+            older entries through
+            parent: The parent object (default: {None})
+        '''
+        super(HistoryModel, self).__init__(parent)
+
+        self.history = history
+
+        self.entries = []
+        self.hashes = set()
+        self.pinnedCount = 0
+        self.pinnedHashes = set()
+        self.oldestId = None
+        self.exhausted = False
+
+        # All rows fit two lines of text, which lets the view skip
+        # measuring every row
+        self.rowSize = QSize(0, QFontMetrics(QApplication.font()).lineSpacing() * 2 + 10)
+
+        self.pinnedFont = QFont(QApplication.font())
+        self.pinnedFont.setBold(True)
+
+        self.thumbnails = ThumbnailCache(parent=self)
+        self.thumbnails.thumbnailLoaded.connect(self.thumbnailLoaded)
+
+    def reset(self, entries, complete=False, pinned=()):
+        '''Replaces the entries of the model.
+
+        Args:
+            entries: A list of clipboard history entries, newest first
+            complete: Whether the entries are all there is to show, e.g. the
+            results of a search, so no older ones are loaded (default: {False})
+            pinned: A list of entries listed before the others (default: {()})
+        '''
+        self.beginResetModel()
+
+        pinnedHashes = set(entry["hash"] for entry in pinned)
+        self.entries = list(pinned) + [entry for entry in entries if entry["hash"] not in pinnedHashes]
+        self.pinnedCount = len(pinned)
+        self.hashes = set(entry["hash"] for entry in self.entries)
+        self.oldestId = None
+        self.exhausted = complete
+
+        self.endResetModel()
+
+    def setPinned(self, hashes):
+        '''Sets which entries are displayed as pinned.
+
+        Args:
+            hashes: The hashes of the pinned entries
+        '''
+        self.pinnedHashes = set(hashes)
+        if self.entries:
+            self.dataChanged.emit(self.index(0), self.index(len(self.entries) - 1))
+
+    def entry(self, row):
+        '''Returns the clipboard history entry of a row.
+
+        Args:
+            row: The row of the entry
+
+        Returns:
+            A dictionary representing a clipboard history entry
+            dict
+        '''
+        return self.entries[row]
+
+    def rowCount(self, parent=QModelIndex()):
+        '''Returns the number of loaded entries.
+
+        Args:
+            parent: The parent index (default: {QModelIndex()})
+
+        Returns:
+            int
+        '''
+        if parent.isValid():
+            return 0
+        return len(self.entries)
+
+    def data(self, index, role=Qt.DisplayRole):
+        '''Returns the data the view needs to display a row.
+
+        Args:
+            index: The index of the row
+            role: The role of the requested data (default: {Qt.DisplayRole})
+        '''
+        if not index.isValid():
+            return None
+
+        entry = self.entries[index.row()]
+
+        if role == Qt.DisplayRole:
+            return entry["preview"]
+        if role == Qt.DecorationRole and entry.get("hasImage"):
+            return self.thumbnails.get(entry["text"][0])
+        if role == Qt.ToolTipRole and entry["lines"] is not None:
+            return "%d lines, %d characters" % (entry["lines"], entry["chars"])
+        if role == Qt.FontRole and entry["hash"] in self.pinnedHashes:
+            return self.pinnedFont
+        if role == Qt.SizeHintRole:
+            return self.rowSize
+
+        return None
+
+    def thumbnailLoaded(self, path):
+        '''Updates the rows of the image whose thumbnail has been read.
+
+        Args:
+            path: The path of the image
+        '''
+        for row, entry in enumerate(self.entries):
+            if entry.get("hasImage") and entry["text"][0] == path:
+                index = self.index(row)
+                self.dataChanged.emit(index, index)
+
+    def _anchorId(self):
+        '''Returns the id of the oldest loaded entry in the database.
+
+        Entries which have been captured recently and come from the
+        cache do not know their ids, so they are looked up by hash. If the
+        oldest entry is not written to the database yet, the id of the
+        oldest entry which has one is used instead.
+
+        The pinned entries are not part of the order of the history, so if
+        only they are loaded, the history is read from the newest entry.
+
+        Returns:
+            The id or None to read from the newest entry
+            int
+        '''
+        if self.oldestId is not None:
+            return self.oldestId
+        if len(self.entries) <= self.pinnedCount:
+            return None
+
+        oldest = self.entries[-1]
+        anchorId = oldest["id"] if oldest["id"] is not None else self.history.entryId(oldest["hash"])
+        if anchorId is not None:
+            return anchorId
+
+        for entry in reversed(self.entries[self.pinnedCount:]):
+            if entry["id"] is not None:
+                return entry["id"]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        '''Stops the view from reading older entries by itself.
+
+        The view asks for more rows whenever the last one is visible, which
+        would read the database on every show until the view is full. Older
+        entries are only read when the selection moves past the last row,
+        see loadMore.
+
+        Args:
+            parent: The parent index (default: {QModelIndex()})
+
+        Returns:
+            bool
+        '''
+        return False
+
+    def loadMore(self):
+        '''Appends the next page of older entries from the database.
+
+        Entries which are already loaded, e.g. because they were copied
+        again and are still waiting to be written, are skipped, reading
+        further pages until one has entries which are not loaded yet. Once
+        there are no older entries, nothing more is read.
+        '''
+        if self.exhausted:
+            return
+
+        anchorId = self._anchorId()
+        while True:
+            page = self.history.readLatest(HistoryModel.PAGE_SIZE, anchorId)
+            if not page:
+                self.exhausted = True
+                return
+
+            self.oldestId = anchorId = page[-1]["id"]
+
+            page = [entry for entry in page if entry["hash"] not in self.hashes]
+            if page:
+                break
+
+        self.beginInsertRows(QModelIndex(), len(self.entries), len(self.entries) + len(page) - 1)
+        self.entries.extend(page)
+        self.hashes.update(entry["hash"] for entry in page)
+        self.endInsertRows()
+
@@ -2,9 +2,13 @@ from PySide.QtGui import *
 from PySide.QtCore import *
 
 from .. import config
+from .. import tracing
 from titleBar import TitleBar
 
 
+LATENCY_FILE = "paste_latency.json"
+
+
 class Main(QWidget):
     '''This is the main window of the program.
     
@@ -26,22 +30,17 @@ class Main(QWidget):
         values of the preferences.
         
         Args:
-            _config: Preferences as a dictionary.
+            _config: Preferences as a config.Config snapshot.
         '''
         super(Main, self).__init__()
 
-        self.config = _config
-
         # UI setup
         self.setWindowFlags(Qt.FramelessWindowHint)
         self.setAttribute(Qt.WA_StyledBackground)
 
         # Build UI elements
         self.buildUI()
-
-        # Load stylesheet
-        with open("vsClipboard/ui/styles.css", "r") as f:
-            self.setStyleSheet(f.read())
+        self.showConfig(_config)
 
     def buildUI(self):
         '''Creates the UI elements and arranges them in proper layouts.
@@ -62,8 +61,7 @@ class Main(QWidget):
 
         historyLengthField = QSpinBox()
         historyLengthField.setMinimum(1)
-        historyLengthField.setMaximum(50)
-        historyLengthField.setValue(self.config["history_length"])
+        historyLengthField.setMaximum(1000)
 
         # Time (in seconds) to wait before showing the clipboard history
         # when Ctrl + V is pressed
@@ -73,20 +71,38 @@ class Main(QWidget):
         holdTimeField.setMinimum(.01)
         holdTimeField.setMaximum(5)
         holdTimeField.setSingleStep(.01)
-        holdTimeField.setValue(self.config["hold_before_showing"])
 
-        # Interval (in seconds) to poll the clipboard for changes
-        clipboardPollIntervalLabel = QLabel("Clipboard poll interval (sec)")
+        # Bounds of the interval (in seconds) to poll the clipboard for changes
+        clipboardPollIntervalMinLabel = QLabel("Min clipboard poll interval (sec)")
+
+        clipboardPollIntervalMinField = QDoubleSpinBox()
+        clipboardPollIntervalMinField.setMinimum(.01)
+        clipboardPollIntervalMinField.setMaximum(5)
+        clipboardPollIntervalMinField.setSingleStep(.01)
+
+        clipboardPollIntervalMaxLabel = QLabel("Max clipboard poll interval (sec)")
 
-        clipboardPollIntervalField = QDoubleSpinBox()
-        clipboardPollIntervalField.setMinimum(.01)
-        clipboardPollIntervalField.setMaximum(5)
-        clipboardPollIntervalField.setSingleStep(.1)
-        clipboardPollIntervalField.setValue(self.config["poll_clipboard_interval"])
+        clipboardPollIntervalMaxField = QDoubleSpinBox()
+        clipboardPollIntervalMaxField.setMinimum(.01)
+        clipboardPollIntervalMaxField.setMaximum(5)
+        clipboardPollIntervalMaxField.setSingleStep(.1)
 
         # Save preferences button
         savePreferencesButton = QPushButton("Save preferences")
 
+        # Latency of the stages of pasting, refreshed whenever the window is shown
+        latencyLabel = QLabel("Paste latency")
+
+        latencyField = QPlainTextEdit()
+        latencyField.setReadOnly(True)
+        latencyField.setLineWrapMode(QPlainTextEdit.NoWrap)
+        latencyFont = QFont("Consolas")
+        latencyFont.setStyleHint(QFont.TypeWriter)
+        latencyField.setFont(latencyFont)
+
+        refreshLatencyButton = QPushButton("Refresh")
+        dumpLatencyButton = QPushButton("Save to %s" % LATENCY_FILE)
+
         # Add preference elements to body layout
         bodyLayout.addWidget(historyLengthLabel, 1, 0)
         bodyLayout.addWidget(historyLengthField, 1, 1)
@@ -94,10 +110,18 @@ class Main(QWidget):
         bodyLayout.addWidget(holdTimeLabel, 2, 0)
         bodyLayout.addWidget(holdTimeField, 2, 1)
 
-        bodyLayout.addWidget(clipboardPollIntervalLabel, 3, 0)
-        bodyLayout.addWidget(clipboardPollIntervalField, 3, 1)
+        bodyLayout.addWidget(clipboardPollIntervalMinLabel, 3, 0)
+        bodyLayout.addWidget(clipboardPollIntervalMinField, 3, 1)
+
+        bodyLayout.addWidget(clipboardPollIntervalMaxLabel, 4, 0)
+        bodyLayout.addWidget(clipboardPollIntervalMaxField, 4, 1)
+
+        bodyLayout.addWidget(savePreferencesButton, 5, 0, 1, 2)
 
-        bodyLayout.addWidget(savePreferencesButton, 4, 0, 1, 2)
+        bodyLayout.addWidget(latencyLabel, 6, 0, 1, 2)
+        bodyLayout.addWidget(latencyField, 7, 0, 1, 2)
+        bodyLayout.addWidget(refreshLatencyButton, 8, 0)
+        bodyLayout.addWidget(dumpLatencyButton, 8, 1)
 
         bodyLayout.setColumnStretch(1, 1)
         bodyLayout.setColumnStretch(0, 10)
@@ -111,7 +135,7 @@ class Main(QWidget):
         self.layout().setContentsMargins(0, 0, 0, 0)
         self.layout().setAlignment(Qt.AlignTop)
 
-        self.resize(350, self.minimumSizeHint().height())
+        self.resize(450, self.minimumSizeHint().height())
 
         # Create the system tray icon
         trayIcon = QSystemTrayIcon(QIcon("icon.png"), parent=self)
@@ -136,10 +160,29 @@ class Main(QWidget):
         # Preferences
         savePreferencesButton.clicked.connect(self.savePreferences)
 
+        # Paste latency
+        refreshLatencyButton.clicked.connect(self.refreshLatency)
+        dumpLatencyButton.clicked.connect(self.dumpLatency)
+
         # Store fields for access across the class
         self.historyLengthField = historyLengthField
         self.holdTimeField = holdTimeField
-        self.clipboardPollIntervalField = clipboardPollIntervalField
+        self.clipboardPollIntervalMinField = clipboardPollIntervalMinField
+        self.clipboardPollIntervalMaxField = clipboardPollIntervalMaxField
+        self.latencyField = latencyField
+
+        self.refreshLatency()
+
+    def showConfig(self, _config):
+        '''Displays the passed in preferences in the fields.
+
+        Args:
+            _config: Preferences as a config.Config snapshot.
+        '''
+        self.historyLengthField.setValue(_config.history_length)
+        self.holdTimeField.setValue(_config.hold_before_showing)
+        self.clipboardPollIntervalMinField.setValue(_config.poll_clipboard_interval_min)
+        self.clipboardPollIntervalMaxField.setValue(_config.poll_clipboard_interval_max)
 
     def trayIconActivated(self, reason):
         '''Handles activating the window from the system tray.
@@ -154,21 +197,37 @@ class Main(QWidget):
         '''Saves the current preferences to the config file.
 
         After the preferences are saved the updatePreferences signal is
-        emitted, which triggers an update on all other parts of the program
+        emitted, which makes them the current config, used by all other
+        parts of the program
 
         - the Paste widget
-        - the clipboard monitoring thread
+        - the clipboard monitoring and retention tasks
         - the hotkey thread
         '''
-        newSettings = {}
+        # Start from the current config file, so preferences which are
+        # not exposed in the UI are preserved
+        newSettings = config.parse()
         newSettings["history_length"] = self.historyLengthField.value()
         newSettings["hold_before_showing"] = self.holdTimeField.value()
-        newSettings["poll_clipboard_interval"] = self.clipboardPollIntervalField.value()
+        newSettings["poll_clipboard_interval_min"] = self.clipboardPollIntervalMinField.value()
+        newSettings["poll_clipboard_interval_max"] = self.clipboardPollIntervalMaxField.value()
 
         config.save(newSettings)
 
         self.updatePreferences.emit()
 
+    def refreshLatency(self):
+        '''Displays the current statistics of the stages of pasting.
+        '''
+        self.latencyField.setPlainText(tracing.formatSummary())
+
+    def dumpLatency(self):
+        '''Writes the current statistics of the stages of pasting to
+        LATENCY_FILE, next to the config file.
+        '''
+        self.refreshLatency()
+        tracing.dump(LATENCY_FILE)
+
     def _show(self):
         '''Handles toggling visibility of the widget.
 
@@ -178,6 +237,7 @@ class Main(QWidget):
         the widget.
         '''
         if not self.isVisible():
+            self.refreshLatency()
             self.activateWindow()
             QTimer.singleShot(100, self.showNormal)
         else:
@@ -1,9 +1,25 @@
 from PySide.QtGui import *
 from PySide.QtCore import *
 
-from functools import partial
+from .. import tracing
+from ..history import LocalHistory
+from historyModel import HistoryModel
 
-from .. import clipboard
+
+class HistoryView(QListView):
+    '''The list displaying the clipboard history in the Paste widget.
+
+    Wheel events are passed on to the Paste widget, which uses them for
+    changing the selection instead of scrolling.
+    '''
+
+    def wheelEvent(self, e):
+        '''Ignores the wheel event, so it propagates to the parent widget.
+
+        Args:
+            e: the event
+        '''
+        e.ignore()
 
 
 class Paste(QWidget):
@@ -14,7 +30,16 @@ class Paste(QWidget):
     for longer than the value specified in the config for "hold_before_showing".
 
     The mouse wheel can be used to scroll through the list and select different
-    entries.
+    entries. Scrolling past the end of the list loads older entries.
+
+    Typing while the widget is visible filters the list down to the entries
+    containing the typed words. The search runs on the search thread, and
+    only the results of the latest query are displayed. Backspace removes the
+    last typed character and Escape clears the filter.
+
+    Pressing Insert pins or unpins the selected entry. The pinned entries
+    are listed at the top, above the latest history_length entries, and
+    are never deleted by the retention policies.
 
     Once the "ctrl+v" hotkey is released, the widget is hidden and the currently
     selected item is pasted.
@@ -22,11 +47,13 @@ class Paste(QWidget):
     Attributes:
         showPaste: a custom signal which triggers the visibility of the widget.
         hidePaste: a custom signal which hides the widget
+        showResults: a custom signal which displays the results of a search
     '''
-    showPaste = Signal(list)
+    showPaste = Signal(object)
     hidePaste = Signal()
+    showResults = Signal(int, object)
 
-    def __init__(self, _config=None):
+    def __init__(self, _config=None, searcher=None, history=None):
         '''Constructs the widget.
 
         We set the needed flags and attributes and we build the
@@ -36,13 +63,20 @@ class Paste(QWidget):
         correct length when displaying the history.
 
         Args:
-            _config: Preferences as a dictionary.
+            _config: Preferences as a config.Config snapshot.
+            searcher: The search.Searcher used for filtering the history (default: {None})
+            history: The history.LocalHistory or daemon.DaemonClient to read
+            and paste the history through (default: {None})
         '''
         super(Paste, self).__init__()
 
+        self.searcher = searcher
+        self.history = history if history is not None else LocalHistory()
+
         # Connect custom signals
         self.showPaste.connect(self.showAndPopulate)
         self.hidePaste.connect(self.hide)
+        self.showResults.connect(self.showSearchResults)
 
         # Set flags and attributes
         self.setWindowFlags(Qt.Tool | Qt.WindowStaysOnTopHint | Qt.FramelessWindowHint)
@@ -50,10 +84,12 @@ class Paste(QWidget):
         self.setAttribute(Qt.WA_ShowWithoutActivating)
 
         # States and storage
-        self.buttons = []
         self.wheelScrolled = False
-        self.active = None
-        self.previousData = []
+        self.version = None
+        self.latest = []
+        self.pinned = ()
+        self.query = u""
+        self.searchGeneration = None
 
         # Build the ui elements
         self.buildUI()
@@ -61,10 +97,6 @@ class Paste(QWidget):
         # Handle preferences
         self.initConfig(_config)
 
-        # Apply stylesheet
-        with open("vsClipboard/ui/styles.css", "r") as f:
-            self.setStyleSheet(f.read())
-
     def focusNextPrevChild(self, down):
         '''This event is called when pressing the Up and Down arrow keys.
         
@@ -98,136 +130,227 @@ class Paste(QWidget):
         self.layout().setContentsMargins(0, 0, 0, 0)
         self.layout().setSpacing(0)
 
-    def showAndPopulate(self, data):
-        '''Receives the clipboard history, displays it and shows the widget.
+        # Only the visible rows of the list are ever drawn, no matter
+        # how many entries are loaded
+        self.model = HistoryModel(self.history, self)
+
+        self.view = HistoryView(self)
+        self.view.setModel(self.model)
+        self.view.setFocusPolicy(Qt.NoFocus)
+        self.view.setUniformItemSizes(True)
+        self.view.setWordWrap(True)
+        self.view.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.view.setIconSize(QSize(self.model.rowSize.height() * 2, self.model.rowSize.height() - 10))
+        self.view.clicked.connect(self.itemClicked)
 
-        This function grabs the latest :preferences["history_length"] elements
-        from the clipboard history and displays them. If there hasn't been a
-        change then this function shows the widget and returns early.
+        # Displays what has been typed so far
+        self.searchLabel = QLabel(self)
+        self.searchLabel.hide()
+
+        self.layout().addWidget(self.searchLabel)
+        self.layout().addWidget(self.view)
+
+    def populate(self, snapshot):
+        '''Displays the pinned entries followed by the latest
+        :preferences["history_length"] entries of the clipboard history.
+
+        Anything typed the last time the widget was shown is cleared.
 
         Args:
-            data: The clipboard history
+            snapshot: The cached clipboard history as a cache.HistorySnapshot
         '''
-        # Grab the latest chunk of the history
-        data = data[-self.historyLength:] if len(data) >= self.historyLength \
-            else data
-        data = list(reversed(data))
+        # Grab the pinned entries and the latest chunk of the history, without
+        # listing the pinned entries twice
+        self.pinned = snapshot.pinned
+        pinnedHashes = set(entry["hash"] for entry in self.pinned)
+        self.latest = [entry for entry in snapshot.entries[:self.historyLength]
+                       if entry["hash"] not in pinnedHashes]
+
+        self.version = snapshot.version
+        self.query = u""
+        self.searchGeneration = None
+        self.searchLabel.hide()
+        self.model.setPinned(pinnedHashes)
+        self.model.reset(self.latest, pinned=self.pinned)
+
+    def showAndPopulate(self, snapshot):
+        '''Receives the clipboard history, displays it and shows the widget.
 
-        # Check if we even need to rebuild the list
-        if data == self.previousData:
+        If the version of the history is the same as the one displayed, then
+        this function shows the widget and returns early.
+
+        Args:
+            snapshot: The cached clipboard history as a cache.HistorySnapshot
+        '''
+        tracing.sinceMark("showPaste", "show_paste_signal")
+
+        with tracing.span("paste_rebuild"):
+            # Check if we even need to rebuild the list
+            if snapshot.version == self.version and not self.query:
+                self.show()
+                self.activateWindow()
+                return
+
+            # If there has been a change in the clipboard history then
+            # display the new data
+            self.populate(snapshot)
+
+            # Since there has been a change in the clipboard history we need to
+            # select the latest clipboard item and clean up the wheelScrolled state
+            self.wheelScrolled = False
+            self.select(0)
             self.show()
             self.activateWindow()
+
+    def togglePin(self):
+        '''Pins the selected entry, or unpins it if it is already pinned.
+
+        Unless the history is being searched, the list is rebuilt straight
+        away, keeping the entry selected.
+        '''
+        row = self.currentRow()
+        if row < 0:
             return
 
-        # If there has been a change in the clipboard history then release the
-        # currently active item and store the new data
-        self.active = None
-        self.previousData = data
-
-        self.deselect()
-
-        # Clean the list
-        for each in self.buttons:
-            self.layout().removeWidget(each)
-            each.deleteLater()
-
-        self.buttons = []
-
-        # Build the new list
-        for each in data:
-            # As nothing else but text is currently supported, we need to check
-            # the data type in order to pick the correct portion to display
-            text = each["unicode"] if each["unicode"] else each["text"]
-            if each["hasFile"]:
-                text = text[0]
-
-            # Clean up the text to be displayed nicely in the ui
-            # - strip out leading and multiple spaces
-            # - clamp the length to a 100 characters
-            # - limit the new lines to 2
-            text = text.strip().lstrip()
-            text = text[:100] + "..." if len(text) > 100 else text
-            text = "\n".join(text.split("\n")[:2]) + "..." \
-                if len(text.split("\n")) > 2 else text
-
-            # Add new button and connect it to the self.buttonClicked function
-            # to handle it
-            self.buttons.append(QPushButton(text, self))
-            self.buttons[-1].setSizePolicy(
-                QSizePolicy(QSizePolicy.Preferred, QSizePolicy.Preferred))
-            self.buttons[-1].clicked.connect(
-                partial(self.buttonClicked, each, self.buttons[-1]))
-            self.layout().addWidget(self.buttons[-1])
-
-        # Since there has been a change in the clipboard history we need to
-        # select the latest clipboard item and clean up the wheelScrolled state
-        self.wheelScrolled = False
+        entry = self.model.entry(row)
+        if entry["hash"] in self.model.pinnedHashes:
+            self.history.unpin(entry)
+        else:
+            self.history.pin(entry)
+
+        snapshot = self.history.snapshot()
+        if self.query:
+            self.model.setPinned(each["hash"] for each in snapshot.pinned)
+            return
+
+        self.populate(snapshot)
+        for row in range(self.model.rowCount()):
+            if self.model.entry(row)["hash"] == entry["hash"]:
+                self.select(row)
+                break
+        else:
+            self.select(0)
+
+    def setQuery(self, query):
+        '''Filters the displayed history by the passed in text.
+
+        The search itself runs on the search thread and its results are
+        displayed by showSearchResults. If the query is empty, the latest
+        entries are displayed again.
+
+        Args:
+            query: The text typed by the user
+        '''
+        self.query = query
+        self.searchLabel.setText(query)
+        self.searchLabel.setVisible(bool(query))
+
+        if query.strip() and self.searcher is not None:
+            self.searchGeneration = self.searcher.search(query, self.showResults.emit)
+            return
+
+        self.searchGeneration = None
+        self.model.reset(self.latest, pinned=self.pinned)
         self.select(0)
-        self.show()
-        self.activateWindow()
 
-    def deselect(self):
-        '''Deselects the currently active item.
+    def showSearchResults(self, generation, entries):
+        '''Displays the results of a search, unless a newer one has been started
+        since.
 
-        All this means is we remove the "selected" objectName and force a 
-        recalculation of the styleSheet so the change is reflected.
+        Args:
+            generation: The generation of the query as returned by Searcher.search
+            entries: A list of the matching clipboard history entries, newest first
         '''
-        if self.active:
-            self.active.setObjectName("")
-            self.active.setStyleSheet("")
-            self.active = None
+        if generation != self.searchGeneration:
+            return
 
-    def select(self, buttonId):
-        '''Apply the selected colour to the button corresponding to buttonId
+        self.model.reset(entries, complete=True)
+        self.select(0)
+
+    def keyPressEvent(self, e):
+        '''Override of the default key press event, so typing filters the
+        clipboard history.
 
-        We apply the "selected" objectName, which acts as a CSS class and 
-        force a recalculation of the styleSheet.
+        As the widget is shown while "ctrl + v" is held, letters and digits
+        typed together with ctrl are taken as they are.
 
         Args:
-            buttonId: Which element of the buttons list to be "selected"
+            e: the event
         '''
-        if not self.buttons:
+        key = e.key()
+        if key == Qt.Key_Backspace:
+            self.setQuery(self.query[:-1])
+        elif key == Qt.Key_Escape:
+            self.setQuery(u"")
+        elif key == Qt.Key_Insert:
+            self.togglePin()
+        elif e.modifiers() & Qt.ControlModifier and (Qt.Key_A <= key <= Qt.Key_Z or Qt.Key_0 <= key <= Qt.Key_9):
+            self.setQuery(self.query + unichr(key).lower())
+        elif e.text() and e.text() >= u" ":
+            self.setQuery(self.query + e.text())
+        else:
+            return super(Paste, self).keyPressEvent(e)
+
+    def currentRow(self):
+        '''Returns the row of the currently selected item.
+
+        Returns:
+            The row or -1 if nothing is selected
+            int
+        '''
+        return self.view.currentIndex().row()
+
+    def select(self, row):
+        '''Selects the item in the specified row and scrolls to it.
+
+        Selecting past the end of the list loads older entries if there are
+        any, otherwise it wraps around to the other end.
+
+        Args:
+            row: Which row of the list to be selected
+        '''
+        if row >= self.model.rowCount() and not self.model.exhausted:
+            self.model.loadMore()
+
+        if not self.model.rowCount():
             return
 
-        self.active = self.buttons[buttonId % len(self.buttons)]
-        self.active.setObjectName("selected")
-        self.active.setStyleSheet("")
+        index = self.model.index(row % self.model.rowCount())
+        self.view.setCurrentIndex(index)
+        self.view.scrollTo(index)
 
-    def buttonClicked(self, data, button):
-        '''Applies the "selected" state to the specified button and sets the
-        clipboard to the data, so it can be pasted.
+    def itemClicked(self, index):
+        '''Applies the "selected" state to the specified item and sets the
+        clipboard to its data, so it can be pasted.
 
         Args:
-            data: The data coming from the clipboard history database
-            button: The button widget
+            index: The model index of the item
         '''
-        self.deselect()
-        self.select(self.buttons.index(button))
+        self.select(index.row())
 
-        clipboard.set(data)
+        self.history.set(self.model.entry(index.row()))
 
     def initConfig(self, config):
         '''Stores the history_length preference, so it can be reflected in the
         widget.
 
+        The displayed history is rebuilt the next time it is shown, so a
+        change of the length is reflected.
+
         Args:
-            config: The preferences as a dictionary
+            config: The preferences as a config.Config snapshot
         '''
-        self.historyLength = config["history_length"]
+        self.historyLength = config.history_length
+        self.version = None
 
     def selectNext(self):
         '''Selects the next entry in the clipboard history.'''
-        currentButtonIndex = self.buttons.index(self.active) if self.active else -1
-
-        self.deselect()
-        self.select(currentButtonIndex + 1)
+        self.select(self.currentRow() + 1)
 
     def selectPrevious(self):
         '''Selects the previous entry in the clipboard history.'''
-        currentButtonIndex = self.buttons.index(self.active) if self.active else -1
-
-        self.deselect()
-        self.select(currentButtonIndex - 1)
+        self.select(self.currentRow() - 1)
 
     def wheelEvent(self, e):
         '''Override of the default wheel event, so we can cycle through the
@@ -249,12 +372,13 @@ class Paste(QWidget):
 
     def hideEvent(self, e):
         '''Ovrride the default hide event, so we can handle applying the data
-        from the currently active element if it was specified by a wheel scroll.
+        from the currently active element if it was specified by a wheel scroll
+        or a search.
 
         Args:
             e: the event
         '''
-        if self.wheelScrolled and self.active:
-            self.active.clicked.emit()
+        if (self.wheelScrolled or self.query) and self.currentRow() >= 0:
+            self.itemClicked(self.view.currentIndex())
 
         return super(Paste, self).hideEvent(e)
@@ -0,0 +1,127 @@
+from PySide.QtGui import *
+from PySide.QtCore import *
+
+from collections import OrderedDict
+
+from .. import images
+
+
+MAX_BYTES = 32 * 1024 * 1024
+
+
+def _pixmapBytes(pixmap):
+    '''Returns the approximate memory used by a pixmap.
+
+    Args:
+        pixmap: The pixmap
+
+    Returns:
+        The size in bytes
+        int
+    '''
+    return pixmap.width() * pixmap.height() * 4
+
+
+class _LoadThumbnail(QRunnable):
+    '''Reads the thumbnail of an image on one of the threads of the pool.
+    '''
+
+    def __init__(self, path, loaded):
+        '''Constructs the task.
+
+        Args:
+            path: The path of the image
+            loaded: The signal to emit with the path and the read QImage
+        '''
+        super(_LoadThumbnail, self).__init__()
+        self.path = path
+        self.loaded = loaded
+
+    def run(self):
+        '''Reads the thumbnail, or creates it from the image if it is missing.
+        '''
+        image = QImage(images.thumbnailPath(self.path))
+        if image.isNull():
+            image = QImage(self.path)
+            if not image.isNull():
+                image = image.scaled(images.THUMBNAIL_SIZE, images.THUMBNAIL_SIZE,
+                                     Qt.KeepAspectRatio, Qt.SmoothTransformation)
+        self.loaded.emit(self.path, image)
+
+
+class ThumbnailCache(QObject):
+    '''The decoded thumbnails of the images in the clipboard history.
+
+    Thumbnails which are not cached yet are read in the global QThreadPool,
+    so displaying the history never waits on reading images. Once a
+    thumbnail is read, the thumbnailLoaded signal is emitted with the
+    path of its image.
+
+    The least recently used thumbnails are evicted once the cached
+    thumbnails take up more than maxBytes.
+
+    Attributes:
+        thumbnailLoaded: a custom signal emitted once a thumbnail has been read
+    '''
+    thumbnailLoaded = Signal(object)
+    _loaded = Signal(object, object)
+
+    def __init__(self, maxBytes=MAX_BYTES, parent=None):
+        '''Constructs an empty cache.
+
+        Args:
+            maxBytes: The maximum size of the cached thumbnails (default: {MAX_BYTES})
+            parent: The parent object (default: {None})
+        '''
+        super(ThumbnailCache, self).__init__(parent)
+
+        self.maxBytes = maxBytes
+        self.totalBytes = 0
+
+        self._thumbnails = OrderedDict()
+        self._pending = set()
+
+        self._loaded.connect(self._store)
+
+    def get(self, path):
+        '''Returns the thumbnail of an image, reading it in the background if
+        it is not cached.
+
+        Args:
+            path: The path of the image
+
+        Returns:
+            The thumbnail or None if it is not read yet
+            QPixmap
+        '''
+        pixmap = self._thumbnails.pop(path, None)
+        if pixmap is not None:
+            self._thumbnails[path] = pixmap
+            return pixmap
+
+        if path not in self._pending:
+            self._pending.add(path)
+            QThreadPool.globalInstance().start(_LoadThumbnail(path, self._loaded))
+        return None
+
+    def _store(self, path, image):
+        '''Caches a thumbnail which has been read, evicting the least recently
+        used ones.
+
+        Args:
+            path: The path of the image
+            image: The thumbnail
+        '''
+        self._pending.discard(path)
+        if image.isNull():
+            return
+
+        pixmap = QPixmap.fromImage(image)
+        self._thumbnails[path] = pixmap
+        self.totalBytes += _pixmapBytes(pixmap)
+
+        while self.totalBytes > self.maxBytes and len(self._thumbnails) > 1:
+            _, evicted = self._thumbnails.popitem(last=False)
+            self.totalBytes -= _pixmapBytes(evicted)
+
+        self.thumbnailLoaded.emit(path)
@@ -0,0 +1,206 @@
+'''Writing clipboard history entries to the database in the background.
+
+Instead of writing every entry as soon as it is captured, the entries are
+put in a bounded queue and written by a task, see the tasks module, which
+runs on the same loop as the clipboard polling and is spawned once there
+is something to write. Everything that gets queued before the task gets
+to run is written in the same commit, so bursts of copies result in a
+single commit. The database uses write-ahead logging without a full sync
+on every commit, so committing does not hold up the polling for long.
+
+If the database falls so far behind that the queue fills up, new entries
+are dropped instead of blocking the monitoring task.
+
+If a batch can not be written, e.g. because the database is locked or
+the disk is failing, it is retried a few times, waiting longer after
+every attempt, before it is given up on. The other tasks keep running
+while the task waits to retry.
+
+Attributes:
+    MAX_ATTEMPTS: How many times a batch is tried to be written
+    RETRY_DELAY: How long (in seconds) to wait before the first retry,
+    doubled after every attempt
+'''
+import Queue
+import logging
+import threading
+import time
+
+import database
+
+
+MAX_ATTEMPTS = 5
+
+RETRY_DELAY = .1
+
+
+class Writer(object):
+    '''A write-behind queue for the clipboard history.
+
+    The entries are put in the queue and written by the flush task on the
+    thread of the tasks.TaskLoop.
+
+    Attributes:
+        queued: The number of entries put in the queue
+        flushed: The number of entries written to the database
+        dropped: The number of entries dropped because the queue was full
+        failed: The number of entries dropped because they could not be written
+        lastHash: The hash of the latest queued entry
+    '''
+
+    def __init__(self, tasks, maxQueued=1000, batchSize=100):
+        '''Constructs the writer with an empty queue.
+
+        Args:
+            tasks: The tasks.TaskLoop the entries are written on
+            maxQueued: The maximum number of entries waiting to be written (default: {1000})
+            batchSize: The maximum number of entries written in one commit (default: {100})
+        '''
+        self._queue = Queue.Queue(maxQueued)
+        self.tasks = tasks
+        self.batchSize = batchSize
+
+        self._lock = threading.Lock()
+        self._flushing = False
+        self._batch = []
+
+        self.queued = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.failed = 0
+        self.lastHash = None
+
+    def put(self, data, dataHash=None):
+        '''Queues the passed in data to be written to the database.
+
+        This never blocks.
+
+        Args:
+            data: A dictionary representing a clipboard history entry
+            dataHash: The hash of the data, if already known (default: {None})
+
+        Returns:
+            True if the data has been queued, False if it has been dropped
+            bool
+        '''
+        try:
+            self._queue.put_nowait((data, time.time()))
+        except Queue.Full:
+            self.dropped += 1
+            logging.error("Clipboard history write queue is full. Dropped entry.")
+            return False
+
+        self.queued += 1
+        self.lastHash = dataHash or database.hashData(data)
+
+        with self._lock:
+            spawn = not self._flushing
+            self._flushing = True
+        if spawn:
+            self.tasks.spawn(self.flush)
+        return True
+
+    def latestHash(self):
+        '''Returns the hash of the newest entry in the history, including
+        entries which are not written yet.
+
+        Returns:
+            The hash of the newest entry or None if the history is empty
+            str
+        '''
+        return self.lastHash or database.latestHash()
+
+    def stats(self):
+        '''Returns the counters of the writer.
+
+        Returns:
+            A dictionary with the "queued", "flushed", "dropped", "failed" and
+            "pending" number of entries
+            dict
+        '''
+        return {
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "pending": self._queue.qsize()
+        }
+
+    def _take(self):
+        '''Takes up to batchSize entries from the queue, without blocking.
+
+        Returns:
+            A list of (data, created) tuples
+            list
+        '''
+        batch = []
+        while len(batch) < self.batchSize:
+            try:
+                batch.append(self._queue.get_nowait())
+            except Queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        '''Writes a batch of entries, retrying if it fails.
+
+        Yields the times to wait before retrying, so it can be run as part
+        of a task.
+
+        Args:
+            batch: A list of (data, created) tuples
+        '''
+        delay = RETRY_DELAY
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                database.writeMany(batch)
+            except Exception:
+                logging.exception("Writing %d clipboard history entries failed (attempt %d of %d)"
+                                  % (len(batch), attempt, MAX_ATTEMPTS))
+                if attempt < MAX_ATTEMPTS:
+                    yield delay
+                    delay *= 2
+                continue
+
+            self.flushed += len(batch)
+            return
+
+        self.failed += len(batch)
+        logging.error("Gave up on writing %d clipboard history entries" % len(batch))
+
+    def flush(self):
+        '''Writes the queued entries to the database a batch at a time.
+
+        This is a task run by a tasks.TaskLoop, spawned by put and finishing
+        once the queue is empty.
+        '''
+        while True:
+            self._batch = self._take()
+            if not self._batch:
+                with self._lock:
+                    if self._queue.empty():
+                        self._flushing = False
+                        return
+                continue
+
+            for delay in self._write(self._batch):
+                yield delay
+            self._batch = []
+
+            # Let the other tasks run in between batches
+            yield 0
+
+    def close(self):
+        '''Writes everything left in the queue, including a batch which was
+        waiting to be retried.
+
+        It is called once the tasks.TaskLoop has stopped, as the flush task
+        is cancelled with it.
+        '''
+        batch, self._batch = self._batch + self._take(), []
+        while batch:
+            for delay in self._write(batch):
+                time.sleep(delay)
+            batch = self._take()
+
+        logging.info("Clipboard history writer stopped %s" % self.stats())